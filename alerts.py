@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class AlertRule:
+
+    """
+    A threshold on one metric, with hysteresis and a cooldown.
+
+    The rule fires when the metric crosses `threshold` and only clears once it is back
+    past `threshold -/+ hysteresis`, so a value hovering around the threshold fires once.
+
+    Attributes:
+      name (str): Unique name of the rule.
+      metric (str): Key of the sample value the rule watches.
+      threshold (float): Value at which the rule fires.
+      above (bool): True to fire above the threshold, False to fire below it.
+      hysteresis (float): Distance back from the threshold needed to clear the alert.
+      cooldown (float): Minimum seconds between two notifications of this rule.
+      message (str): Text of the alert, formatted with `value` and `threshold`.
+    """
+
+    def __init__(self, name, metric, threshold, above=True, hysteresis=0.0, cooldown=900, message=None):
+        self.name = name
+        self.metric = metric
+        self.threshold = threshold
+        self.above = above
+        self.hysteresis = hysteresis
+        self.cooldown = cooldown
+        self.message = message or f"{metric} is {{value:.1f}} ({'above' if above else 'below'} {{threshold}})"
+
+        self.active = False
+        self.last_notified = float("-inf")
+
+    def fires(self, value) -> bool:
+        return value > self.threshold if self.above else value < self.threshold
+
+    def clears(self, value) -> bool:
+        if self.above:
+            return value <= self.threshold - self.hysteresis
+        return value >= self.threshold + self.hysteresis
+
+
+class AlertEngine:
+
+    """
+    Evaluates alert rules against every new sample as it is published.
+
+    Only the rules watching a metric present in the sample are evaluated, and every
+    rule keeps its own state, so a sample costs a dictionary lookup per value
+    instead of a poll of the whole system.
+    Samples may come from several threads (sensor sampler, system metrics collector).
+
+    Attributes:
+      notify (callable): Called with the alert text whenever a rule fires or clears.
+    """
+
+    def __init__(self, rules, notify):
+        """
+        Args:
+            rules (list of AlertRule): The rules to evaluate.
+            notify (callable): Called with the alert text whenever a rule fires or clears.
+        """
+        self.notify = notify
+        self._rules = {}
+        for rule in rules:
+            self._rules.setdefault(rule.metric, []).append(rule)
+        self._lock = threading.Lock()
+
+    def evaluate(self, sample, now=None) -> None:
+        """
+        Update the rules watching the metrics of `sample`.
+
+        Args:
+            sample (dict): Metric name -> value, missing or None values are skipped.
+            now (float): Time of the sample, defaults to time.monotonic().
+        """
+        now = time.monotonic() if now is None else now
+        messages = []
+        with self._lock:
+            for metric, value in sample.items():
+                if value is None or value != value:  # skip missing and NaN values
+                    continue
+                for rule in self._rules.get(metric, ()):
+                    if not rule.active and rule.fires(value):
+                        rule.active = True
+                        if now - rule.last_notified >= rule.cooldown:
+                            rule.last_notified = now
+                            messages.append("⚠️ " + rule.message.format(value=value, threshold=rule.threshold))
+                    elif rule.active and rule.clears(value):
+                        rule.active = False
+                        logger.info(f"Alert {rule.name} cleared at {value:.1f}.")
+        for message in messages:
+            logger.warning(f"Alert: {message}")
+            self.notify(message)
+
+
+class TelegramAlertNotifier:
+
+    """
+    Pushes alerts to Telegram users through the bot's job queue.
+
+    Alerts arriving within `coalesce_window` seconds are sent as one message, and
+    every user gets at most one message per `min_interval` seconds; alerts raised
+    in between are held back and delivered together.
+
+    Attributes:
+      user_ids (iterable): Telegram ids of the users receiving the alerts.
+      coalesce_window (float): Seconds to wait for further alerts before sending.
+      min_interval (float): Minimum seconds between two messages to the same user.
+    """
+
+    def __init__(self, job_queue, user_ids, coalesce_window=10, min_interval=60):
+        """
+        Args:
+            job_queue (telegram.ext.JobQueue): The job queue of the running Application.
+            user_ids (iterable): Telegram ids of the users receiving the alerts.
+            coalesce_window (float): Seconds to wait for further alerts before sending.
+            min_interval (float): Minimum seconds between two messages to the same user.
+        """
+        self.job_queue = job_queue
+        self.user_ids = set(user_ids)
+        self.coalesce_window = coalesce_window
+        self.min_interval = min_interval
+
+        self._lock = threading.Lock()
+        self._pending = {user_id: [] for user_id in self.user_ids}
+        self._last_sent = {user_id: float("-inf") for user_id in self.user_ids}
+        self._scheduled = False
+
+    def __call__(self, message) -> None:
+        """
+        Queue an alert. Safe to call from any thread.
+        """
+        with self._lock:
+            for messages in self._pending.values():
+                messages.append(message)
+            self._schedule(self.coalesce_window)
+
+    def _schedule(self, delay) -> None:
+        # called with self._lock held, one flush job at a time
+        if not self._scheduled:
+            self._scheduled = True
+            self.job_queue.run_once(self._flush, max(delay, 0), name="alert-flush")
+
+    async def _flush(self, context) -> None:
+        now = time.monotonic()
+        batches = {}
+        with self._lock:
+            self._scheduled = False
+            wait = None
+            for user_id, messages in self._pending.items():
+                if not messages:
+                    continue
+                remaining = self._last_sent[user_id] + self.min_interval - now
+                if remaining > 0:
+                    wait = remaining if wait is None else min(wait, remaining)
+                    continue
+                batches[user_id] = messages[:]
+                messages.clear()
+                self._last_sent[user_id] = now
+            if wait is not None:
+                # rate limited users get everything held back in one message later
+                self._schedule(wait)
+
+        for user_id, messages in batches.items():
+            text = "\n".join(messages)
+            if len(messages) > 1:
+                text = f"{len(messages)} alerts:\n{text}"
+            try:
+                await context.bot.send_message(chat_id=user_id, text=text)
+            except Exception as e:
+                logger.error(f"Failed to send alert to {user_id}: {e}")
@@ -0,0 +1,279 @@
+"""
+Off-device benchmark of the bot, using the fake BME680 driver and the fake Bot API.
+
+Runs in a scratch directory with a synthetic database and writes the results as JSON:
+
+    python3 benchmark.py --rows 200000 --out bench_results.json
+
+Every latency is reported as percentiles in milliseconds, so two result files can be
+compared to spot regressions.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# the bot modules are imported from the repository, whatever the working directory is
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+BENCH_USER = 424242
+
+
+def summarize(samples) -> dict:
+    """
+    Percentiles in milliseconds of a list of durations in seconds.
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def make_database(db_name, rows, interval) -> None:
+    """
+    Create a database with `rows` synthetic readings, one every `interval` seconds up to now.
+    """
+    from migrate_db import migrate
+    from db_handler import DataBaseHandler
+
+    migrate(db_name)
+    db = DataBaseHandler(db_name, batch_size=10000)
+    now = time.time()
+    for i in range(rows):
+        ts = now - (rows - i) * interval
+        db.insert_sensor_data({"timestamp": ts,
+                               "temperature": 22 + 3 * random.random(),
+                               "humidity": 45 + 10 * random.random()})
+    db.close()
+
+
+def bench_insert(db_name, count) -> dict:
+    """
+    insert_sensor_data rate with a commit per reading and with batched commits.
+    """
+    from db_handler import DataBaseHandler
+
+    results = {}
+    for batch_size in (1, 100):
+        db = DataBaseHandler(db_name, batch_size=batch_size)
+        start = time.perf_counter()
+        for _ in range(count):
+            db.insert_sensor_data({"temperature": 22.0, "humidity": 45.0})
+        db.flush()
+        elapsed = time.perf_counter() - start
+        db.close()
+        results[f"batch_{batch_size}"] = {"rows": count, "rows_per_s": round(count / elapsed, 1)}
+    return results
+
+
+def bench_render(hours_list, repeats) -> dict:
+    """
+    render_graph time and PNG size per range, rendered in this process.
+    """
+    from graph import render_graph
+
+    results = {}
+    for hours in hours_list:
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            png = render_graph(hours)
+            samples.append(time.perf_counter() - start)
+        results[f"{hours}h"] = dict(summarize(samples), png_bytes=len(png))
+    return results
+
+
+def bench_stabilize(stabilization_time, read_interval, latency, unstable_rate) -> dict:
+    """
+    Wall time of stabilize_sensor with a fake sensor of the given measurement latency.
+
+    Raises:
+        RuntimeError: If the burn-in collected no gas reading, its duration would mean nothing.
+    """
+    import fake_bme680
+    from sensormain import SensorManager
+
+    fake_bme680.configure(latency=latency, unstable_rate=unstable_rate)
+    manager = SensorManager(stabilization_time, read_interval, sample_interval=0, baseline_path=None,
+                            driver=fake_bme680)
+    start = time.perf_counter()
+    manager.stabilize_sensor()
+    elapsed = time.perf_counter() - start
+    manager.stop_sampler()
+    if not manager.is_stabilized or manager.gas_baseline <= 0:
+        raise RuntimeError("stabilize_sensor collected no gas reading, the gas baseline is missing.")
+    return {"stabilization_time_s": stabilization_time, "read_interval_s": read_interval,
+            "elapsed_s": round(elapsed, 3), "gas_baseline": round(manager.gas_baseline, 1),
+            "gas_readings": manager._baseline_samples}
+
+
+def bench_import(repeats) -> dict:
+    """
+    Time to import the bot module in a fresh interpreter, the fixed cost of every (re)start.
+    """
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import botmain"], cwd=REPO_DIR, check=True)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+class BotRunner:
+
+    """
+    Runs the real Application against the fake Bot API on a background event loop.
+    """
+
+    def __init__(self, api, sensors):
+        import botmain
+        self.application = botmain.build_application("123456:BENCH", sensors, base_url=api.url)
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), daemon=True)
+
+    async def _run(self):
+        application = self.application
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            await application.updater.start_polling(poll_interval=0, timeout=1)
+            self._ready.set()
+            await asyncio.to_thread(self._stop.wait)
+            await application.updater.stop()
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+    def __enter__(self):
+        self._thread.start()
+        self._ready.wait(30)
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join(30)
+
+
+def bench_commands(api, commands, concurrency) -> dict:
+    """
+    Send every command in `commands` through the fake Bot API, `concurrency` at a time,
+    and measure the time until the bot's reply arrives.
+    """
+    latencies = []
+    failures = 0
+    chat_ids = iter(range(10**6, 2 * 10**6))
+    start = time.perf_counter()
+    for offset in range(0, len(commands), concurrency):
+        wave = [(next(chat_ids), text) for text in commands[offset:offset + concurrency]]
+        sent = {chat_id: api.push_command(text, chat_id, BENCH_USER) for chat_id, text in wave}
+        for chat_id, _ in wave:
+            reply = api.wait_reply(chat_id, timeout=120)
+            if reply is None:
+                failures += 1
+            else:
+                latencies.append(reply.received_at - sent[chat_id])
+    elapsed = time.perf_counter() - start
+    return dict(summarize(latencies), failures=failures, concurrency=concurrency,
+                throughput_per_s=round(len(latencies) / elapsed, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="synthetic readings in the database")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between synthetic readings")
+    parser.add_argument("--requests", type=int, default=200, help="/status requests sent through the bot")
+    parser.add_argument("--concurrency", type=int, default=10, help="requests in flight at once")
+    parser.add_argument("--sensor-latency", type=float, default=0.15, help="fake measurement time in seconds")
+    parser.add_argument("--out", default=os.path.join(REPO_DIR, "bench_results.json"), help="result file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # the bot reads its configuration from the environment when imported
+    os.environ["ALLOWED_USERS"] = str(BENCH_USER)
+    os.environ.setdefault("SAMPLE_INTERVAL", "3600")
+    os.environ.setdefault("SYSTEM_METRICS_INTERVAL", "3600")
+    # the cold /graph numbers are only cold without the background warm-up
+    os.environ.setdefault("GRAPH_WARMUP", "0")
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="picontrolbot-bench-")
+    os.chdir(workdir)
+
+    print(f"Building a database with {args.rows} rows in {workdir}")
+    start = time.perf_counter()
+    make_database("sensor_data.db", args.rows, args.interval)
+    results["build_database_s"] = round(time.perf_counter() - start, 3)
+
+    print("Benchmarking insert_sensor_data")
+    results["insert"] = bench_insert("insert_bench.db", 2000)
+
+    span_hours = args.rows * args.interval / 3600
+    hours_list = sorted({12, 24, 168, int(span_hours)})
+    print(f"Benchmarking render_graph for {hours_list} hours")
+    results["render_graph"] = bench_render(hours_list, repeats=3)
+
+    print("Benchmarking the bot import")
+    results["import_botmain"] = bench_import(repeats=5)
+
+    print("Benchmarking stabilize_sensor")
+    results["stabilize_sensor"] = bench_stabilize(5, 0.5, args.sensor_latency, unstable_rate=0.1)
+
+    import fake_bme680
+    from fake_bot_api import FakeBotAPI
+    from sensormain import SensorManager, SensorRegistry
+
+    fake_bme680.configure(latency=args.sensor_latency, unstable_rate=0.1)
+    sensor_manager = SensorManager(5, 1, sample_interval=1, baseline_path=None, driver=fake_bme680)
+    sensors = SensorRegistry([sensor_manager])
+    sensors.start_samplers()
+    sensor_manager.wait_for_reading(timeout=10)
+    api = FakeBotAPI().start()
+    try:
+        with BotRunner(api, sensors):
+            print(f"Benchmarking /status, {args.requests} requests")
+            results["status"] = bench_commands(api, ["/status"] * args.requests, args.concurrency)
+            print("Benchmarking /graph, cold cache")
+            graph_commands = [f"/graph {hours}" for hours in range(1, 2 * args.concurrency + 1)]
+            results["graph_cold"] = bench_commands(api, graph_commands, args.concurrency)
+            print("Benchmarking /graph, warm cache")
+            results["graph_warm"] = bench_commands(api, graph_commands, args.concurrency)
+    finally:
+        api.stop()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "rows": args.rows,
+        "results": results,
+    }
+    with open(args.out, "w") as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
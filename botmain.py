@@ -1,52 +1,160 @@
+import time
+# the startup report is measured from here, the imports below included
+STARTUP_BEGIN = time.perf_counter()
+
 from telegram import Update
-from telegram.ext import filters, MessageHandler, Application, CommandHandler, ContextTypes
+from telegram.ext import filters, MessageHandler, Application, CommandHandler, ContextTypes, TypeHandler
 from dotenv import load_dotenv
 import os
+import asyncio
 import logging
 import threading
 from functools import wraps
-from sensormain import SensorManager
-from datetime import datetime
+# the modules below import numpy inside the functions using it, the bot starts without loading it
+from sensormain import SensorManager, SensorRegistry, parse_sensor_specs
 from systeminfo import GetSystemInfo
-from data_filler import fill_database
-from graph import generate_graph
+from data_filler import fill_database, fill_system_metrics, fill_sensor_blocks
+from db_handler import DataBaseHandler, DEFAULT_SENSOR_ID
+from migrate_db import migrate
+from render_pool import GraphRenderPool, RenderQueueFull, RenderTimeout
+from graph_cache import GraphCache
+from telegram.error import BadRequest
+from alerts import AlertEngine, AlertRule, TelegramAlertNotifier
+from ring_buffer import SensorRingBuffer
+from retention import RetentionPolicy, run_retention
+from export import EXPORT_FORMATS, export_parts, parse_range
+from trend import build_trend
+from compression import ReadingCompressor, parse_tolerances
+from stats import build_stats
+import webhook
+import log_queue
+import metrics
+import connection_manager
 
 load_dotenv('credentials.env')
 
 # select only the specific users
 ALLOWED_USERS = set(map(int, os.getenv("ALLOWED_USERS","").split(',')))
+# users allowed to see the bot's internals (/metrics), all the allowed users if not set
+ADMIN_USERS = set(map(int, os.getenv("ADMIN_USERS").split(','))) if os.getenv("ADMIN_USERS") else ALLOWED_USERS
 
 
-# Ensure the 'logs/' directory exists
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
+# (step, seconds since STARTUP_BEGIN) of the startup, logged when the first update is handled
+startup_steps = []
 
-#create a unique filename for every running of the script
-log_filename = os.path.join(log_dir, datetime.now().strftime("log_%Y-%m-%d_%H-%M.log"))
+def startup_step(name) -> None:
+    """
+    Record that the startup step `name` just finished.
+    """
+    startup_steps.append((name, time.perf_counter() - STARTUP_BEGIN))
 
-# This part is for setting up logging module, so you will know when (and why) things don't work as expected:
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers = [
-        logging.StreamHandler(), # log to console
-        logging.FileHandler(log_filename, mode='w' ) # log to file
-    
-])
-# set higher logging level for httpx to avoid all GET and POST requests being logged
-logging.getLogger("httpx").setLevel(logging.WARNING)
+def startup_report() -> str:
+    """
+    Format the duration of every recorded startup step.
+    """
+    previous = 0.0
+    parts = []
+    for name, at in startup_steps:
+        parts.append(f"{name} {at - previous:.2f}s")
+        previous = at
+    return f"Startup took {previous:.2f}s: " + ", ".join(parts)
+
+def setup_logging():
+    """
+    Configure the root logger. Called from main() only, so the graph worker
+    processes that re-import this module do not open (and rotate) the log file.
+    Records are written by a background thread, see log_queue.py.
+    """
+    log_queue.setup(
+        os.getenv("LOG_FILE", os.path.join("logs", "bot.log")),
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        max_bytes=int(os.getenv("LOG_MAX_BYTES", 1024 * 1024)),
+        budget=int(os.getenv("LOG_DISK_BUDGET", 10 * 1024 * 1024)),
+        interval=float(os.getenv("LOG_ROTATE_INTERVAL", 86400)),
+        rate_limit=float(os.getenv("LOG_RATE_LIMIT", 60)))
+    # set higher logging level for httpx to avoid all GET and POST requests being logged
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # this decorator allows you to restrict the access of a handler to only the ALLOWED_USERS specified in .env file
-def restricted(func):
+# every command passes through it, so it also measures how long the handler takes
+def restricted(func, allowed_users=ALLOWED_USERS):
     @wraps(func)
     async def wrapped(update, context, *args, **kwargs):
         user_id = update.effective_user.id
-        if user_id not in ALLOWED_USERS:
-            print(f"Unauthorized access denied for {user_id}.")
+        if user_id not in allowed_users:
+            logging.warning(f"Unauthorized access denied for {user_id}.")
+            metrics.UNAUTHORIZED.inc()
             return
-        return await func(update, context, *args, **kwargs)
+        with metrics.COMMAND_SECONDS.time(command=func.__name__):
+            return await func(update, context, *args, **kwargs)
     return wrapped
 
+# same as restricted, for the handlers only the ADMIN_USERS may use
+def admin_only(func):
+    return restricted(func, ADMIN_USERS)
+
+def graph_key(hours, source="sensor", sensor_id=DEFAULT_SENSOR_ID) -> tuple:
+    """
+    Build the cache key of a graph: its range plus the rows it is drawn from.
+    New rows only land every few minutes, so most requests map to an existing key.
+    Row ids start over in a recreated database, so the key also holds the id of the database.
+    A compressed sensor may store no row for up to COMPRESSION_MAX_SILENCE while its rebuilt
+    series still reaches to now, so its key also changes every 1% of the range.
+    """
+    db = DataBaseHandler("sensor_data.db")
+    try:
+        first, last = db.get_hours_range(hours, source, sensor_id)
+        compressed = source == "sensor" and db.get_compression(sensor_id) is not None
+        database_id = db.get_database_id()
+    finally:
+        db.close()
+    key = ("graph", database_id, source, sensor_id, hours, first, last)
+    if compressed:
+        key += (int(time.time() // max(60.0, float(hours) * 36)),)
+    return key
+
+def sensor_alert_rules() -> list:
+    """
+    Create the alert rules of one sensor with the thresholds from the .env file.
+    Rules keep their state, so every sensor gets its own.
+    """
+    return [
+        AlertRule("temp_high", "temperature", float(os.getenv("ALERT_TEMP_MAX", 35)), hysteresis=1,
+                  message="Temperature is {value:.1f}C (above {threshold}C)"),
+        AlertRule("temp_low", "temperature", float(os.getenv("ALERT_TEMP_MIN", 5)), above=False, hysteresis=1,
+                  message="Temperature is {value:.1f}C (below {threshold}C)"),
+        AlertRule("humidity", "humidity", float(os.getenv("ALERT_HUMIDITY_MAX", 70)), hysteresis=3,
+                  message="Humidity is {value:.1f}% (above {threshold}%)"),
+        AlertRule("air_quality", "air_quality", float(os.getenv("ALERT_AIR_QUALITY_MIN", 50)), above=False,
+                  hysteresis=5, message="Air quality score is {value:.1f} (below {threshold})"),
+    ]
+
+def build_alert_engines(application: Application, system_info: GetSystemInfo, sensors: SensorRegistry) -> tuple:
+    """
+    Create the alert engines pushing to ALLOWED_USERS: one for the Pi health and one per sensor,
+    all sharing the same notifier. With several sensors the alerts name the sensor they come from.
+
+    Returns:
+        tuple: (AlertEngine of the Pi, dict of sensor id -> AlertEngine).
+    """
+    notifier = TelegramAlertNotifier(
+        application.job_queue, ALLOWED_USERS,
+        coalesce_window=float(os.getenv("ALERT_COALESCE_WINDOW", 10)),
+        min_interval=float(os.getenv("ALERT_MIN_INTERVAL", 60)))
+    system_rules = [
+        AlertRule("cpu_temp", "cpu_temp", system_info.temp_threshold, hysteresis=5,
+                  message="CPU temperature is {value:.1f}C (limit {threshold}C)"),
+        AlertRule("memory", "mem_used_pct", system_info.mem_proc_treshold, hysteresis=5,
+                  message="Memory usage is {value:.1f}% (limit {threshold}%)"),
+    ]
+    sensor_engines = {}
+    for sensor_manager in sensors:
+        notify = notifier
+        if len(sensors) > 1:
+            notify = lambda message, name=sensor_manager.sensor_id: notifier(f"[{name}] {message}")
+        sensor_engines[sensor_manager.sensor_id] = AlertEngine(sensor_alert_rules(), notify)
+    return AlertEngine(system_rules, notifier), sensor_engines
+
 # Bot command handlers
 
 @restricted
@@ -58,11 +166,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logging.info("The user used /START.")
     await update.message.reply_text(
          "Welcome to IoT Radio Bot!\n"
-         "Use /status to get sensor data.\n"
+         "Use /status [sensor] to get sensor data.\n"
          "Use /inforpi to get info about CPU temp and memory.\n"
          "Use /uptime to get the RPI uptime.\n"
-         "Use /graph [hours] to get a graph with temperature and humidity. "
-         "Default graph duration is 12h if no argument is specified."
+         "Use /graph [hours] [sensor] to get a graph with temperature and humidity. "
+         "Default graph duration is 12h if no argument is specified.\n"
+         "Use /sysgraph [hours] to get a graph with the Pi CPU temperature and memory usage.\n"
+         "Use /trend [hours] [sensor] to get a quick text trend of temperature, humidity and pressure.\n"
+         "Use /stats [hours] [sensor] to get statistics and the daily profile of temperature and humidity.\n"
+         "Use /export [range] [csv|bin] [sensor] to download the sensor data, e.g. /export 7d.\n"
+         f"Sensors: {', '.join(context.bot_data['sensors'].ids())}."
      )
 
 @restricted
@@ -72,11 +185,22 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Retrieves and sends the current sensor data to the user.
     """
     logging.info("The user used /STATUS")
-    sensor_manager: SensorManager = context.bot_data['sensor_manager']
-    
+    sensors: SensorRegistry = context.bot_data['sensors']
+    if context.args:
+        sensor_manager = await select_sensor(update, context, context.args[0])
+        if sensor_manager is None:
+            return
+        selected = [sensor_manager]
+    else:
+        selected = list(sensors)
+
     output = "Current sensor data:"
-    sensor_data = sensor_manager.read_sensor()  # Retrieve sensor data
-    await update.message.reply_text(f"{output}\n{sensor_data}")
+    for sensor_manager in selected:
+        sensor_data = sensor_manager.read_sensor()  # Latest snapshot, does not touch the sensor
+        if len(sensors) > 1:
+            output += f"\n\n[{sensor_manager.sensor_id}]"
+        output += f"\n{sensor_data}"
+    await update.message.reply_text(output)
 
 @restricted
 async def inforpi(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -85,8 +209,18 @@ async def inforpi(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Retrieves and sends info about the Raspberry Pi.
     """
     logging.info("The user used /INFORPI")
-    sys_info = GetSystemInfo()
-    output = f"Cpu Temperature: {sys_info.cpu_temp()}C\n{sys_info.mem_info_string()}"
+    sys_info: GetSystemInfo = context.bot_data['system_info']
+    # every figure comes from one pass over the files, the load is measured since the previous /inforpi
+    snapshot = sys_info.snapshot("inforpi")
+    cpu_temp = "Data not available" if snapshot["cpu_temp"] is None else snapshot["cpu_temp"]
+    output = f"Cpu Temperature: {cpu_temp}C\n"
+    if snapshot["cpu_percent"] is not None:
+        # the first /inforpi has nothing to compare with
+        output += f"Cpu Load: {snapshot['cpu_percent']:.1f}%\n"
+    if snapshot["loadavg"] is not None:
+        output += "Load Average: {0:.2f} {1:.2f} {2:.2f}\n".format(*snapshot["loadavg"])
+    if snapshot["memory"] is not None:
+        output += sys_info.mem_info_string(snapshot["memory"])
     await update.message.reply_text(output)
 
 @restricted
@@ -96,80 +230,459 @@ async def uptime(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Retrieves and sends the system uptime info.
     """
     logging.info("The user used /UPTIME")
-    sys_info = GetSystemInfo()
+    sys_info: GetSystemInfo = context.bot_data['system_info']
     await update.message.reply_text(sys_info.uptime_string())
 
+async def select_sensor(update: Update, context: ContextTypes.DEFAULT_TYPE, sensor_id) -> SensorManager:
+    """
+    Look up the sensor named in a command, the first sensor if `sensor_id` is None.
+    Replies with the known sensors and returns None if there is no such sensor.
+    """
+    sensors: SensorRegistry = context.bot_data['sensors']
+    try:
+        return sensors.get(sensor_id)
+    except KeyError:
+        await update.message.reply_text(f"Unknown sensor {sensor_id}, use one of: {', '.join(sensors.ids())}.")
+        return None
+
+async def send_graph(update: Update, context: ContextTypes.DEFAULT_TYPE, hours, source,
+                     sensor_id=DEFAULT_SENSOR_ID) -> None:
+    """
+    Render (or take from the cache) the graph of `source` (of sensor `sensor_id`) for the past `hours` and send it.
+    """
+    render_pool: GraphRenderPool = context.bot_data['render_pool']
+    graph_cache: GraphCache = context.bot_data['graph_cache']
+
+    async def render() -> bytes:
+        with metrics.GRAPH_RENDER_SECONDS.time(source=source):
+            png = await render_pool.render(hours, source, sensor_id)
+        metrics.GRAPH_PNG_BYTES.observe(len(png), source=source)
+        return png
+
+    try:
+        key = await asyncio.to_thread(graph_key, hours, source, sensor_id)
+        # the render runs in a worker process, the event loop keeps serving other users
+        entry = await graph_cache.get_or_render(key, render)
+    except RenderQueueFull:
+        logging.warning("Graph render queue is full.")
+        await update.message.reply_text("Too many graphs are being generated, try again in a moment.")
+        return
+    except RenderTimeout as e:
+        logging.error(f"Graph render timed out: {e}")
+        await update.message.reply_text("The graph took too long to generate.")
+        return
+    except Exception as e:
+        logging.error(f"Failed to generate graph: {e}")
+        await update.message.reply_text("The graph could not be generated.")
+        return
+
+    if entry.file_id:
+        # the same image was uploaded before, resend it without uploading again
+        try:
+            await context.bot.send_photo(chat_id=update.effective_chat.id, photo=entry.file_id)
+            return
+        except BadRequest as e:
+            logging.warning(f"Cached graph file_id rejected, uploading again: {e}")
+
+    message = await context.bot.send_photo(chat_id=update.effective_chat.id, photo=entry.png)
+    graph_cache.set_file_id(entry, message.photo[-1].file_id)
+
+def hours_argument(context: ContextTypes.DEFAULT_TYPE, default=12) -> int:
+    """
+    Extract the number of hours from the command arguments, `default` if missing or not a number.
+
+    Raises:
+        ValueError: If the number of hours is zero or negative.
+    """
+    try:
+        hours = int(context.args[0])
+    except (IndexError, ValueError):
+        logging.info("No argument, or correct one for graph generate.")
+        return default
+    if hours <= 0:
+        raise ValueError(f"Invalid number of hours: {context.args[0]}")
+    return hours
+
+def hours_and_sensor(context: ContextTypes.DEFAULT_TYPE, default=12) -> tuple:
+    """
+    Split the command arguments into the number of hours (`default` if missing) and a sensor name
+    (None if missing), in any order: /graph 24 outdoor and /graph outdoor 24 are the same.
+
+    Raises:
+        ValueError: If the number of hours is zero or negative.
+    """
+    hours, sensor_id = default, None
+    for arg in context.args or []:
+        try:
+            hours = int(arg)
+        except ValueError:
+            sensor_id = arg
+            continue
+        if hours <= 0:
+            raise ValueError(f"Invalid number of hours: {arg}")
+    return hours, sensor_id
+
 @restricted
 async def graph(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handles the /graph command for Telegram bot.
-    Generates and sends a temperature graph based on specific time range.
+    Generates and sends a temperature graph based on specific time range, of the first sensor
+    unless one is named: /graph 24 outdoor (the arguments may come in any order).
     If no argument is provided or an invalid value is given, the default is 12 hours.
     """
     logging.info("The user used /GRAPH")    
-    # Extract the argument from the command    
     try:
-        hours = int(context.args[0])
-    except (IndexError, ValueError):
-        logging.info("No argument, or corect one for graph generate.")  
-        hours = 12
-    
-    generate_graph(hours)
-    image_path = "tmp/temperature.png"
+        hours, sensor_id = hours_and_sensor(context)
+    except ValueError:
+        await update.message.reply_text("Usage: /graph [hours] [sensor], hours a whole number above 0.")
+        return
+    sensor_manager = await select_sensor(update, context, sensor_id)
+    if sensor_manager is None:
+        return
+    await send_graph(update, context, hours, "sensor", sensor_manager.sensor_id)
 
-    if os.path.isfile(image_path):
-        await context.bot.send_photo(chat_id=update.effective_chat.id, photo=open(image_path, 'rb'))
-    else:
-        # Notify the user if the image is not found
-        logging.error("The graph image is not found.")
-        update.message.reply_text(f"The graph image is not found.")
+@restricted
+async def sysgraph(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handles the /sysgraph command for Telegram bot.
+    Generates and sends a graph of the Pi CPU temperature and memory usage based on specific time range.
+    If no argument is provided or an invalid value is given, the default is 12 hours.
+    """
+    logging.info("The user used /SYSGRAPH")
+    try:
+        hours = hours_argument(context)
+    except ValueError:
+        await update.message.reply_text("Usage: /sysgraph [hours], hours a whole number above 0.")
+        return
+    await send_graph(update, context, hours, "system")
+
+@restricted
+async def trend(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handles the /trend command for Telegram bot.
+    Sends text sparklines with min/max/avg/last of temperature, humidity and pressure, a quick
+    look at where the values are heading without rendering and uploading a graph.
+    Takes the same arguments as /graph, the default is 12 hours.
+    """
+    logging.info("The user used /TREND")
+    try:
+        hours, sensor_id = hours_and_sensor(context)
+    except ValueError:
+        await update.message.reply_text("Usage: /trend [hours] [sensor], hours a whole number above 0.")
+        return
+    sensor_manager = await select_sensor(update, context, sensor_id)
+    if sensor_manager is None:
+        return
+    # short ranges come from the high-rate readings when HIGH_RATE_BUFFER is set
+    ring_buffer = context.bot_data['ring_buffers'].get(sensor_manager.sensor_id)
+    text = await asyncio.to_thread(build_trend, hours, sensor_manager.sensor_id, ring_buffer=ring_buffer)
+    if text is None:
+        await update.message.reply_text("No sensor data in this range.")
+        return
+    await update.message.reply_text(text, parse_mode="HTML")
+
+@restricted
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handles the /stats command for Telegram bot.
+    Sends min/avg/max, standard deviation, percentiles and the profile per hour of the day of
+    temperature and humidity, all computed inside SQLite. Takes the same arguments as /graph,
+    the default is 24 hours.
+    """
+    logging.info("The user used /STATS")
+    try:
+        hours, sensor_id = hours_and_sensor(context, default=24)
+    except ValueError:
+        await update.message.reply_text("Usage: /stats [hours] [sensor], hours a whole number above 0.")
+        return
+    sensor_manager = await select_sensor(update, context, sensor_id)
+    if sensor_manager is None:
+        return
+    text = await asyncio.to_thread(build_stats, hours, sensor_manager.sensor_id)
+    if text is None:
+        await update.message.reply_text("No sensor data in this range.")
+        return
+    await update.message.reply_text(text, parse_mode="HTML")
+
+@restricted
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handles the /export command for Telegram bot.
+    Sends the sensor data of a range ('24', '36h', '7d', '2w' or 'all', default 24h) as gzip-compressed
+    CSV or packed binary documents, split into several documents below the Telegram upload limit.
+    A third argument selects the sensor, the first one by default.
+    """
+    logging.info("The user used /EXPORT")
+    args = context.args or []
+    try:
+        hours = parse_range(args[0]) if args else 24
+    except ValueError:
+        await update.message.reply_text("Usage: /export [range] [csv|bin] [sensor], range like 24, 36h, 7d, 2w or all.")
+        return
+    fmt = args[1].lower() if len(args) > 1 else "csv"
+    if fmt not in EXPORT_FORMATS:
+        await update.message.reply_text(f"Unknown format {fmt}, use one of: {', '.join(EXPORT_FORMATS)}.")
+        return
+    sensor_manager = await select_sensor(update, context, args[2] if len(args) > 2 else None)
+    if sensor_manager is None:
+        return
+
+    # every part is compressed in a worker thread while the event loop keeps serving other users
+    parts = export_parts("sensor_data.db", hours, fmt, sensor_id=sensor_manager.sensor_id)
+    sent = 0
+    try:
+        while True:
+            part = await asyncio.to_thread(next, parts, None)
+            if part is None:
+                break
+            name, file, rows = part
+            with file:
+                await context.bot.send_document(chat_id=update.effective_chat.id, document=file, filename=name,
+                                                caption=f"{rows} readings", write_timeout=300)
+            sent += 1
+    except Exception as e:
+        logging.error(f"Failed to export data: {e}")
+        await update.message.reply_text("The export failed.")
+        return
+    finally:
+        await asyncio.to_thread(parts.close)
+    if not sent:
+        await update.message.reply_text("No sensor data in this range.")
+
+@admin_only
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handles the /metrics command for Telegram bot.
+    Sends a summary of the command latencies, sensor, database and graph metrics.
+    """
+    logging.info("The user used /METRICS")
+    await update.message.reply_text(metrics.summary())
 
 # must be added last
 @restricted
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(chat_id=update.effective_chat.id, text="Sorry, I didn't understand that command.")   
 
-# Main function
-def main():
+def build_compressors(sensors) -> dict:
+    """
+    Create a ReadingCompressor for every sensor if COMPRESSION is set, so the database filler
+    only stores the readings needed to rebuild the series within COMPRESSION_TOLERANCES.
 
-    TAPI_KEY = os.getenv('TEL_API_KEY')
-    if not TAPI_KEY:
-        raise ValueError("Telegram API key not found. Please set TEL_API_KEY in your .env file.")
-    
+    Returns:
+        dict: sensor id -> ReadingCompressor, empty when every reading is stored.
+    """
+    kind = os.getenv("COMPRESSION", "off")
+    if kind == "off":
+        return {}
+    tolerances = parse_tolerances(os.getenv("COMPRESSION_TOLERANCES", ""))
+    max_silence = float(os.getenv("COMPRESSION_MAX_SILENCE", 3600))
+    return {sensor_id: ReadingCompressor(kind, tolerances, max_silence) for sensor_id in sensors.ids()}
 
-    sensor_manager = SensorManager(300,1)
+def build_application(token, sensors: SensorRegistry, base_url=None) -> Application:
+    """
+    Assemble the bot: shared services in bot_data, command handlers and background threads.
+    The background threads start with the application and stop (flushing their buffers) with it.
+
+    Args:
+        token (str): Telegram bot API token.
+        sensors (SensorRegistry): The sensors, their samplers already running.
+        base_url (str): Bot API endpoint, None for the official Telegram servers.
+
+    Returns:
+        Application: The application, ready for run_polling().
+    """
+    # graphs are rendered in worker processes, one per Pi core by default
+    render_pool = GraphRenderPool(
+        max_workers=int(os.getenv("GRAPH_WORKERS", 4)),
+        max_queue=int(os.getenv("GRAPH_QUEUE", 8)),
+        timeout=float(os.getenv("GRAPH_TIMEOUT", 60)))
+
+    # one instance keeps the /proc files open and the previous sample for rates
+    system_info = GetSystemInfo()
+
+    # the data filler buffers readings, it has to flush them before the process exits
+    stop_event = threading.Event()
+    data_filler_thread = threading.Thread(target=fill_database, args=(sensors,), kwargs={
+        "interval": float(os.getenv("SAMPLE_INTERVAL", 600)),
+        "stop_event": stop_event,
+        "batch_size": int(os.getenv("DB_BATCH_SIZE", 1)),
+        "flush_interval": float(os.getenv("DB_FLUSH_INTERVAL", 0)),
+        "compressors": build_compressors(sensors),
+    }, daemon=True)
+
+    system_metrics_thread = threading.Thread(target=fill_system_metrics, args=(system_info,), kwargs={
+        "interval": float(os.getenv("SYSTEM_METRICS_INTERVAL", 60)),
+        "stop_event": stop_event,
+        "batch_size": int(os.getenv("SYSTEM_METRICS_BATCH_SIZE", 10)),
+        "on_sample": lambda sample: alert_engine.evaluate(sample),
+    }, daemon=True)
+
+    # high-rate mode: every sampler reading goes into the ring buffer of its sensor,
+    # flushed to the DB in packed blocks
+    threads = [data_filler_thread, system_metrics_thread]
+    ring_buffers = {}
+    high_rate_buffer = int(os.getenv("HIGH_RATE_BUFFER", 0))
+    if high_rate_buffer:
+        for sensor_manager in sensors:
+            ring_buffer = ring_buffers[sensor_manager.sensor_id] = SensorRingBuffer(high_rate_buffer)
+            sensor_manager.subscribe(lambda reading, ring_buffer=ring_buffer, sensor_manager=sensor_manager:
+                                     ring_buffer.append(reading.timestamp, sensor_manager.reading_fields(reading)))
+        threads.append(threading.Thread(target=fill_sensor_blocks, args=(ring_buffers,), kwargs={
+            "interval": float(os.getenv("HIGH_RATE_FLUSH_INTERVAL", 300)),
+            "stop_event": stop_event,
+        }, daemon=True))
+
+    # expired data is deleted in small batches and the freed space given back to the SD card
+    policy = RetentionPolicy(
+        raw_days=float(os.getenv("RETENTION_RAW_DAYS", 30)),
+        minute_days=float(os.getenv("RETENTION_MINUTE_DAYS", 90)),
+        hour_days=float(os.getenv("RETENTION_HOUR_DAYS", 730)),
+        day_days=float(os.getenv("RETENTION_DAY_DAYS", 0)),
+        block_days=float(os.getenv("RETENTION_BLOCK_DAYS", 7)),
+        system_days=float(os.getenv("RETENTION_SYSTEM_DAYS", 30)))
+    threads.append(threading.Thread(target=run_retention, args=(policy,), kwargs={
+        "interval": float(os.getenv("RETENTION_INTERVAL", 3600)),
+        "stop_event": stop_event,
+        "batch_size": int(os.getenv("RETENTION_BATCH_SIZE", 500)),
+    }, daemon=True))
+
+    metrics_port = int(os.getenv("METRICS_PORT", 9108))
+    metrics_server = []
+
+    async def startup(application: Application):
+        startup_step("bot initialized")
+        for thread in threads:
+            thread.start()
+        if metrics.enabled() and metrics_port:
+            metrics_server.append(metrics.serve(metrics_port, os.getenv("METRICS_HOST", "127.0.0.1")))
+        # matplotlib is loaded by the render workers in the background while the bot already answers
+        if os.getenv("GRAPH_WARMUP", "1") == "1":
+            render_pool.warm_up()
+
+    first_update = []
+
+    async def report_startup(update: object, context: ContextTypes.DEFAULT_TYPE):
+        if not first_update:
+            first_update.append(update)
+            startup_step("first update")
+            logging.info(startup_report())
+
+    async def shutdown(application: Application):
+        for server in metrics_server:
+            server.shutdown()
+            server.server_close()
+        render_pool.shutdown()
+        stop_event.set()
+        for thread in threads:
+            await asyncio.to_thread(thread.join, 10)
+        await asyncio.to_thread(sensors.stop_samplers)
+        system_info.close()
+        # every writer has stopped, the shared database connections can go
+        connection_manager.close_all()
 
-    try:
-        #sensor_manager.stabilize_sensor()
-        stabilize_thread = threading.Thread(target=sensor_manager.stabilize_sensor, daemon = True )
-        stabilize_thread.start()
-    except Exception as e:
-        logging.error(f"Failed to stabilize sensor: {e}")
- 
     # add longer time to proccess the requests in case of network instability
-    application =( Application.builder()
-        .token(TAPI_KEY).connect_timeout(30)
-        .read_timeout(30).write_timeout(30).build() )
+    # updates wait in a bounded queue, a webhook answers Telegram 503 when it is full
+    builder =( Application.builder()
+        .token(token).connect_timeout(30)
+        .read_timeout(30).write_timeout(30)
+        .update_queue(asyncio.Queue(maxsize=int(os.getenv("UPDATE_QUEUE_SIZE", 100))))
+        .post_init(startup).post_shutdown(shutdown) )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
     
-    # add SensorManager to bot_data for sharing across handlers
-    application.bot_data['sensor_manager'] = sensor_manager
+    # every new sensor reading and system sample is checked against the alert rules
+    alert_engine, sensor_alert_engines = build_alert_engines(application, system_info, sensors)
+    for sensor_manager in sensors:
+        sensor_manager.subscribe(lambda reading, engine=sensor_alert_engines[sensor_manager.sensor_id],
+                                 sensor_manager=sensor_manager: engine.evaluate({
+            "temperature": reading.temperature,
+            "humidity": reading.humidity,
+            "air_quality": sensor_manager.air_quality_score(reading),
+        }))
+
+    # add the sensors to bot_data for sharing across handlers
+    application.bot_data['sensors'] = sensors
+    application.bot_data['render_pool'] = render_pool
+    application.bot_data['graph_cache'] = GraphCache()
+    application.bot_data['system_info'] = system_info
+    application.bot_data['ring_buffers'] = ring_buffers
 
+    # runs before the command handlers, for every update
+    application.add_handler(TypeHandler(Update, report_startup), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("status", status))
     application.add_handler(CommandHandler("inforpi", inforpi))
     application.add_handler(CommandHandler("uptime", uptime))
     application.add_handler(CommandHandler("graph", graph))
+    application.add_handler(CommandHandler("sysgraph", sysgraph))
+    application.add_handler(CommandHandler("trend", trend))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("export", export))
+    application.add_handler(CommandHandler("metrics", show_metrics))
     
     application.add_handler(MessageHandler(filters.COMMAND, unknown))
+    return application
+
+# Main function
+def main():
+    setup_logging()
+
+    TAPI_KEY = os.getenv('TEL_API_KEY')
+    if not TAPI_KEY:
+        raise ValueError("Telegram API key not found. Please set TEL_API_KEY in your .env file.")
     
-    data_filler_thread = threading.Thread(target=fill_database, args=(sensor_manager,), daemon=True)
-    data_filler_thread.start()
+
+    startup_step("imports")
+
+    # instrumentation costs nothing until it is enabled
+    if os.getenv("METRICS_ENABLED", "0") == "1":
+        metrics.enable()
+
+    # a database created by an older version is upgraded before anything reads it
+    migrate("sensor_data.db")
+    startup_step("migration")
+
+    # SENSOR_DRIVER=fake runs the bot without a BME680, e.g. for development off the Pi
+    driver = None
+    if os.getenv("SENSOR_DRIVER") == "fake":
+        import fake_bme680 as driver
+
+    # SENSORS lists the sensors as name:address[@bus], a single sensor at the default address if not set
+    sensors = SensorRegistry()
+    for sensor_id, i2c_addr, i2c_bus in parse_sensor_specs(os.getenv("SENSORS", "")):
+        baseline_path = "gas_baseline.json" if sensor_id == DEFAULT_SENSOR_ID else f"gas_baseline_{sensor_id}.json"
+        sensors.add(SensorManager(300, float(os.getenv("GAS_READ_INTERVAL", 10)),
+                                  float(os.getenv("SENSOR_READ_INTERVAL", 1)),
+                                  baseline_path=baseline_path,
+                                  max_baseline_age=float(os.getenv("GAS_BASELINE_MAX_AGE", 86400)),
+                                  driver=driver, sensor_id=sensor_id, i2c_addr=i2c_addr, i2c_bus=i2c_bus))
+    # the samplers are the only code touching the I2C buses, handlers read their latest snapshots.
+    # They set up their sensors themselves, polling starts without waiting for the I2C bus
+    sensors.start_samplers()
+
+    try:
+        sensors.stabilize_all()
+    except Exception as e:
+        logging.error(f"Failed to stabilize sensor: {e}")
  
+    application = build_application(TAPI_KEY, sensors)
+    startup_step("application built")
+
     # Start the bot (asynchronously)
-    application.run_polling()
+    # with WEBHOOK_URL set Telegram pushes every update as it happens, no long-poll connection is kept open
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if webhook_url:
+        webhook.run(application, webhook_url=webhook_url,
+                    listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+                    port=int(os.getenv("WEBHOOK_PORT", 8443)),
+                    secret_token=os.getenv("WEBHOOK_SECRET") or None,
+                    cert=os.getenv("WEBHOOK_CERT") or None,
+                    key=os.getenv("WEBHOOK_KEY") or None,
+                    upload_certificate=os.getenv("WEBHOOK_SELF_SIGNED", "0") == "1")
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
     main()
-
-
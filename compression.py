@@ -0,0 +1,197 @@
+import logging
+import math
+from ring_buffer import FIELDS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# how the stored points of a compressed sensor are joined again when read:
+# dead-band values hold until the next point, swinging-door points are joined by straight lines
+COMPRESSION_KINDS = {"deadband": "step", "swinging_door": "linear"}
+
+# largest error a dropped reading may have, per field, in the unit of the field
+DEFAULT_TOLERANCES = {"temperature": 0.1, "humidity": 0.5, "pressure": 0.5}
+
+
+def parse_tolerances(spec) -> dict:
+    """
+    Parse a tolerance list like "temperature:0.1,humidity:0.5".
+
+    Returns:
+        dict: field -> tolerance, DEFAULT_TOLERANCES if `spec` is empty.
+
+    Raises:
+        ValueError: If an entry has no tolerance, a negative one, or names an unknown field.
+    """
+    if not spec or not spec.strip():
+        return dict(DEFAULT_TOLERANCES)
+    tolerances = {}
+    for entry in spec.split(","):
+        field, _, value = entry.strip().partition(":")
+        if field not in FIELDS or not value:
+            raise ValueError(f"Invalid compression tolerance: {entry.strip()!r}")
+        tolerances[field] = float(value)
+        if tolerances[field] < 0:
+            raise ValueError(f"Negative compression tolerance: {entry.strip()!r}")
+    return tolerances
+
+
+class ReadingCompressor:
+
+    """
+    Decides which readings of one sensor have to be stored, so that the dropped ones can be
+    rebuilt from the stored ones within the tolerance of every field.
+
+    deadband: a reading is stored when a field moved more than its tolerance away from the
+    last stored value, in between the value is taken as constant (a step series).
+
+    swinging_door: a reading is held back as long as the straight line from the last stored
+    reading to it passes within the tolerance of every reading in between. The first reading
+    for which no such line exists makes the held one stored, so the rebuilt series is linear.
+
+    A field that is missing (None) or turns missing always ends the current step or line.
+    Fields without a tolerance are stored with whatever reading is kept.
+
+    Attributes:
+      kind (str): 'deadband' or 'swinging_door', one of COMPRESSION_KINDS.
+      tolerances (dict): field -> largest error of a dropped reading.
+      max_silence (float): Seconds after which a reading is stored even if nothing moved,
+        it tells a steady signal from a dead sensor.
+    """
+
+    def __init__(self, kind="swinging_door", tolerances=None, max_silence=3600):
+        if kind not in COMPRESSION_KINDS:
+            raise ValueError(f"Unknown compression: {kind!r}, expected one of {', '.join(COMPRESSION_KINDS)}")
+        self.kind = kind
+        self.tolerances = dict(DEFAULT_TOLERANCES if tolerances is None else tolerances)
+        self.max_silence = max_silence
+        self._stored = None
+        self._held = None
+        # per field the range of slopes from the stored reading that keeps every held-back reading within tolerance
+        self._doors = {}
+
+    def offer(self, reading) -> list:
+        """
+        Pass the next reading through the compressor.
+
+        Args:
+            reading (dict): A reading with 'timestamp' (epoch seconds) and its fields, see
+              SensorManager.get_read_sensor(). A reading not newer than the previous one is ignored.
+
+        Returns:
+            list of dict: The readings to store now, oldest first, usually none.
+        """
+        ts = reading["timestamp"]
+        latest = self._held or self._stored
+        if latest is not None and ts <= latest["timestamp"]:
+            return []
+        if self._stored is None:
+            return self._store(reading)
+
+        if self.kind == "deadband":
+            if any(self._moved(field, reading) for field in self.tolerances) or self._silent(reading):
+                return self._store(reading)
+            return []
+
+        stored = []
+        if self._held is not None and not self._fits(reading):
+            # the held reading is the last one a line could still reach, the line restarts there
+            stored = self._store(self._held)
+        if self._silent(reading) or not self._fits(reading):
+            # after a restart only a field turning missing cannot be reached
+            return stored + self._store(reading)
+        self._hold(reading)
+        return stored
+
+    def flush(self) -> list:
+        """
+        Return the held-back reading, called when recording stops so the series ends at the last reading.
+        """
+        if self._held is None:
+            return []
+        return self._store(self._held)
+
+    def _store(self, reading) -> list:
+        self._stored, self._held = reading, None
+        self._doors = {field: [-math.inf, math.inf] for field in self.tolerances}
+        return [reading]
+
+    def _silent(self, reading) -> bool:
+        return reading["timestamp"] - self._stored["timestamp"] >= self.max_silence
+
+    def _moved(self, field, reading) -> bool:
+        value, last = reading.get(field), self._stored.get(field)
+        if value is None or last is None:
+            return (value is None) != (last is None)
+        return abs(value - last) > self.tolerances[field]
+
+    def _fits(self, reading) -> bool:
+        """
+        Whether the line from the stored reading to `reading` passes every held-back reading within tolerance.
+        """
+        dt = reading["timestamp"] - self._stored["timestamp"]
+        for field, (low, high) in self._doors.items():
+            value, start = reading.get(field), self._stored.get(field)
+            if value is None or start is None:
+                if (value is None) != (start is None):
+                    return False
+                continue
+            if not low <= (value - start) / dt <= high:
+                return False
+        return True
+
+    def _hold(self, reading) -> None:
+        dt = reading["timestamp"] - self._stored["timestamp"]
+        for field, door in self._doors.items():
+            value, start = reading.get(field), self._stored.get(field)
+            if value is None or start is None:
+                continue
+            tolerance = self.tolerances[field]
+            # the door narrows to the slopes passing within tolerance of this reading too
+            door[0] = max(door[0], (value - tolerance - start) / dt)
+            door[1] = min(door[1], (value + tolerance - start) / dt)
+        self._held = reading
+
+
+def reconstruct(ts, values, grid, kind, max_gap) -> "np.ndarray":
+    """
+    Rebuild the values of a compressed series at the times of `grid`.
+
+    A step series holds every stored value until the next one, a linear series joins the stored
+    values with straight lines. Stored points further apart than `max_gap` are not joined, the
+    sensor was not recording in between, and a step series is not held longer than `max_gap`.
+
+    Args:
+        ts (np.ndarray): Increasing epoch seconds of the stored values.
+        values (np.ndarray): The stored values, NaN for missing ones.
+        grid (np.ndarray): Epoch seconds to rebuild the series at.
+        kind (str): 'step' or 'linear', see COMPRESSION_KINDS.
+        max_gap (float): Seconds two stored points may be apart and still be joined.
+
+    Returns:
+        np.ndarray: The rebuilt values, NaN where nothing is known.
+    """
+    import numpy as np
+    ts = np.asarray(ts, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    grid = np.asarray(grid, dtype=np.float64)
+    result = np.full(len(grid), np.nan)
+    if not len(ts):
+        return result
+    # index of the stored point at or before every grid time
+    before = np.searchsorted(ts, grid, side="right") - 1
+    known = before >= 0
+    if kind == "step":
+        known &= grid - ts[before.clip(0)] <= max_gap
+        result[known] = values[before[known]]
+        return result
+    after = before + 1
+    known &= after < len(ts)
+    b, a = before[known], after[known]
+    joined = ts[a] - ts[b] <= max_gap
+    b, a, at = b[joined], a[joined], grid[known][joined]
+    weight = (at - ts[b]) / (ts[a] - ts[b])
+    result[np.flatnonzero(known)[joined]] = values[b] + (values[a] - values[b]) * weight
+    # a grid time right on the last stored point
+    result[grid == ts[-1]] = values[-1]
+    return result
@@ -0,0 +1,185 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# page cache of every connection in KiB, SQLite's default is 2 MB
+CACHE_SIZE_KIB = 4096
+# bytes of the database file read through a memory map instead of read() calls into the page cache
+MMAP_SIZE = 64 * 2**20
+# prepared statements kept per connection, every query of DataBaseHandler fits
+CACHED_STATEMENTS = 256
+# seconds a reader waits for a free pooled connection
+READER_TIMEOUT = 30
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+class ConnectionManager:
+
+    """
+    The connections of one database file in this process: a single long-lived writer
+    connection, opened on the first write, and a small pool of read-only ones. A process
+    that only reads, like a graph worker, never opens the writer.
+
+    Every write goes through the writer while holding its lock, so the threads writing to
+    the database queue up in-process instead of contending for SQLite's file lock. In WAL
+    mode the readers never wait for the writer. Connections live as long as the manager,
+    so their statement caches and page caches stay warm between queries.
+
+    Attributes:
+      db_name (str): The database file.
+      readers (int): Read-only connections at most, opened on demand.
+    """
+
+    def __init__(self, db_name, readers=4):
+        """
+        Set up the manager, no connection is opened yet.
+
+        Args:
+            db_name (str): The name of the SQLite database file.
+            readers (int): Read-only connections at most, opened on demand.
+        """
+        self.db_name = db_name
+        self.readers = readers
+        self._pid = os.getpid()
+        self._writer = None
+        self._writer_lock = threading.RLock()
+
+        self._idle = queue.LifoQueue()
+        self._opened = []
+        self._pool_lock = threading.Lock()
+        self._closed = False
+
+    @staticmethod
+    def _tune(connection) -> None:
+        connection.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+        connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        # the sorts of the percentile queries stay in memory instead of going to a temp file on the SD card
+        connection.execute("PRAGMA temp_store=MEMORY")
+
+    def _open_writer(self) -> sqlite3.Connection:
+        """
+        Open the writer connection, which creates the file if needed and switches it to WAL mode.
+        """
+        # a connection is used by one thread at a time, but not always by the one that opened it
+        connection = sqlite3.connect(self.db_name, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode NORMAL only syncs at checkpoints, the database stays consistent on power loss
+        connection.execute("PRAGMA synchronous=NORMAL")
+        # after a checkpoint the WAL file is cut back to 1 MB instead of keeping its largest size
+        connection.execute("PRAGMA journal_size_limit=1048576")
+        self._tune(connection)
+        return connection
+
+    def _open_reader(self) -> sqlite3.Connection:
+        uri = Path(self.db_name).resolve().as_uri() + "?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        self._tune(connection)
+        return connection
+
+    @contextmanager
+    def writer(self):
+        """
+        Borrow the writer connection, holding the write lock, and open it on first use.
+        The block commits or rolls back itself.
+
+        Yields:
+            sqlite3.Connection: The writer connection.
+        """
+        with self._writer_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError(f"Connections of {self.db_name} are closed.")
+            if self._writer is None:
+                self._writer = self._open_writer()
+            yield self._writer
+
+    @contextmanager
+    def reader(self):
+        """
+        Borrow a read-only connection from the pool, opening one if none is idle and the pool
+        is not full yet, otherwise waiting for one to be returned.
+
+        Yields:
+            sqlite3.Connection: A read-only connection, returned to the pool after the block.
+
+        Raises:
+            sqlite3.OperationalError: If no connection is returned within READER_TIMEOUT seconds.
+        """
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = None
+            with self._pool_lock:
+                if self._closed:
+                    raise sqlite3.ProgrammingError(f"Connections of {self.db_name} are closed.")
+                if len(self._opened) < self.readers:
+                    connection = self._open_reader()
+                    self._opened.append(connection)
+            if connection is None:
+                try:
+                    connection = self._idle.get(timeout=READER_TIMEOUT)
+                except queue.Empty:
+                    raise sqlite3.OperationalError(f"No free connection to {self.db_name}.") from None
+        try:
+            yield connection
+        finally:
+            # a statement left open would pin an old WAL snapshot and hold back checkpoints
+            if connection.in_transaction:
+                connection.rollback()
+            if self._closed:
+                connection.close()
+            else:
+                self._idle.put(connection)
+
+    def close(self) -> None:
+        """
+        Close the writer and every idle reader, readers still borrowed are closed when returned.
+        """
+        with self._writer_lock, self._pool_lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._writer is not None:
+                self._writer.close()
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+        logger.info(f"Connections of {self.db_name} are closed.")
+
+
+def get_manager(db_name) -> ConnectionManager:
+    """
+    Return the connection manager of `db_name` in this process, creating it on first use.
+    A process started from this one (e.g. a graph worker) gets its own connections.
+    """
+    key = os.path.abspath(db_name)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None or manager._closed or manager._pid != os.getpid():
+            manager = _managers[key] = ConnectionManager(db_name)
+        return manager
+
+
+def close_all() -> None:
+    """
+    Close the connections of every database, called when the bot stops and at exit.
+    """
+    with _managers_lock:
+        managers = [manager for manager in _managers.values() if manager._pid == os.getpid()]
+        _managers.clear()
+    for manager in managers:
+        manager.close()
+
+
+atexit.register(close_all)
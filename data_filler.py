@@ -1,34 +1,143 @@
+
+import threading
 import time
 from db_handler import DataBaseHandler
 import logging
-import asyncio
+import metrics
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 
-def fill_database(sensor_manager, db_name="sensor_data.db"):
+def fill_database(sensors, db_name="sensor_data.db", interval=600, stop_event=None,
+                  batch_size=1, flush_interval=0, compressors=None):
     """
-    Populates the database with sensor readings at regular intervals.   
+    Populates the database with the readings of every sensor at regular intervals.   
 
-    :param sensor_manager: Object to fetch sensor data.
+    :param sensors: SensorRegistry (or any iterable of SensorManager) to fetch sensor data from.
     :param db_name: Name of the database file.
+    :param interval: Seconds between two readings.
+    :param stop_event: threading.Event that ends the loop, the buffered readings are flushed before returning.
+    :param batch_size: Number of readings written per transaction.
+    :param flush_interval: Seconds a reading may wait in the buffer before it is written.
+    :param compressors: Optional dict of sensor id -> compression.ReadingCompressor, only the readings
+                        it keeps are written for such a sensor, the others store every reading.
+                        The aggregates count every reading either way.
     """
     logging.info("Database population has started.")
-    db = DataBaseHandler(db_name) 
+    stop_event = stop_event or threading.Event()
+    compressors = compressors or {}
+    db = DataBaseHandler(db_name, batch_size=batch_size, flush_interval=flush_interval)
     try:
-        while True:
+        for sensor_manager in sensors:
+            compressor = compressors.get(sensor_manager.sensor_id)
+            if compressor is None:
+                db.set_compression(sensor_manager.sensor_id, None, 0)
+            else:
+                # a reading is kept at least every max_silence, the next one arrives within an interval
+                # plus the time waited for a fresh reading
+                db.set_compression(sensor_manager.sensor_id, compressor.kind, compressor.max_silence + 2 * interval)
+        while not stop_event.is_set():
             
-            # get sensor data
-            # looks like if there is imperfect connection i get None in data
-            data = None # added
-            while data == None: # added
-               data = sensor_manager.get_read_sensor() # added
-            db.insert_sensor_data(data)
-            # wait 10 minutes between readings
-            time.sleep(600)
+            # get the latest reading published by every sampler thread
+            # if there is no fresh one (imperfect connection) wait for the next instead of spinning,
+            # at most one interval so a dead sensor does not hold back the others
+            deadline = time.monotonic() + interval
+            for sensor_manager in sensors:
+                data = sensor_manager.get_read_sensor()
+                while data is None and not stop_event.is_set() and time.monotonic() < deadline:
+                   metrics.SENSOR_STALE_WAITS.inc(sensor=sensor_manager.sensor_id)
+                   sensor_manager.wait_for_reading(timeout=1)
+                   data = sensor_manager.get_read_sensor()
+                if data is not None:
+                    data["sensor_id"] = sensor_manager.sensor_id
+                    compressor = compressors.get(sensor_manager.sensor_id)
+                    if compressor is None:
+                        db.insert_sensor_data(data)
+                    else:
+                        # the aggregates are not weighted towards the periods the signal changed in
+                        db.aggregate_sensor_data(data)
+                        for reading in compressor.offer(data):
+                            db.insert_sensor_data(reading, aggregate=False)
+            # wait between readings, wake up immediately on shutdown
+            stop_event.wait(interval)
     except KeyboardInterrupt:
         logging.warning("Database got an KeyboardInterrupt")
     finally:
+        # the swinging door holds the last reading back, it ends the series
+        for compressor in compressors.values():
+            for reading in compressor.flush():
+                db.insert_sensor_data(reading, aggregate=False)
         db.close()
         logging.info("Database is closed.")
+
+
+def fill_system_metrics(system_info, db_name="sensor_data.db", interval=60, stop_event=None,
+                        batch_size=10, flush_interval=0, on_sample=None):
+    """
+    Records the Raspberry Pi health (CPU temperature and load, memory, uptime) at regular intervals.
+    Samples are buffered and written `batch_size` at a time, so sampling adds no commit per sample.
+
+    :param system_info: Shared GetSystemInfo object.
+    :param db_name: Name of the database file.
+    :param interval: Seconds between two samples.
+    :param stop_event: threading.Event that ends the loop, the buffered samples are flushed before returning.
+    :param batch_size: Number of samples written per transaction.
+    :param flush_interval: Seconds a sample may wait in the buffer before it is written.
+    :param on_sample: Optional callable receiving every recorded sample dict, e.g. an alert engine.
+    """
+    logging.info("System metrics recording has started.")
+    stop_event = stop_event or threading.Event()
+    db = DataBaseHandler(db_name, batch_size=batch_size, flush_interval=flush_interval)
+    try:
+        while not stop_event.is_set():
+            try:
+                snapshot = system_info.snapshot("metrics")
+                memory = snapshot["memory"] or {}
+                sample = {
+                    "cpu_temp": snapshot["cpu_temp"],
+                    "cpu_percent": snapshot["cpu_percent"],
+                    "mem_used_pct": memory.get("percent_used"),
+                    "mem_available_mb": memory.get("available_mem"),
+                    "uptime": snapshot["uptime"] or 0,
+                }
+                db.insert_system_metrics(sample)
+                if on_sample is not None:
+                    on_sample(sample)
+            except Exception as e:
+                logging.error(f"Failed to record system metrics: {e}")
+            stop_event.wait(interval)
+    finally:
+        db.close()
+        logging.info("System metrics recording has stopped.")
+
+
+def fill_sensor_blocks(ring_buffers, db_name="sensor_data.db", interval=300, stop_event=None):
+    """
+    Moves the high-rate readings from the ring buffers to the database in bulk.
+    Every flush writes one packed row per sensor to sensor_blocks, however many readings it holds.
+
+    :param ring_buffers: dict of sensor id -> SensorRingBuffer filled by the sensor's sampler.
+    :param db_name: Name of the database file.
+    :param interval: Seconds between two flushes, the buffer has to hold at least this many seconds of readings.
+    :param stop_event: threading.Event that ends the loop, the buffer is flushed a last time before returning.
+    """
+    logging.info("High-rate recording has started.")
+    stop_event = stop_event or threading.Event()
+    db = DataBaseHandler(db_name)
+    try:
+        while True:
+            stopping = stop_event.wait(interval)
+            for sensor_id, ring_buffer in ring_buffers.items():
+                position, block = ring_buffer.pending()
+                try:
+                    db.insert_sensor_block(block, sensor_id)
+                    ring_buffer.mark_flushed(position)
+                except Exception as e:
+                    # the readings stay pending and are retried with the next flush
+                    logging.error(f"Failed to store {len(block['ts'])} high-rate readings of {sensor_id}: {e}")
+            if stopping:
+                break
+    finally:
+        db.close()
+        logging.info("High-rate recording has stopped.")
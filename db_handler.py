@@ -1,67 +1,658 @@
 import sqlite3
 import logging
+import math
+import threading
+import time
+import metrics
+from connection_manager import get_manager
+from ring_buffer import FIELDS, pack_block, unpack_block
+from compression import COMPRESSION_KINDS, reconstruct
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# sensor the readings belong to when no sensor is given, the only one of a single-sensor setup
+DEFAULT_SENSOR_ID = "main"
+
+# bucket sizes in seconds of the sensor_rollup aggregates (minute, hour, day)
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+# label of the aggregates of every rollup resolution
+RESOLUTION_LABELS = {60: 'per-minute', 3600: 'hourly', 86400: 'daily'}
+
+# time column of every table expire() may prune, the names are put into the SQL text
+EXPIRE_COLUMNS = {"sensor_data": "ts", "sensor_rollup": "bucket", "sensor_blocks": "end_ts", "system_metrics": "ts"}
+
+# columns of every field /stats summarizes: (raw sensor_data column, sensor_rollup column prefix)
+STATS_FIELDS = {"temperature": ("temperature", "temp"), "humidity": ("humidity", "hum")}
+
+ROLLUP_UPSERT = """
+INSERT INTO sensor_rollup VALUES (?, ?, ?, 1, ?, ? * ?, ?, ?, ?, ? * ?, ?, ?)
+ON CONFLICT (sensor_id, resolution, bucket) DO UPDATE SET
+   count = count + 1,
+   temp_sum = temp_sum + excluded.temp_sum, temp_sumsq = temp_sumsq + excluded.temp_sumsq,
+   temp_min = MIN(temp_min, excluded.temp_min), temp_max = MAX(temp_max, excluded.temp_max),
+   hum_sum = hum_sum + excluded.hum_sum, hum_sumsq = hum_sumsq + excluded.hum_sumsq,
+   hum_min = MIN(hum_min, excluded.hum_min), hum_max = MAX(hum_max, excluded.hum_max)
+"""
+
 class DataBaseHandler:
 
     """
     A class to handle interactions with an SQLite database for storing and retrieving sensor data.
 
+    The connections belong to the connection manager of the database file, every handler
+    of the same file shares its writer and its pool of read-only connections.
+
     Attributes:
-      connection: The connection object to the SQLite database.
-      cursor: The cursor object for executing SQL commands.
+      db_name (str): The name of the SQLite database file.
+      batch_size (int): Number of buffered readings that triggers a flush.
+      flush_interval (float): Seconds a reading may stay buffered, 0 to flush on size only.
     """
-    def __init__(self, db_name):
+    def __init__(self, db_name, batch_size=1, flush_interval=0):
         """
-        Initializes the daatabase connection and cursor.
-      
+        Initializes the write buffers, the connections are borrowed from connection_manager per query.
+        The database is switched to WAL mode, so readers never block the writer and the other way around.
+
         Args:
             db_name (str): The name of the SQLite database file.
+            batch_size (int): Number of buffered readings that triggers a flush, 1 writes every reading immediately.
+            flush_interval (float): Seconds a reading may stay buffered, 0 to flush on size only.
         """
-
-        self.connection = sqlite3.connect(db_name)
-        #self.connection.row_factory = sqlite3.Row
-        self.cursor = self.connection.cursor()
+        self.db_name = db_name
+        self._manager = get_manager(db_name)
+        # the flush timer flushes from its own thread, every access to the buffers holds self._lock
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._system_buffer = []
+        # readings folded into the aggregates, also those that are not stored
+        self._rollup_buffer = []
+        self._pending = 0
+        self._lock = threading.RLock()
+        self._timer = None
     
-    def insert_sensor_data(self, data) -> None:
+    def insert_sensor_data(self, data, aggregate=True) -> None:
         """
-        Insert sensor data (temperature and humidity) into the database.
+        Insert sensor data (temperature, humidity, pressure, gas and air quality) into the database.
+        Readings are buffered until `batch_size` of them are collected or `flush_interval` elapsed.
 
         Args:
             data (dict): A dictionary containing sensor readings with keys:
                 - 'temperature' (float)
                 - 'humidity' (float)
+                - 'pressure' (float, optional)
+                - 'gas_resistance' (float, optional): None if the heater was not stable
+                - 'air_quality' (float, optional): None until the sensor is stabilized
+                - 'timestamp' (float, optional): epoch seconds of the reading, defaults to now
+                - 'sensor_id' (str, optional): sensor that took the reading, defaults to DEFAULT_SENSOR_ID
+            aggregate (bool): Fold the reading into the aggregates, False if aggregate_sensor_data()
+                already did when the reading was taken.
+        """
+        row = self._sensor_row(data)
+        self._append((self._buffer, row), *([(self._rollup_buffer, row)] if aggregate else []))
+
+    def aggregate_sensor_data(self, data) -> None:
+        """
+        Fold a reading into the minute, hour and day aggregates without storing it, e.g. a reading
+        compression dropped. The aggregates then count every reading, not only the stored ones.
+
+        Args:
+            data (dict): A reading like for insert_sensor_data().
+        """
+        self._append((self._rollup_buffer, self._sensor_row(data)))
+
+    @staticmethod
+    def _sensor_row(data) -> tuple:
+        ts = int(data.get('timestamp', time.time()))
+        return (ts, data['temperature'], data['humidity'], data.get('pressure'),
+                data.get('gas_resistance'), data.get('air_quality'), data.get('sensor_id', DEFAULT_SENSOR_ID))
+
+    def insert_system_metrics(self, data) -> None:
+        """
+        Insert a Raspberry Pi health sample into the system_metrics table.
+        Samples are buffered like the sensor readings, `batch_size` of them are written per transaction.
+        They only share a transaction with sensor readings buffered by the same handler;
+        fill_system_metrics and fill_database each use their own.
+
+        Args:
+            data (dict): A dictionary with keys:
+                - 'cpu_temp' (float): CPU temperature in C, None if unknown
+                - 'cpu_percent' (float): CPU load in %, None if unknown
+                - 'mem_used_pct' (float): used memory in %
+                - 'mem_available_mb' (float): available memory in MB
+                - 'uptime' (float): uptime in seconds
+                - 'timestamp' (float, optional): epoch seconds of the sample, defaults to now
+        """
+        ts = int(data.get('timestamp', time.time()))
+        self._append((self._system_buffer, (ts, data['cpu_temp'], data['cpu_percent'],
+                                            data['mem_used_pct'], data['mem_available_mb'], int(data['uptime']))))
+
+    def _append(self, *entries) -> None:
+        # entries are (buffer, row) pairs of one reading, it counts once towards batch_size
+        with self._lock:
+            for buffer, row in entries:
+                buffer.append(row)
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self.flush()
+            elif self.flush_interval and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        """
+        Write the buffered readings with one executemany in a single transaction.
+        The minute, hour and day aggregates are updated in the same transaction.
         """
-        try:
-           query = "INSERT INTO sensor_data (temperature, humidity) VALUES (?, ?)"
-           self.cursor.execute(query, (data['temperature'], data['humidity']))
-           self.connection.commit()
-        except sqlite3.Error as e:
-           logging.error(f"Database error: {e}")
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            rows, self._buffer = self._buffer, []
+            system_rows, self._system_buffer = self._system_buffer, []
+            rollup_rows, self._rollup_buffer = self._rollup_buffer, []
+            self._pending = 0
+            if not rows and not system_rows and not rollup_rows:
+                return
+            with self._manager.writer() as connection:
+                try:
+                   with metrics.DB_COMMIT_SECONDS.time():
+                       if rows:
+                           query = ("INSERT INTO sensor_data (ts, temperature, humidity, pressure, gas_resistance, "
+                                    "air_quality, sensor_id) VALUES (?, ?, ?, ?, ?, ?, ?)")
+                           connection.executemany(query, rows)
+                       if rollup_rows:
+                           self._update_rollups(connection, rollup_rows)
+                       if system_rows:
+                           # two samples within the same second replace each other
+                           query = "INSERT OR REPLACE INTO system_metrics VALUES (?, ?, ?, ?, ?, ?)"
+                           connection.executemany(query, system_rows)
+                       connection.commit()
+                   if rows:
+                       metrics.DB_ROWS_WRITTEN.inc(len(rows), table="sensor_data")
+                   if system_rows:
+                       metrics.DB_ROWS_WRITTEN.inc(len(system_rows), table="system_metrics")
+                except sqlite3.Error as e:
+                   connection.rollback()
+                   logging.error(f"Database error, {len(rows) + len(system_rows)} readings lost: {e}")
     
-    def get_hours_data(self, hours) -> list:
+    @staticmethod
+    def _update_rollups(connection, rows) -> None:
+        """
+        Fold readings into the sensor_rollup aggregates.
+
+        Args:
+          connection (sqlite3.Connection): The writer, inside the transaction inserting the readings.
+          rows (list of tuples): (epoch seconds, temperature, humidity, ..., sensor id) of every reading.
+        """
+        connection.executemany(ROLLUP_UPSERT, (
+            (sensor_id, resolution, ts // resolution * resolution, t, t, t, t, t, h, h, h, h, h)
+            for ts, t, h, *_, sensor_id in rows
+            for resolution in ROLLUP_RESOLUTIONS
+        ))
+
+    def insert_sensor_block(self, block, sensor_id=DEFAULT_SENSOR_ID) -> None:
+        """
+        Write a block of high-rate readings as one packed row, in its own transaction.
+
+        Args:
+            block (dict of np.ndarray): 'ts' and every field of ring_buffer.FIELDS, oldest reading first.
+            sensor_id (str): Sensor that took the readings.
+        """
+        import numpy as np
+        count = len(block['ts'])
+        if not count:
+            return
+        with self._manager.writer() as connection:
+            try:
+                with metrics.DB_COMMIT_SECONDS.time():
+                    connection.execute("INSERT INTO sensor_blocks VALUES (?, ?, ?, ?, ?)",
+                                       (float(block['ts'][0]), float(block['ts'][-1]), count, pack_block(block),
+                                        sensor_id))
+                    connection.commit()
+                metrics.DB_ROWS_WRITTEN.inc(count, table="sensor_blocks")
+            except sqlite3.Error:
+                connection.rollback()
+                raise
+
+    def get_sensor_blocks(self, since, until=None, sensor_id=DEFAULT_SENSOR_ID) -> dict:
+        """
+        Retrieves the high-rate readings of a sensor stored between {since} and {until}.
+
+        Args:
+          since (float): Epoch seconds, older readings are skipped.
+          until (float): Epoch seconds, newer readings are skipped, None for no limit.
+          sensor_id (str): Sensor whose readings are retrieved.
+
+        Returns:
+          dict of np.ndarray with keys 'ts' and every field of ring_buffer.FIELDS, oldest first.
+        """
+        import numpy as np
+        until = float('inf') if until is None else until
+        query = ("SELECT count, data FROM sensor_blocks WHERE end_ts >= ? AND start_ts <= ? AND sensor_id = ? "
+                 "ORDER BY start_ts")
+        with metrics.DB_QUERY_SECONDS.time(query="sensor_blocks"), self._manager.reader() as connection:
+            blocks = [unpack_block(data, count) for count, data in connection.execute(query, (since, until, sensor_id))]
+        names = ('ts',) + FIELDS
+        if not blocks:
+            return {name: np.empty(0, dtype=np.float64 if name == 'ts' else np.float32) for name in names}
+        columns = {name: np.concatenate([block[name] for block in blocks]) for name in names}
+        mask = (columns['ts'] >= since) & (columns['ts'] <= until)
+        return {name: column[mask] for name, column in columns.items()}
+
+    def get_hours_data(self, hours, sensor_id=DEFAULT_SENSOR_ID) -> list:
         """
         Retrieves sensor data from the last {hours}.
         
         Args:
           hours (int): The number of hours to retrieve data for.
+          sensor_id (str): Sensor whose readings are retrieved.
     
         Returns:
           list of tuples, where each tuple represent a row from table: 
-            (ID, Timestamp, Temperature, Humidity)
+            (ID, Timestamp (epoch seconds), Temperature, Humidity)
         """
         
-        query = f"SELECT * FROM sensor_data WHERE timestamp >= datetime('now', '-{hours} hours')" 
-        self.cursor.execute(query)
-        last_hours_data = self.cursor.fetchall()
-        #print(type(last_hours_data))
-        #print(last_hours_data)
+        query = "SELECT id, ts, temperature, humidity FROM sensor_data WHERE sensor_id = ? AND ts >= ? ORDER BY ts"
+        with metrics.DB_QUERY_SECONDS.time(query="hours_data"), self._manager.reader() as connection:
+            last_hours_data = connection.execute(query, (sensor_id, self._since(hours))).fetchall()
         return last_hours_data
 
+    def iter_sensor_data(self, since, batch_size=1000, sensor_id=DEFAULT_SENSOR_ID):
+        """
+        Stream every field of the sensor readings newer than {since}, {batch_size} rows at a time.
+        Every batch borrows a read-only connection only while it is fetched, so a slow consumer,
+        e.g. an upload of the export, does not keep a connection from the other queries.
+
+        Args:
+          since (float): Epoch seconds, older readings are skipped.
+          batch_size (int): Rows fetched from SQLite at once.
+          sensor_id (str): Sensor whose readings are streamed.
+
+        Yields:
+          list of tuples: (ts, temperature, humidity, pressure, gas_resistance, air_quality), oldest first.
+        """
+        # the next batch starts after the (ts, id) of the last row, ids are positive
+        last = (since, -1)
+        while True:
+            with self._manager.reader() as connection:
+                rows = connection.execute("SELECT id, ts, temperature, humidity, pressure, gas_resistance, air_quality "
+                                          "FROM sensor_data WHERE sensor_id = ? AND (ts, id) > (?, ?) "
+                                          "ORDER BY ts, id LIMIT ?",
+                                          (sensor_id, *last, batch_size)).fetchall()
+            if not rows:
+                return
+            last = (rows[-1][1], rows[-1][0])
+            yield [row[1:] for row in rows]
+            if len(rows) < batch_size:
+                return
+
+    def get_hours_series(self, hours, sensor_id=DEFAULT_SENSOR_ID, points=None) -> tuple:
+        """
+        Retrieves sensor data from the last {hours} as ready-to-plot arrays.
+        The rows go straight from the cursor into NumPy, no intermediate list of tuples is built.
+
+        Args:
+          hours (int): The number of hours to retrieve data for.
+          sensor_id (str): Sensor whose readings are retrieved.
+          points (int): If the sensor is compressed (see set_compression), rebuild the series at
+            this many evenly spaced times, NaN where nothing was recorded. None for the stored rows.
+
+        Returns:
+          tuple of np.ndarray: (timestamps as epoch seconds, temperatures, humidity)
+        """
+        import numpy as np
+        compression = self.get_compression(sensor_id) if points else None
+        since = self._since(hours)
+        query = ("SELECT ts, temperature, humidity FROM sensor_data "
+                 "WHERE sensor_id = ? AND ts >= ? AND temperature IS NOT NULL AND humidity IS NOT NULL ORDER BY ts")
+        with metrics.DB_QUERY_SECONDS.time(query="hours_series"), self._manager.reader() as connection:
+            start = since - compression[1] if compression else since
+            rows = np.fromiter(connection.execute(query, (sensor_id, start)), dtype=[('ts', np.int64), ('temperature', np.float64), ('humidity', np.float64)])
+        if compression is None:
+            return rows['ts'], rows['temperature'], rows['humidity']
+        grid = np.linspace(since, time.time(), points).astype(np.int64)
+        return (grid, reconstruct(rows['ts'], rows['temperature'], grid, *compression),
+                reconstruct(rows['ts'], rows['humidity'], grid, *compression))
+
+    def set_compression(self, sensor_id, kind, max_gap) -> None:
+        """
+        Record how the readings of `sensor_id` are compressed from now on.
+
+        Args:
+          sensor_id (str): The sensor.
+          kind (str): One of compression.COMPRESSION_KINDS, None if every reading is stored.
+          max_gap (float): Seconds two stored readings are apart at most while the sensor is recording.
+        """
+        with self._manager.writer() as connection:
+            try:
+                if kind is None:
+                    connection.execute("DELETE FROM sensor_compression WHERE sensor_id = ?", (sensor_id,))
+                else:
+                    connection.execute("INSERT OR REPLACE INTO sensor_compression VALUES (?, ?, ?)",
+                                       (sensor_id, kind, max_gap))
+                connection.commit()
+            except sqlite3.Error:
+                connection.rollback()
+                raise
+
+    def get_compression(self, sensor_id=DEFAULT_SENSOR_ID) -> tuple:
+        """
+        How the stored readings of `sensor_id` are rebuilt.
+
+        Returns:
+          tuple: ('step' or 'linear', max gap in seconds), None if every reading is stored.
+        """
+        with self._manager.reader() as connection:
+            row = connection.execute("SELECT kind, max_gap FROM sensor_compression WHERE sensor_id = ?",
+                                     (sensor_id,)).fetchone()
+        return None if row is None else (COMPRESSION_KINDS[row[0]], row[1])
+
+    def get_database_id(self) -> str:
+        """
+        The random id migrate_db gave this database, it changes when the file is recreated.
+        """
+        with self._manager.reader() as connection:
+            return connection.execute("SELECT value FROM database_info WHERE key = 'id'").fetchone()[0]
+
+    def get_hours_fields(self, hours, fields=("temperature", "humidity", "pressure"),
+                         sensor_id=DEFAULT_SENSOR_ID) -> dict:
+        """
+        Retrieves some fields of the sensor data from the last {hours} as arrays, straight from the cursor.
+
+        Args:
+          hours (float): The number of hours to retrieve data for.
+          fields (tuple of str): Columns to retrieve, any of ring_buffer.FIELDS.
+          sensor_id (str): Sensor whose readings are retrieved.
+
+        Returns:
+          dict of np.ndarray: 'ts' (epoch seconds) and every field, missing values as NaN.
+        """
+        import numpy as np
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown sensor fields: {', '.join(sorted(unknown))}")
+        query = (f"SELECT ts, {', '.join(fields)} FROM sensor_data "
+                 "WHERE sensor_id = ? AND ts >= ? ORDER BY ts")
+        dtype = [('ts', np.int64)] + [(field, np.float64) for field in fields]
+        with metrics.DB_QUERY_SECONDS.time(query="hours_fields"), self._manager.reader() as connection:
+            cursor = connection.execute(query, (sensor_id, self._since(hours)))
+            # NULL becomes NaN on the way into the float columns
+            rows = np.fromiter(((ts, *(np.nan if v is None else v for v in values)) for ts, *values in cursor),
+                               dtype=dtype)
+        return {name: rows[name] for name, _ in dtype}
+
+    def pick_resolution(self, hours, max_points, sensor_id=DEFAULT_SENSOR_ID) -> int:
+        """
+        Choose the finest data source that still fits {max_points} points for the last {hours}.
+
+        Args:
+          hours (int): The number of hours to plot.
+          max_points (int): The number of points the plot can show.
+          sensor_id (str): Sensor whose readings are plotted.
+
+        Returns:
+          int: 0 for the raw rows, otherwise the rollup bucket size in seconds.
+        """
+        since = self._since(hours)
+        # count at most max_points + 1 rows through the index, never the whole range
+        query = "SELECT COUNT(*) FROM (SELECT 1 FROM sensor_data WHERE sensor_id = ? AND ts >= ? LIMIT ?)"
+        with metrics.DB_QUERY_SECONDS.time(query="pick_resolution"), self._manager.reader() as connection:
+            count = connection.execute(query, (sensor_id, since, max_points + 1)).fetchone()[0]
+            # where every source starts, expired data must not make a source look complete
+            starts = [(0, connection.execute("SELECT MIN(ts) FROM sensor_data WHERE sensor_id = ?",
+                                             (sensor_id,)).fetchone()[0])]
+            for resolution in ROLLUP_RESOLUTIONS:
+                start = connection.execute("SELECT MIN(bucket) FROM sensor_rollup WHERE sensor_id = ? AND resolution = ?",
+                                           (sensor_id, resolution)).fetchone()[0]
+                starts.append((resolution, start))
+
+        for i, (resolution, start) in enumerate(starts):
+            fits = count <= max_points if resolution == 0 else float(hours) * 3600 / resolution <= max_points
+            # a source is cut off by retention if a coarser one holds a whole bucket before its first entry
+            expired = start is None or (since < start and any(
+                coarser_start is not None and coarser_start + coarser <= start
+                for coarser, coarser_start in starts[i + 1:]))
+            if fits and not expired:
+                return resolution
+        return 0 if all(start is None for _, start in starts) else ROLLUP_RESOLUTIONS[-1]
+
+    def get_hours_rollup(self, hours, resolution, sensor_id=DEFAULT_SENSOR_ID) -> dict:
+        """
+        Retrieves the aggregates of one resolution from the last {hours} as ready-to-plot arrays.
+
+        Args:
+          hours (int): The number of hours to retrieve data for.
+          resolution (int): Bucket size in seconds, one of ROLLUP_RESOLUTIONS.
+          sensor_id (str): Sensor whose aggregates are retrieved.
+
+        Returns:
+          dict of np.ndarray with keys 'ts' (bucket middle, epoch seconds), 'count',
+          'temp_avg', 'temp_min', 'temp_max', 'hum_avg', 'hum_min', 'hum_max'.
+        """
+        import numpy as np
+        query = ("SELECT bucket + ? / 2, count, temp_sum / count, temp_min, temp_max, "
+                 "hum_sum / count, hum_min, hum_max FROM sensor_rollup "
+                 "WHERE sensor_id = ? AND resolution = ? AND bucket >= ? ORDER BY bucket")
+        # the bucket holding the range start is included, so the plot reaches the left edge
+        since = self._since(hours) // resolution * resolution
+        fields = ['ts', 'count', 'temp_avg', 'temp_min', 'temp_max', 'hum_avg', 'hum_min', 'hum_max']
+        dtype = [('ts', np.int64), ('count', np.int64)] + [(name, np.float64) for name in fields[2:]]
+        with metrics.DB_QUERY_SECONDS.time(query="hours_rollup"), self._manager.reader() as connection:
+            rows = np.fromiter(connection.execute(query, (resolution, sensor_id, resolution, since)), dtype=dtype)
+        return {name: rows[name] for name in fields}
+
+    def get_hours_stats(self, hours, sensor_id=DEFAULT_SENSOR_ID, percentiles=(0.05, 0.5, 0.95),
+                        max_rows=2000, max_percentile_rows=20000) -> dict:
+        """
+        Summarize the last {hours} inside SQLite: min, max, average, standard deviation and
+        percentiles of every field of STATS_FIELDS, and the average per hour of the day.
+
+        Like the graphs, the finest source holding at most {max_rows} rows in the range is
+        aggregated (see pick_resolution()), so the work is bounded however long the range is.
+        From a rollup the standard deviation is still exact (from the sums of squares), but the
+        first bucket may start before the range. Percentiles need the values sorted, they are
+        computed from the raw rows up to {max_percentile_rows} of them, beyond that from the
+        bucket averages weighted by their counts, which narrows the spread. Only a few rows reach Python.
+
+        Args:
+          hours (float): The number of hours to summarize.
+          sensor_id (str): Sensor whose readings are summarized.
+          percentiles (tuple of float): Percentiles to compute, between 0 and 1.
+          max_rows (int): Rows or buckets aggregated for the totals and the hourly profile.
+          max_percentile_rows (int): Rows or buckets sorted for the percentiles.
+
+        Returns:
+          dict: 'resolution' and 'percentile_resolution' (0 for the raw rows, else the bucket size),
+          'count' (readings), 'first' and 'last' (epoch seconds), for every field a dict with 'min',
+          'max', 'avg', 'stddev' and 'p5', 'p50', ... (None without data), and 'profile' mapping the
+          local hour of the day to a dict of field averages (empty for the daily rollup, which has no hour).
+        """
+        since = self._since(hours)
+        resolution = self.pick_resolution(hours, max_rows, sensor_id)
+        stats = {"resolution": resolution}
+        with metrics.DB_QUERY_SECONDS.time(query="hours_stats"), self._manager.reader() as connection:
+            # one pass for the totals of every field
+            table, time_column, where, params, count, columns = self._stats_source(resolution, sensor_id, since)
+            totals = ", ".join(", ".join(expressions[2:]) for expressions in columns.values())
+            row = connection.execute(f"SELECT {count}, MIN({time_column}), MAX({time_column}), {totals} "
+                                     f"FROM {table} WHERE {where}", params).fetchone()
+            stats["count"], stats["first"], stats["last"] = row[0] or 0, row[1], row[2]
+            for i, field in enumerate(columns):
+                total, total_sq, n, low, high = row[3 + 5 * i: 8 + 5 * i]
+                summary = {"min": low, "max": high, "avg": None, "stddev": None}
+                if n:
+                    summary["avg"] = total / n
+                    # sample variance from the sums, rounding may leave a tiny negative value
+                    summary["stddev"] = math.sqrt(max(total_sq - total * total / n, 0.0) / (n - 1)) if n > 1 else 0.0
+                stats[field] = summary
+
+            # average per hour of the day, at most 24 rows
+            stats["profile"] = {}
+            if resolution < 86400:
+                averages = ", ".join(f"{total} / {n}" for _, _, total, _, n, _, _ in columns.values())
+                for hour, *values in connection.execute(
+                        f"SELECT CAST(strftime('%H', {time_column}, 'unixepoch', 'localtime') AS INTEGER) AS hour, "
+                        f"{averages} FROM {table} WHERE {where} GROUP BY hour ORDER BY hour", params):
+                    stats["profile"][hour] = dict(zip(columns, values))
+
+        percentile_resolution = resolution
+        if resolution and max_percentile_rows > max_rows:
+            percentile_resolution = self.pick_resolution(hours, max_percentile_rows, sensor_id)
+        stats["percentile_resolution"] = percentile_resolution
+        with metrics.DB_QUERY_SECONDS.time(query="hours_percentiles"), self._manager.reader() as connection:
+            # the running count over the values in ascending order reaches q * total first
+            # at the q-th percentile, a window function computes it in the same sort
+            table, _, where, params, _, columns = self._stats_source(percentile_resolution, sensor_id, since)
+            picks = ", ".join(f"MIN(CASE WHEN running >= {q!r} * total THEN v END)" for q in percentiles)
+            for field, (value, weight, *_) in columns.items():
+                row = connection.execute(
+                    f"SELECT {picks} FROM (SELECT v, SUM(w) OVER (ORDER BY v ROWS UNBOUNDED PRECEDING) AS running, "
+                    f"SUM(w) OVER () AS total FROM (SELECT {value} AS v, {weight} AS w FROM {table} "
+                    f"WHERE {where} AND {value} IS NOT NULL))", params).fetchone()
+                for q, result in zip(percentiles, row):
+                    stats[field][f"p{round(q * 100)}"] = result
+        return stats
+
+    @staticmethod
+    def _stats_source(resolution, sensor_id, since) -> tuple:
+        """
+        SQL pieces get_hours_stats() aggregates, for the raw rows (resolution 0) or one rollup.
+
+        Returns:
+          tuple: (table, time column, where clause, its parameters, count of readings,
+          per field: (value of a row, weight of a row, sum, sum of squares, count, min, max)).
+        """
+        if resolution:
+            columns = {field: (f"{prefix}_sum / count", "count", f"SUM({prefix}_sum)", f"SUM({prefix}_sumsq)",
+                               "SUM(count)", f"MIN({prefix}_min)", f"MAX({prefix}_max)")
+                       for field, (_, prefix) in STATS_FIELDS.items()}
+            return ("sensor_rollup", "bucket", "sensor_id = ? AND resolution = ? AND bucket >= ?",
+                    (sensor_id, resolution, since // resolution * resolution), "SUM(count)", columns)
+        columns = {field: (column, "1", f"SUM({column})", f"SUM({column} * {column})",
+                           f"COUNT({column})", f"MIN({column})", f"MAX({column})")
+                   for field, (column, _) in STATS_FIELDS.items()}
+        return "sensor_data", "ts", "sensor_id = ? AND ts >= ?", (sensor_id, since), "COUNT(*)", columns
+
+    def get_hours_system_metrics(self, hours) -> dict:
+        """
+        Retrieves the Raspberry Pi health samples from the last {hours} as ready-to-plot arrays.
+
+        Args:
+          hours (int): The number of hours to retrieve data for.
+
+        Returns:
+          dict of np.ndarray with keys 'ts' (epoch seconds), 'cpu_temp', 'cpu_percent',
+          'mem_used_pct', 'mem_available_mb', 'uptime'. Missing values are NaN.
+        """
+        import numpy as np
+        query = ("SELECT ts, cpu_temp, cpu_percent, mem_used_pct, mem_available_mb, uptime "
+                 "FROM system_metrics WHERE ts >= ? ORDER BY ts")
+        fields = ['ts', 'cpu_temp', 'cpu_percent', 'mem_used_pct', 'mem_available_mb', 'uptime']
+        dtype = [('ts', np.int64)] + [(name, np.float64) for name in fields[1:]]
+        nan = float('nan')
+        with metrics.DB_QUERY_SECONDS.time(query="hours_system_metrics"), self._manager.reader() as connection:
+            cursor = connection.execute(query, (self._since(hours),))
+            rows = np.fromiter(((ts, *(nan if v is None else v for v in values)) for ts, *values in cursor),
+                               dtype=dtype)
+        return {name: rows[name] for name in fields}
+
+    def get_hours_range(self, hours, source="sensor", sensor_id=DEFAULT_SENSOR_ID) -> tuple:
+        """
+        Retrieves the keys of the first and last rows from the last {hours}.
+        Together they identify the data a graph of that range is drawn from.
+
+        Args:
+          hours (int): The number of hours to look back.
+          source (str): 'sensor' for sensor_data (row ids), 'system' for system_metrics (timestamps).
+          sensor_id (str): Sensor whose rows are looked up, for the 'sensor' source.
+
+        Returns:
+          tuple: (first key, last key), both None if there is no data in the range.
+        """
+        if source == "system":
+            query, params = "SELECT MIN(ts), MAX(ts) FROM system_metrics WHERE ts >= ?", (self._since(hours),)
+        else:
+            query = "SELECT MIN(id), MAX(id) FROM sensor_data WHERE sensor_id = ? AND ts >= ?"
+            params = (sensor_id, self._since(hours))
+        with metrics.DB_QUERY_SECONDS.time(query="hours_range"), self._manager.reader() as connection:
+            return connection.execute(query, params).fetchone()
+
+    def expire(self, table, column, before, batch_size, where="", params=()) -> int:
+        """
+        Delete one batch of the oldest rows of {table} whose {column} is older than {before}.
+        Each batch is its own short transaction, so the writers are never blocked for long.
+
+        Args:
+          table (str): Table to prune, one of EXPIRE_COLUMNS.
+          column (str): Indexed time column, epoch seconds, the one EXPIRE_COLUMNS names for {table}.
+          before (float): Rows with an older {column} are deleted.
+          batch_size (int): Number of rows deleted at most (rows sharing the last time are deleted too).
+          where (str): Extra SQL condition, e.g. "resolution = ?".
+          params (tuple): Parameters of `where`.
+
+        Returns:
+          int: Number of rows deleted, 0 once nothing older than {before} is left.
+
+        Raises:
+          ValueError: If {table} and {column} are not listed in EXPIRE_COLUMNS.
+        """
+        if EXPIRE_COLUMNS.get(table) != column:
+            raise ValueError(f"Cannot expire {table}.{column}")
+        condition = f"{where} AND " if where else ""
+        with self._manager.writer() as connection:
+            try:
+                # the newest time of the batch is found through the index, the delete is a plain range
+                row = connection.execute(f"SELECT {column} FROM {table} WHERE {condition}{column} < ? "
+                                         f"ORDER BY {column} LIMIT 1 OFFSET ?",
+                                         (*params, before, batch_size - 1)).fetchone()
+                if row is None:
+                    cursor = connection.execute(f"DELETE FROM {table} WHERE {condition}{column} < ?", (*params, before))
+                else:
+                    cursor = connection.execute(f"DELETE FROM {table} WHERE {condition}{column} <= ?", (*params, row[0]))
+                deleted = cursor.rowcount
+                connection.commit()
+            except sqlite3.Error:
+                connection.rollback()
+                raise
+        if deleted:
+            metrics.DB_ROWS_EXPIRED.inc(deleted, table=table)
+        return deleted
+
+    def incremental_vacuum(self, pages) -> int:
+        """
+        Give up to {pages} free pages back to the file system (needs auto_vacuum=INCREMENTAL, see migrate_db).
+
+        Returns:
+          int: Number of free pages left in the file.
+        """
+        self.flush()
+        with self._manager.writer() as connection:
+            # executescript steps the pragma to completion, execute() would free a single page
+            connection.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            return connection.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def checkpoint(self) -> None:
+        """
+        Copy the WAL into the database file and truncate it, if no reader is in the way.
+        """
+        with self._manager.writer() as connection:
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    @staticmethod
+    def _since(hours) -> int:
+        """
+        Epoch second at which a range of the last {hours} starts.
+        """
+        return int(time.time() - float(hours) * 3600)
+
     def close(self):
-        self.connection.close()
+        """
+        Flush the buffered readings. The connections stay open for the other handlers of
+        the file, connection_manager.close_all() closes them when the bot stops.
+        """
+        self.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+import numpy as np
+
+
+def target_points(width_inches, dpi, pixels_per_point=2) -> int:
+    """
+    Number of points worth plotting on a figure of the given width.
+    More points than horizontal pixels cannot be told apart on the PNG.
+
+    Args:
+        width_inches (float): Width of the figure in inches.
+        dpi (int): Resolution the figure is saved with.
+        pixels_per_point (int): Horizontal pixels reserved for every point.
+
+    Returns:
+        int: The number of points to keep per series.
+    """
+    return max(3, int(width_inches * dpi / pixels_per_point))
+
+
+def lttb(x, y, n_out) -> tuple:
+    """
+    Downsample a series with Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept, the points in between are split into
+    `n_out - 2` buckets and from every bucket the point forming the largest
+    triangle with the previously kept point and the average of the next bucket is kept.
+    This keeps the visual shape (peaks and dips) of the series.
+
+    Args:
+        x (np.ndarray): Increasing x values, e.g. epoch seconds.
+        y (np.ndarray): Values of the series.
+        n_out (int): Number of points to keep.
+
+    Returns:
+        tuple: (x, y) arrays with at most `n_out` points.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # bucket boundaries of the inner points [1, n - 1)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # average point of every bucket, used as the third corner of the triangle
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    avg_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+    avg_x = np.append(avg_x, x[-1])
+    avg_y = np.append(avg_y, y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        bx = x[start:end]
+        by = y[start:end]
+        # twice the triangle area, the constant factor does not change the argmax
+        area = np.abs((x[prev] - avg_x[i + 1]) * (by - y[prev])
+                      - (x[prev] - bx) * (avg_y[i + 1] - y[prev]))
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+    return x[selected], y[selected]
+
+
+def min_max_mean(x, y, n_buckets) -> tuple:
+    """
+    Aggregate a series into equally sized buckets.
+
+    Args:
+        x (np.ndarray): Increasing x values, e.g. epoch seconds.
+        y (np.ndarray): Values of the series.
+        n_buckets (int): Number of buckets.
+
+    Returns:
+        tuple: (x, y_min, y_max, y_mean) arrays with one value per bucket,
+        x being the mean x of the bucket.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_buckets >= n:
+        return x, y, y, y
+
+    starts = np.linspace(0, n, n_buckets, endpoint=False).astype(np.int64)
+    counts = np.diff(np.append(starts, n))
+    return (np.add.reduceat(x, starts) / counts,
+            np.minimum.reduceat(y, starts),
+            np.maximum.reduceat(y, starts),
+            np.add.reduceat(y, starts) / counts)
@@ -0,0 +1,126 @@
+import csv
+import gzip
+import io
+import logging
+import re
+import struct
+import tempfile
+import time
+from db_handler import DataBaseHandler, DEFAULT_SENSOR_ID
+from ring_buffer import pack_block
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# file extension of every export format
+EXPORT_FORMATS = {"csv": ".csv.gz", "bin": ".bin.gz"}
+
+# columns of the exported readings, in the order of DataBaseHandler.iter_sensor_data()
+COLUMNS = ("ts", "temperature", "humidity", "pressure", "gas_resistance", "air_quality")
+
+# header of every chunk of the binary format: magic, number of readings
+BIN_CHUNK_HEADER = struct.Struct("<4sI")
+BIN_MAGIC = b"PCB1"
+
+# Telegram bots may upload documents up to 50 MB
+MAX_PART_BYTES = 45 * 2**20
+
+RANGE_UNITS = {"h": 1, "d": 24, "w": 24 * 7}
+
+
+def parse_range(text) -> float:
+    """
+    Parse an export range like '12', '36h', '7d', '2w' or 'all'.
+
+    Returns:
+        float: The range in hours, None for the whole history.
+
+    Raises:
+        ValueError: If the text is not a valid range.
+    """
+    if text.lower() == "all":
+        return None
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([hdw]?)", text.lower())
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"Invalid export range: {text}")
+    return float(match.group(1)) * RANGE_UNITS[match.group(2) or "h"]
+
+
+def _encode_csv(rows, header) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(COLUMNS[:1] + ("time",) + COLUMNS[1:])
+    for ts, *values in rows:
+        writer.writerow([ts, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)),
+                         *("" if v is None else v for v in values)])
+    return buffer.getvalue().encode()
+
+
+def _encode_bin(rows, header) -> bytes:
+    # one self-contained chunk per batch: the readings packed column by column, see ring_buffer.pack_block()
+    import numpy as np
+    columns = np.array(rows, dtype=np.float64)
+    block = {name: columns[:, i] for i, name in enumerate(COLUMNS)}
+    return BIN_CHUNK_HEADER.pack(BIN_MAGIC, len(rows)) + pack_block(block)
+
+
+def export_parts(db_name, hours, fmt="csv", max_part_bytes=MAX_PART_BYTES, batch_size=1000,
+                 sensor_id=DEFAULT_SENSOR_ID):
+    """
+    Stream the sensor readings of the last {hours} into gzip-compressed files of at most
+    about {max_part_bytes} each. Rows go from the cursor through the compressor into a
+    temporary file batch by batch, so memory use does not depend on the size of the range.
+
+    The 'csv' format has a header line in every part. The 'bin' format is a sequence of
+    chunks, each a BIN_CHUNK_HEADER followed by the readings packed like ring_buffer.pack_block().
+
+    Args:
+        db_name (str): The name of the SQLite database file.
+        hours (float): The number of past hours to export, None for everything.
+        fmt (str): 'csv' or 'bin'.
+        max_part_bytes (int): Compressed size after which a new part is started.
+        batch_size (int): Rows read and encoded at once.
+        sensor_id (str): Sensor whose readings are exported.
+
+    Yields:
+        tuple: (file name, file object positioned at the start, number of rows), the caller closes the file.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    encode = _encode_csv if fmt == "csv" else _encode_bin
+    since = 0 if hours is None else time.time() - hours * 3600
+    stamp = time.strftime("%Y%m%d-%H%M")
+    if sensor_id != DEFAULT_SENSOR_ID:
+        stamp = f"{sensor_id}_{stamp}"
+
+    db = DataBaseHandler(db_name)
+    raw = compressor = None
+    rows_in_part = 0
+    try:
+        number = 0
+        for rows in db.iter_sensor_data(since, batch_size, sensor_id):
+            if compressor is None:
+                number += 1
+                raw = tempfile.TemporaryFile()
+                compressor = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+                rows_in_part = 0
+            compressor.write(encode(rows, header=rows_in_part == 0))
+            rows_in_part += len(rows)
+            # the compressor holds back a few hundred KB at most, well within the margin to the upload limit
+            if raw.tell() >= max_part_bytes:
+                compressor.close()
+                raw.seek(0)
+                part, raw, compressor = raw, None, None
+                yield f"sensor_data_{stamp}_part{number}{EXPORT_FORMATS[fmt]}", part, rows_in_part
+        if compressor is not None:
+            compressor.close()
+            raw.seek(0)
+            part, raw = raw, None
+            name = f"sensor_data_{stamp}_part{number}" if number > 1 else f"sensor_data_{stamp}"
+            yield name + EXPORT_FORMATS[fmt], part, rows_in_part
+    finally:
+        # a part still being written when the export is abandoned is dropped here
+        if raw is not None:
+            raw.close()
+        db.close()
@@ -0,0 +1,114 @@
+"""
+Stand-in for the bme680 package, producing synthetic readings without any hardware.
+
+Pass the module as `driver` to SensorManager. The behaviour of every FakeBME680
+created afterwards is set with configure(), e.g. to add I2C latency or make the
+gas heater unstable.
+"""
+import math
+import random
+import time
+
+I2C_ADDR_PRIMARY = 0x76
+I2C_ADDR_SECONDARY = 0x77
+
+OS_NONE, OS_1X, OS_2X, OS_4X, OS_8X, OS_16X = range(6)
+FILTER_SIZE_0, FILTER_SIZE_1, FILTER_SIZE_3, FILTER_SIZE_7, FILTER_SIZE_15 = range(5)
+DISABLE_GAS_MEAS, ENABLE_GAS_MEAS = 0, 1
+
+_settings = {
+    # seconds a forced measurement takes, the real sensor needs ~150 ms with the gas heater on
+    "latency": 0.0,
+    # probability that a reading has heat_stable False
+    "unstable_rate": 0.0,
+    # probability that get_sensor_data() returns False
+    "failure_rate": 0.0,
+    # raise in the constructor like a missing device at the primary address
+    "missing_primary": False,
+    "seed": None,
+}
+
+
+def configure(**settings) -> None:
+    """
+    Change the behaviour of the fake sensors created after the call.
+
+    Args:
+        latency (float): Seconds every get_sensor_data() call blocks.
+        unstable_rate (float): Probability (0-1) that a reading is not heat stable.
+        failure_rate (float): Probability (0-1) that get_sensor_data() returns no data.
+        missing_primary (bool): Raise on the primary address, like a sensor wired to the secondary one.
+        seed (int): Seed of the random generator, for reproducible runs.
+    """
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise TypeError(f"Unknown fake sensor settings: {', '.join(sorted(unknown))}")
+    _settings.update(settings)
+
+
+class FieldData:
+
+    """
+    Same attributes as bme680.FieldData.
+    """
+
+    def __init__(self):
+        self.temperature = 0.0
+        self.pressure = 0.0
+        self.humidity = 0.0
+        self.gas_resistance = 0.0
+        self.heat_stable = False
+
+
+class BME680:
+
+    """
+    Fake BME680 returning slowly drifting temperature, humidity, pressure and gas readings.
+    """
+
+    def __init__(self, i2c_addr=I2C_ADDR_PRIMARY, i2c_device=None):
+        if _settings["missing_primary"] and i2c_addr == I2C_ADDR_PRIMARY:
+            raise IOError("No fake sensor at the primary address")
+        self.i2c_addr = i2c_addr
+        self.data = FieldData()
+        self._latency = _settings["latency"]
+        self._unstable_rate = _settings["unstable_rate"]
+        self._failure_rate = _settings["failure_rate"]
+        self._random = random.Random(_settings["seed"])
+        self._start = time.time()
+        self._gas_enabled = False
+
+    # the configuration calls of the real driver are accepted and ignored
+    def set_humidity_oversample(self, value): pass
+    def set_pressure_oversample(self, value): pass
+    def set_temperature_oversample(self, value): pass
+    def set_filter(self, value): pass
+    def set_gas_heater_temperature(self, value, nb_profile=0): pass
+    def set_gas_heater_duration(self, value, nb_profile=0): pass
+    def select_gas_heater_profile(self, value): pass
+
+    def set_gas_status(self, value):
+        # like the real sensor, no gas reading is heat stable while the heater is off
+        self._gas_enabled = value != DISABLE_GAS_MEAS
+
+    def get_sensor_data(self) -> bool:
+        """
+        Run a fake forced measurement and update `data`.
+
+        Returns:
+            bool: False when the configured failure rate hits, True otherwise.
+        """
+        if self._latency:
+            time.sleep(self._latency)
+        if self._random.random() < self._failure_rate:
+            return False
+
+        # one slow daily cycle plus a little noise
+        phase = 2 * math.pi * (time.time() - self._start) / 86400
+        noise = self._random.gauss
+        self.data.temperature = 22.0 + 3.0 * math.sin(phase) + noise(0, 0.05)
+        self.data.humidity = 45.0 - 8.0 * math.sin(phase) + noise(0, 0.2)
+        self.data.pressure = 1013.0 + 2.0 * math.cos(phase) + noise(0, 0.05)
+        self.data.gas_resistance = 120000.0 + 10000.0 * math.cos(phase) + noise(0, 500)
+        self.data.heat_stable = self._gas_enabled and self._random.random() >= self._unstable_rate
+        return True
@@ -0,0 +1,247 @@
+"""
+Local stand-in for the Telegram Bot API, for benchmarks and development without Telegram.
+
+Point the Application at it with Application.builder().base_url(api.url). Commands are
+injected with push_command() and handed out through getUpdates, or posted right away to the
+webhook once the bot called setWebhook. Everything the bot sends is recorded with its
+arrival time and can be awaited with wait_reply().
+"""
+import email.parser
+import itertools
+import json
+import logging
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class Reply:
+
+    """
+    A call the bot made towards a chat.
+
+    Attributes:
+      method (str): Bot API method, e.g. 'sendMessage'.
+      params (dict): Decoded request parameters, uploaded files as bytes.
+      received_at (float): time.perf_counter() when the request arrived.
+    """
+
+    def __init__(self, method, params, received_at):
+        self.method = method
+        self.params = params
+        self.received_at = received_at
+
+
+class FakeBotAPI:
+
+    """
+    Minimal Bot API server running on a background thread.
+
+    Attributes:
+      url (str): Base URL to pass to Application.builder().base_url().
+      calls (dict): Number of calls per Bot API method.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self._updates = []
+        self._updates_changed = threading.Condition()
+        self._replies = {}
+        self._replies_changed = threading.Condition()
+        self._ids = itertools.count(1)
+        self.calls = {}
+        self.webhook = None
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                api._handle(self)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+        self.url = f"http://{host}:{self._server.server_address[1]}/bot"
+
+    def start(self) -> "FakeBotAPI":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def push_command(self, text, chat_id, user_id) -> float:
+        """
+        Queue a message for the next getUpdates call, or post it to the webhook if one is set.
+
+        Args:
+            text (str): The message text, e.g. '/graph 24'.
+            chat_id (int): Chat the message is sent in, replies are recorded per chat.
+            user_id (int): Telegram id of the sender.
+
+        Returns:
+            float: time.perf_counter() when the update became available.
+        """
+        update_id = next(self._ids)
+        command = text.split()[0] if text.startswith("/") else None
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        }
+        if command:
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        update = {"update_id": update_id, "message": message}
+        pushed_at = time.perf_counter()
+        if self.webhook and self._deliver(update):
+            return pushed_at
+        with self._updates_changed:
+            self._updates.append(update)
+            self._updates_changed.notify_all()
+        return pushed_at
+
+    def _deliver(self, update) -> bool:
+        """
+        Post an update to the webhook like Telegram does. Returns False if the bot did not accept it.
+        """
+        webhook = self.webhook
+        request = urllib.request.Request(webhook["url"], data=json.dumps(update).encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        if webhook.get("secret_token"):
+            request.add_header("X-Telegram-Bot-Api-Secret-Token", webhook["secret_token"])
+        # a self-signed certificate is the common case for a bot on a Pi
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        try:
+            with urllib.request.urlopen(request, timeout=10, context=context) as response:
+                return response.status == 200
+        except (urllib.error.URLError, OSError) as e:
+            logger.warning(f"Webhook delivery failed: {e}")
+            return False
+
+    def wait_reply(self, chat_id, timeout=30) -> Reply:
+        """
+        Wait for the next call the bot makes towards `chat_id`.
+
+        Returns:
+            Reply: The call, None on timeout.
+        """
+        with self._replies_changed:
+            self._replies_changed.wait_for(lambda: self._replies.get(chat_id), timeout)
+            replies = self._replies.get(chat_id)
+            return replies.pop(0) if replies else None
+
+    def _handle(self, request) -> None:
+        method = request.path.rsplit("/", 1)[-1]
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        params = self._decode(request.headers.get("Content-Type", ""), body)
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        result = self._dispatch(method, params)
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+    @staticmethod
+    def _decode(content_type, body) -> dict:
+        """
+        Decode url-encoded, multipart or JSON parameters. Values the bot JSON-encoded are decoded too.
+        """
+        params = {}
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser().parsebytes(
+                b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+            for part in message.get_payload():
+                name = part.get_param("name", header="content-disposition")
+                value = part.get_payload(decode=True)
+                params[name] = value if part.get_filename() else value.decode()
+        elif content_type.startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        for key, value in params.items():
+            # text is sent as is, everything else JSON-encoded
+            if isinstance(value, str) and key not in ("text", "caption", "secret_token"):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    pass
+        return params
+
+    def _dispatch(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method == "getUpdates":
+            return self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        if method == "setWebhook":
+            self.webhook = params
+            return True
+        if method == "deleteWebhook":
+            self.webhook = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": (self.webhook or {}).get("url", ""), "has_custom_certificate": False,
+                    "pending_update_count": 0}
+        if method.startswith("send"):
+            return self._record(method, params)
+        return True
+
+    def _get_updates(self, offset, timeout) -> list:
+        with self._updates_changed:
+            # updates below the offset were confirmed by the bot
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            self._updates_changed.wait_for(lambda: self._updates, timeout)
+            return list(self._updates)
+
+    def _record(self, method, params) -> dict:
+        received_at = time.perf_counter()
+        chat_id = int(params.get("chat_id", 0))
+        message = {"message_id": next(self._ids), "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}}
+        if method == "sendPhoto":
+            photo = params.get("photo")
+            file_id = photo if isinstance(photo, str) else f"photo-{message['message_id']}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 994}]
+        elif method == "sendDocument":
+            message["document"] = {"file_id": f"doc-{message['message_id']}",
+                                   "file_unique_id": f"doc-{message['message_id']}"}
+        else:
+            message["text"] = params.get("text", "")
+        with self._replies_changed:
+            self._replies.setdefault(chat_id, []).append(Reply(method, params, received_at))
+            self._replies_changed.notify_all()
+        return message
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    api = FakeBotAPI(port=8081).start()
+    print(f"Fake Bot API listening on {api.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        api.stop()
@@ -1,66 +1,210 @@
-import matplotlib.pyplot as plt
-from datetime import datetime
-from db_handler import DataBaseHandler
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # no display on the Pi, render straight to PNG
+from db_handler import DataBaseHandler, DEFAULT_SENSOR_ID, RESOLUTION_LABELS
+from downsample import lttb, min_max_mean, target_points
+import io
 import os
+import time
+import numpy as np
 import matplotlib.dates as mdates
 
-def generate_graph(hours):
-   
+# Telegram shows photos at most 2560 px on the long side, larger images are only scaled down again
+TELEGRAM_MAX_SIDE = 2560
+
+# figure size in inches and resolution of the PNG, 2554 x 1984 px
+FIG_SIZE = (10.3, 8)
+DPI = int(TELEGRAM_MAX_SIDE / max(FIG_SIZE))
+
+# above this many points per series the markers only clutter the line
+MAX_MARKED_POINTS = 100
+
+# subplots of every graph source: (series, title, y label, color, marker)
+PANELS = {
+    "sensor": [
+        ("temp", 'Temperature Over Time', 'Temperature (°C)', 'red', 'o'),
+        ("hum", 'Humidity Over Time', 'Humidity (%)', 'blue', 's'),
+    ],
+    "system": [
+        ("cpu_temp", 'CPU Temperature Over Time', 'CPU Temperature (°C)', 'orange', 'o'),
+        ("mem_used_pct", 'Memory Usage Over Time', 'Memory used (%)', 'purple', 's'),
+    ],
+}
+
+def _load_series(hours, source, n_points, sensor_id=DEFAULT_SENSOR_ID) -> tuple:
     """
-    Generate and saves a graph of temperature and humidity data for the past specified hours.
+    Read the series of one graph source from the DB.
+
+    Returns:
+      tuple: (resolution, series) where resolution is 0 for raw data or the rollup bucket size,
+      and series maps every panel to (x, y, band_min, band_max), the bands being None for raw data.
+    """
+    db = DataBaseHandler("sensor_data.db")
+    try:
+        if source == "system":
+            metrics = db.get_hours_system_metrics(hours)
+            return 0, {name: (metrics['ts'], metrics[name], None, None) for name, *_ in PANELS[source]}
+
+        # long ranges are read from the pre-aggregated rollups instead of the raw rows
+        resolution = db.pick_resolution(hours, n_points, sensor_id)
+        if resolution:
+            rollup = db.get_hours_rollup(hours, resolution, sensor_id)
+            return resolution, {name: (rollup['ts'], rollup[f'{name}_avg'], rollup[f'{name}_min'], rollup[f'{name}_max'])
+                                for name, *_ in PANELS[source]}
+        # the points of a compressed sensor are rebuilt as steps or lines, see compression.py
+        timestamps, temperatures, humidity = db.get_hours_series(hours, sensor_id, n_points)
+        return 0, {"temp": (timestamps, temperatures, None, None), "hum": (timestamps, humidity, None, None)}
+    finally:
+        db.close()
+
+class GraphTemplate:
+
+    """
+    The figure of one graph source, built once per process and refilled for every render.
+
+    Axes, formatters, legends and line artists are created up front, a render only swaps
+    the data with set_data(). The figure is drawn by the Agg canvas directly, pyplot and its
+    global figure registry are not involved. Not thread safe: every render worker process
+    renders one graph at a time with its own templates.
+
+    Attributes:
+      panels (list): The PANELS entry of the source.
+      figure (Figure): The reused figure.
+    """
+
+    def __init__(self, panels):
+        self.panels = panels
+        self.figure = Figure(figsize=FIG_SIZE, dpi=DPI)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.subplots(len(panels), 1)  # vertical subplots
+        self.lines = []
+        self.bands = [None] * len(panels)
+        self._layout_format = None
+
+        for ax, (name, title, ylabel, color, marker) in zip(self.axes, panels):
+            line, = ax.plot([], [], label=ylabel, color=color, marker=marker)
+            self.lines.append(line)
+            ax.xaxis_date()
+            ax.set_ylabel(ylabel)
+            ax.grid(True)
+            # a fixed corner, 'best' would search for a free spot on every render
+            ax.legend(loc='upper left')
+            ax.tick_params(axis='x', rotation=45)  # Rotate X-axis labels
+        self.axes[-1].set_xlabel('Time')
+
+    def render(self, hours, series, resolution, n_points, label="") -> bytes:
+        """
+        Fill the template with `series` (see _load_series) and encode it.
+        `label` is added to every subplot title, e.g. the name of the sensor.
+
+        Returns:
+          bytes: The encoded PNG image.
+        """
+        suffix = f" ({RESOLUTION_LABELS[resolution]} average, min-max band)" if resolution else ""
+        time_format = '%H:%M' if float(hours) <= 24 else '%d.%m %H:%M'
+        now = time.time()
+
+        for i, (ax, line, (name, title, ylabel, color, marker)) in enumerate(zip(self.axes, self.lines, self.panels)):
+            x, y, band_min, band_max = series[name]
+            line.set_marker(marker if len(x) <= MAX_MARKED_POINTS else 'None')
+            band_x = x
+            if band_min is None and len(x) > n_points:
+                # the raw points LTTB drops still show in the band of their bucket,
+                # coarser buckets than the line keep the band visible around it
+                band_x, band_min, band_max, _ = min_max_mean(x, y, max(n_points // 8, 2))
+            if resolution == 0:
+                x, y = lttb(x, y, n_points)
+            x = mdates.date2num(x.astype('datetime64[s]'))
+            line.set_data(x, y)
+
+            if self.bands[i] is not None:
+                self.bands[i].remove()
+                self.bands[i] = None
+            if band_min is not None:
+                band_x = mdates.date2num(np.asarray(band_x).astype('datetime64[s]'))
+                self.bands[i] = ax.fill_between(band_x, band_min, band_max, color=color, alpha=0.2, linewidth=0)
 
-    Retrieves sensor data from DB using the DataBaseHandler class.
-    Creates a figure with two subplots:
+            ax.set_title(title + label + (" (min-max band)" if band_min is not None and not resolution else suffix))
+            ax.xaxis.set_major_formatter(mdates.DateFormatter(time_format))  # Format X-axis
+            if len(x):
+                ax.relim()
+                ax.autoscale_view()
+            else:
+                # nothing to plot, show the requested range instead of the previous graph's limits
+                ax.set_xlim(mdates.date2num(np.datetime64(int(now - float(hours) * 3600), 's')),
+                            mdates.date2num(np.datetime64(int(now), 's')))
+                ax.set_ylim(0, 1)
+
+        # the margins only depend on the labels, they are recomputed when the date format changes
+        if self._layout_format != time_format:
+            self.figure.tight_layout()
+            self._layout_format = time_format
+
+        buffer = io.BytesIO()
+        self.figure.savefig(buffer, format='png')
+        return buffer.getvalue()
+
+
+# templates of this process, one per graph source
+_templates = {}
+
+def render_graph(hours, source="sensor", sensor_id=DEFAULT_SENSOR_ID) -> bytes:
+    """
+    Render a graph of the data for the past specified hours.
+
+    Retrieves the data from DB using the DataBaseHandler class.
+    Creates a figure with two subplots, for the "sensor" source:
      - first subplot displays temperature over time.
      - second subplot displays humidity over time.
+    and for the "system" source the CPU temperature and the memory usage of the Pi.
+
+    The PNG is rendered into memory, so concurrent renders never share an output file.
+    Args:
+      hours (int): The number of past hours for which to retrieves and display data.
+      source (str): "sensor" for the BME680 readings, "system" for the Pi health metrics.
+      sensor_id (str): Sensor whose readings are plotted, for the "sensor" source.
+
+    Returns:
+      bytes: The encoded PNG image.
+    """
+    # keep at most as many points as the figure can show, so long ranges render as fast as short ones
+    n_points = target_points(FIG_SIZE[0], DPI)
+    resolution, series = _load_series(hours, source, n_points, sensor_id)
+    # the sensor is named in the titles once there is more than the default one
+    label = f" ({sensor_id})" if source == "sensor" and sensor_id != DEFAULT_SENSOR_ID else ""
+
+    template = _templates.get(source)
+    if template is None:
+        template = _templates[source] = GraphTemplate(PANELS[source])
+    return template.render(hours, series, resolution, n_points, label)
+
+def warm_up() -> None:
+    """
+    Build the template of every source and draw it once, so the fonts and the Agg renderer
+    are loaded before the first request. Run by every render worker when it starts.
+    """
+    for source, panels in PANELS.items():
+        if source not in _templates:
+            _templates[source] = GraphTemplate(panels)
+        _templates[source].figure.canvas.draw()
+
+def generate_graph(hours):
+    """
+    Generate and saves a graph of temperature and humidity data for the past specified hours.
 
     The graph is saved as PNG file ('./tmp/temperature.png'). If the output directory does not exist, it will be created.
     Args:
       hours (int): The number of past hours for which to retrieves and display sensor data.
     """
-    db = DataBaseHandler("sensor_data.db")
-    data = db.get_hours_data(hours)  
-           
-    # Extract relevant columns
-    timestamps = [datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S') for row in data]
-    temperatures = [row[2] for row in data]
-    humidity = [row[3] for row in data]
-
-    # Create a figure with 2 subplots
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10.3, 8))  # Two vertical subplots
-
-    # Plot temperature
-    ax1.plot(timestamps, temperatures, label='Temperature (°C)', color='red', marker='o')
-    ax1.set_title('Temperature Over Time')
-    ax1.set_ylabel('Temperature (°C)')
-    ax1.grid(True)
-    ax1.legend()
-    ax1.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))  # Format X-axis
-    ax1.tick_params(axis='x', rotation=45)  # Rotate X-axis labels
-
-    # Plot humidity
-    ax2.plot(timestamps, humidity, label='Humidity (%)', color='blue', marker='s')
-    ax2.set_title('Humidity Over Time')
-    ax2.set_xlabel('Time (Hours:Minutes)')
-    ax2.set_ylabel('Humidity (%)')
-    ax2.grid(True)
-    ax2.legend()
-    ax2.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))  # Format X-axis
-    ax2.tick_params(axis='x', rotation=45)  # Rotate X-axis labels
-
-    # Adjust layout
-    plt.tight_layout()
+    png = render_graph(hours)
 
     # Ensure the output directory exists
     os.makedirs('./tmp', exist_ok=True)
 
     # Save the plot to a file
     output_path = './tmp/temperature.png'
-    plt.savefig(output_path, dpi=500)  # Save as a single image
+    with open(output_path, 'wb') as file:
+        file.write(png)
     print(f"Graphs saved to {output_path}")
 
-    # Close the plot to release memory
-    plt.close()
-
 if __name__ == "__main__":
    generate_graph(2)   
@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+
+    """
+    A rendered graph held by the GraphCache.
+
+    Attributes:
+      digest (str): Content address of the entry, derived from its cache key.
+      png (bytes): The encoded PNG image.
+      file_id (str): Telegram file_id of the uploaded photo, None until it was sent once.
+    """
+
+    def __init__(self, digest, png, file_id=None):
+        self.digest = digest
+        self.png = png
+        self.file_id = file_id
+
+
+class GraphCache:
+
+    """
+    Content-addressed cache for rendered graphs with LRU eviction in memory and on disk.
+
+    Entries are addressed by a hash of their key, e.g. (database id, hours, first row id, last row id, options),
+    so a graph is only rendered again once the data behind it changed.
+    Identical requests arriving while a render is running share that render.
+
+    Attributes:
+      cache_dir (str): Directory holding the PNG files and their Telegram file_ids.
+      max_memory_bytes (int): Byte budget of the PNGs kept in memory.
+      max_disk_bytes (int): Byte budget of the PNGs kept in `cache_dir`.
+    """
+
+    def __init__(self, cache_dir="./tmp/graph_cache", max_memory_bytes=32 * 2**20, max_disk_bytes=256 * 2**20):
+        """
+        Initialize the cache and index the entries left on disk by a previous run.
+
+        Args:
+            cache_dir (str): Directory holding the PNG files and their Telegram file_ids.
+            max_memory_bytes (int): Byte budget of the PNGs kept in memory.
+            max_disk_bytes (int): Byte budget of the PNGs kept in `cache_dir`.
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()  # digest -> CacheEntry, least recently used first
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # digest -> PNG size in bytes
+        self._disk_bytes = 0
+        self._inflight = {}  # digest -> asyncio.Future of a running render
+
+        os.makedirs(cache_dir, exist_ok=True)
+        files = [f for f in os.scandir(cache_dir) if f.name.endswith(".png")]
+        for f in sorted(files, key=lambda f: f.stat().st_mtime):
+            self._disk[f.name[:-4]] = f.stat().st_size
+            self._disk_bytes += f.stat().st_size
+        self._evict_disk()
+
+    @staticmethod
+    def digest(key) -> str:
+        """
+        Return the content address of a cache key.
+        """
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def _path(self, digest, suffix) -> str:
+        return os.path.join(self.cache_dir, digest + suffix)
+
+    async def get_or_render(self, key, render) -> CacheEntry:
+        """
+        Return the cached graph for `key`, rendering it at most once.
+
+        Args:
+            key (tuple): Hashable description of the graph and the data behind it.
+            render (callable): Coroutine function returning the PNG bytes on a cache miss.
+
+        Returns:
+            CacheEntry: The cached entry.
+        """
+        digest = self.digest(key)
+
+        entry = self._memory.get(digest)
+        if entry is not None:
+            self._memory.move_to_end(digest)
+            return entry
+
+        while digest in self._inflight:
+            # an identical request is already rendering, wait for its result
+            inflight = self._inflight[digest]
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                # the request that started the render went away, the first waiter renders instead
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[digest] = future
+        try:
+            entry = None
+            if digest in self._disk:
+                entry = await asyncio.to_thread(self._read, digest)
+                if entry is not None:
+                    self._disk.move_to_end(digest)
+            if entry is None:
+                png = await render()
+                entry = CacheEntry(digest, png)
+                if await asyncio.to_thread(self._write, entry) and digest not in self._disk:
+                    self._disk[digest] = len(png)
+                    self._disk_bytes += len(png)
+                    self._evict_disk()
+            self._remember(entry)
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            # the waiters get the error, nobody else needs to retrieve it
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[digest]
+
+    def set_file_id(self, entry, file_id) -> None:
+        """
+        Remember the Telegram file_id of an uploaded entry so it can be resent without uploading.
+        """
+        entry.file_id = file_id
+        try:
+            with open(self._path(entry.digest, ".id"), "w") as file:
+                file.write(file_id)
+        except OSError as e:
+            logger.error(f"Failed to store the graph file_id: {e}")
+
+    def _read(self, digest) -> CacheEntry:
+        try:
+            with open(self._path(digest, ".png"), "rb") as file:
+                png = file.read()
+        except OSError as e:
+            logger.warning(f"Cached graph could not be read, rendering again: {e}")
+            return None
+        file_id = None
+        if os.path.exists(self._path(digest, ".id")):
+            with open(self._path(digest, ".id")) as file:
+                file_id = file.read().strip() or None
+        # the mtime orders the disk LRU when the cache is indexed on the next start
+        os.utime(self._path(digest, ".png"))
+        return CacheEntry(digest, png, file_id)
+
+    def _write(self, entry) -> bool:
+        path = self._path(entry.digest, ".png")
+        try:
+            with open(path + ".tmp", "wb") as file:
+                file.write(entry.png)
+            os.replace(path + ".tmp", path)
+            return True
+        except OSError as e:
+            logger.error(f"Failed to store the graph on disk: {e}")
+            return False
+
+    def _remember(self, entry) -> None:
+        self._memory[entry.digest] = entry
+        self._memory_bytes += len(entry.png)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.png)
+
+    def _evict_disk(self) -> None:
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            digest, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            for suffix in (".png", ".id"):
+                try:
+                    os.remove(self._path(digest, suffix))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,163 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# records waiting for the writer thread, beyond that they are dropped instead of blocking the caller
+QUEUE_SIZE = 10000
+
+
+class RateLimitFilter(logging.Filter):
+
+    """
+    Lets at most `burst` records of `level` with the same logger and message through every
+    `interval` seconds. The next record let through after a pause tells how many were
+    suppressed, so a warning repeated on every sensor read costs one line per interval.
+    Records of other levels, e.g. the INFO audit lines of the commands, always pass.
+
+    Attributes:
+      interval (float): Seconds of a rate limit window.
+      burst (int): Identical records let through per window.
+      level (int): The only level whose records are limited.
+    """
+
+    # windows remembered at most, the oldest are forgotten beyond it
+    MAX_KEYS = 1000
+
+    def __init__(self, interval=60, burst=1, level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.level = level
+        # key -> [window start, records let through, records suppressed]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record) -> bool:
+        if record.levelno != self.level or getattr(record, "rate_limit_report", False):
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                if window is None and len(self._windows) >= self.MAX_KEYS:
+                    self._windows.pop(next(iter(self._windows)))
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+    def report(self) -> None:
+        """
+        Log how many records were suppressed in the current windows, which no later record will tell.
+        """
+        with self._lock:
+            windows, self._windows = self._windows, {}
+        for (name, level, msg), (_, _, suppressed) in windows.items():
+            if suppressed:
+                logging.getLogger(name).log(level, "%s (%d similar messages suppressed)", msg, suppressed,
+                                            extra={"rate_limit_report": True})
+
+
+class BudgetRotatingFileHandler(RotatingFileHandler):
+
+    """
+    A log file rotated when it reaches `max_bytes` or is older than `interval` seconds.
+    Only as many rotated files are kept as fit into `budget` bytes together with the current one.
+    """
+
+    def __init__(self, filename, max_bytes=1024 * 1024, budget=10 * 1024 * 1024, interval=86400):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=max(1, budget // max_bytes - 1),
+                         encoding="utf-8", delay=True)
+        self.interval = interval
+        self._rollover_at = time.time() + interval if interval else float("inf")
+
+    def shouldRollover(self, record) -> bool:
+        if time.time() >= self._rollover_at and os.path.exists(self.baseFilename):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self._rollover_at = time.time() + self.interval if self.interval else float("inf")
+
+
+class DroppingQueueHandler(QueueHandler):
+
+    """
+    Puts the records on a bounded queue without waiting: when the writer thread falls behind,
+    records are dropped (and counted) instead of stalling the event loop.
+    """
+
+    def enqueue(self, record) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+
+def setup(filename, level=logging.INFO, max_bytes=1024 * 1024, budget=10 * 1024 * 1024, interval=86400,
+          rate_limit=60, rate_limit_level=logging.WARNING) -> QueueListener:
+    """
+    Route every record of the root logger through a queue to a background thread writing
+    the console and a rotated log file, so logging never waits for the SD card.
+
+    Args:
+        filename (str): The log file, its directory is created if needed.
+        level (int or str): Level of the root logger, e.g. logging.INFO or "INFO".
+        max_bytes (int): Size at which the log file is rotated.
+        budget (int): Bytes the log file and its rotated copies may take together.
+        interval (float): Seconds after which the log file is rotated anyway, 0 for size only.
+        rate_limit (float): Seconds during which a repeated message is logged once, 0 to log every record.
+        rate_limit_level (int): Level of the records that are rate limited.
+
+    Returns:
+        QueueListener: The running writer thread, stopped (and drained) at exit.
+    """
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(), BudgetRotatingFileHandler(filename, max_bytes, budget, interval)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.Queue(QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(records)
+    rate_filter = None
+    if rate_limit:
+        rate_filter = RateLimitFilter(rate_limit, level=rate_limit_level)
+        queue_handler.addFilter(rate_filter)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop, listener, rate_filter)
+    return listener
+
+
+def _stop(listener, rate_filter) -> None:
+    # the listener may have been stopped already, stopping it twice fails
+    if listener._thread is not None:
+        if rate_filter is not None:
+            # queued before the stop, the listener writes them while draining
+            rate_filter.report()
+        listener.stop()
@@ -0,0 +1,302 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# collection is off until enable() is called, every probe then returns right away
+_enabled = False
+_registry = []
+
+# upper bounds in seconds of the latency buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# upper bounds in bytes of the PNG size buckets
+SIZE_BUCKETS = (50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6)
+
+
+def enable() -> None:
+    """
+    Start collecting. Until then every counter and histogram ignores its updates.
+    """
+    global _enabled
+    _enabled = True
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+class _NoopTimer:
+
+    """
+    Returned by Histogram.time() while collection is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _Timer:
+
+    """
+    Observes the time spent inside the `with` block into a histogram.
+    """
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _Metric:
+
+    """
+    Common part of counters and histograms: name, help text and labelled values.
+
+    Attributes:
+      name (str): Metric name in the Prometheus exposition.
+      help (str): One line description.
+      labels (tuple of str): Names of the labels, values are passed as keyword arguments.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}  # tuple of label values -> value
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _label_text(self, key, extra=None) -> str:
+        pairs = list(zip(self.labels, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def items(self) -> list:
+        """
+        Return (label dict, value) of every label combination seen so far.
+        """
+        with self._lock:
+            return [(dict(zip(self.labels, key)), value) for key, value in sorted(self._values.items())]
+
+    def expose(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._expose_value(key, value))
+        return lines
+
+
+class Counter(_Metric):
+
+    """
+    A monotonically increasing count, e.g. of failed sensor reads.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels) -> None:
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _expose_value(self, key, value) -> list:
+        return [f"{self.name}{self._label_text(key)} {value}"]
+
+
+class Histogram(_Metric):
+
+    """
+    Counts observations into fixed buckets, e.g. command latencies.
+    Quantiles are estimated from the buckets, the same way Prometheus' histogram_quantile() does.
+
+    Attributes:
+      buckets (tuple of float): Upper bounds of the buckets, ascending.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels) -> None:
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per bucket counts (the last one is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """
+        Context manager observing the duration of its block in seconds.
+        """
+        if not _enabled:
+            return _NOOP_TIMER
+        return _Timer(self, labels)
+
+    def stats(self, **labels) -> dict:
+        """
+        Summary of one label combination.
+
+        Returns:
+            dict: 'count', 'sum', 'p50', 'p95' and 'p99', None if nothing was observed.
+        """
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            if state is None:
+                return None
+            counts, total, count = list(state[0]), state[1], state[2]
+        return {"count": count, "sum": total, "p50": self._quantile(0.5, counts, count),
+                "p95": self._quantile(0.95, counts, count), "p99": self._quantile(0.99, counts, count)}
+
+    def _quantile(self, q, counts, count) -> float:
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                if i == len(self.buckets):
+                    # the +Inf bucket has no upper bound, report the highest finite one
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return 0.0
+
+    def _expose_value(self, key, value) -> list:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + ("+Inf",), counts):
+            cumulative += n
+            lines.append(f"{self.name}_bucket{self._label_text(key, ('le', bound))} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {total}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+
+# the metrics of the bot, labels in brackets
+COMMAND_SECONDS = Histogram("picontrolbot_command_seconds", "Time to handle a bot command.", ["command"])
+UNAUTHORIZED = Counter("picontrolbot_unauthorized_total", "Commands rejected from users not in ALLOWED_USERS.")
+SENSOR_READ_SECONDS = Histogram("picontrolbot_sensor_read_seconds", "Duration of a BME680 get_sensor_data() call.",
+                                ["sensor"])
+SENSOR_READ_FAILURES = Counter("picontrolbot_sensor_read_failures_total",
+                               "Sensor reads without data (no_data) or raising (error).", ["sensor", "reason"])
+SENSOR_STALE_WAITS = Counter("picontrolbot_sensor_stale_waits_total",
+                             "Times the database filler had no fresh reading and waited for one.", ["sensor"])
+DB_QUERY_SECONDS = Histogram("picontrolbot_db_query_seconds", "Duration of a database read, rows fetched included.",
+                             ["query"])
+DB_COMMIT_SECONDS = Histogram("picontrolbot_db_commit_seconds",
+                              "Duration of a write transaction (inserts, rollups, commit).")
+DB_ROWS_WRITTEN = Counter("picontrolbot_db_rows_written_total", "Rows written to the database.", ["table"])
+DB_ROWS_EXPIRED = Counter("picontrolbot_db_rows_expired_total", "Rows deleted by the retention policy.", ["table"])
+WEBHOOK_REQUESTS = Counter("picontrolbot_webhook_requests_total",
+                           "Webhook requests by outcome (queued, queue_full, forbidden, ...).", ["result"])
+LOG_RECORDS_DROPPED = Counter("picontrolbot_log_records_dropped_total",
+                              "Log records dropped because the log writer thread fell behind.")
+GRAPH_RENDER_SECONDS = Histogram("picontrolbot_graph_render_seconds",
+                                 "Time to render a graph in the pool, queue time included.", ["source"])
+GRAPH_PNG_BYTES = Histogram("picontrolbot_graph_png_bytes", "Size of a rendered graph.", ["source"],
+                            buckets=SIZE_BUCKETS)
+
+
+def exposition() -> str:
+    """
+    Return every metric in the Prometheus text format.
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> str:
+    """
+    Return a short human readable summary of the collected metrics, for the /metrics command.
+    """
+    if not _enabled:
+        return "Metrics are disabled, set METRICS_ENABLED=1 to collect them."
+    lines = []
+    for metric in _registry:
+        for labels, value in metric.items():
+            label = ",".join(v for v in labels.values() if v)
+            name = metric.name.replace("picontrolbot_", "") + (f"[{label}]" if label else "")
+            if isinstance(metric, Counter):
+                lines.append(f"{name}: {value}")
+                continue
+            stats = metric.stats(**labels)
+            if metric.buckets is SIZE_BUCKETS:
+                lines.append(f"{name}: n={stats['count']} avg={stats['sum'] / stats['count'] / 1e3:.0f}KB "
+                             f"p95={stats['p95'] / 1e3:.0f}KB")
+            else:
+                lines.append(f"{name}: n={stats['count']} avg={stats['sum'] / stats['count'] * 1e3:.1f}ms "
+                             f"p50={stats['p50'] * 1e3:.1f}ms p95={stats['p95'] * 1e3:.1f}ms")
+    return "\n".join(lines) or "No metrics collected yet."
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        payload = exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # scrapes every few seconds would flood the log
+        pass
+
+
+def serve(port, host="127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve the Prometheus exposition on http://host:port/metrics from a background thread.
+
+    Args:
+        port (int): TCP port to listen on.
+        host (str): Address to bind, localhost by default so the metrics stay on the Pi.
+
+    Returns:
+        ThreadingHTTPServer: The server, stop it with shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics are served on http://{host}:{port}/metrics")
+    return server
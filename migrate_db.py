@@ -0,0 +1,204 @@
+import sqlite3
+import logging
+import sys
+import uuid
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Every migration moves the database from version N (its index) to N + 1.
+# The version is kept in PRAGMA user_version, a fresh database is version 0.
+
+
+def _columns(cursor, table) -> list:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _epoch_time_column(cursor) -> None:
+    """
+    Store the sample time as indexed integer epoch seconds instead of DATETIME text.
+    Range queries use the index and no timestamp has to be parsed when plotting.
+    """
+    cursor.execute('''
+    CREATE TABLE sensor_data_new(
+       id INTEGER PRIMARY KEY AUTOINCREMENT,
+       ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+       temperature REAL,
+       humidity REAL
+    )
+    ''')
+    if "timestamp" in _columns(cursor, "sensor_data"):
+        # ids are kept, they identify the data behind cached graphs
+        cursor.execute('''
+        INSERT INTO sensor_data_new (id, ts, temperature, humidity)
+        SELECT id, CAST(strftime('%s', timestamp) AS INTEGER), temperature, humidity
+        FROM sensor_data WHERE timestamp IS NOT NULL
+        ''')
+    cursor.execute("DROP TABLE IF EXISTS sensor_data")
+    cursor.execute("ALTER TABLE sensor_data_new RENAME TO sensor_data")
+    cursor.execute("CREATE INDEX idx_sensor_data_ts ON sensor_data(ts)")
+
+
+def _rollup_table(cursor) -> None:
+    """
+    Add per-minute, per-hour and per-day aggregates of sensor_data, kept up to date on insert.
+    Sums of squares are stored next to the sums so the variance can be derived.
+    """
+    cursor.execute('''
+    CREATE TABLE sensor_rollup(
+       resolution INTEGER NOT NULL,
+       bucket INTEGER NOT NULL,
+       count INTEGER NOT NULL,
+       temp_sum REAL, temp_sumsq REAL, temp_min REAL, temp_max REAL,
+       hum_sum REAL, hum_sumsq REAL, hum_min REAL, hum_max REAL,
+       PRIMARY KEY (resolution, bucket)
+    ) WITHOUT ROWID
+    ''')
+    for resolution in (60, 3600, 86400):
+        cursor.execute('''
+        INSERT INTO sensor_rollup
+        SELECT ?, ts / ? * ?, COUNT(*),
+               SUM(temperature), SUM(temperature * temperature), MIN(temperature), MAX(temperature),
+               SUM(humidity), SUM(humidity * humidity), MIN(humidity), MAX(humidity)
+        FROM sensor_data WHERE temperature IS NOT NULL AND humidity IS NOT NULL
+        GROUP BY ts / ?
+        ''', (resolution, resolution, resolution, resolution))
+
+
+def _system_metrics_table(cursor) -> None:
+    """
+    Add a time series of the Raspberry Pi health, clustered on the sample time.
+    """
+    cursor.execute('''
+    CREATE TABLE system_metrics(
+       ts INTEGER PRIMARY KEY,
+       cpu_temp REAL,
+       cpu_percent REAL,
+       mem_used_pct REAL,
+       mem_available_mb REAL,
+       uptime INTEGER
+    ) WITHOUT ROWID
+    ''')
+
+
+def _full_sensor_fields(cursor) -> None:
+    """
+    Store every field of a reading, and add the packed blocks of the high-rate readings.
+    """
+    for column in ("pressure", "gas_resistance", "air_quality"):
+        cursor.execute(f"ALTER TABLE sensor_data ADD COLUMN {column} REAL")
+    # one row per flush of the ring buffer, the readings are packed column by column in `data`
+    cursor.execute('''
+    CREATE TABLE sensor_blocks(
+       start_ts REAL NOT NULL,
+       end_ts REAL NOT NULL,
+       count INTEGER NOT NULL,
+       data BLOB NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX idx_sensor_blocks_end_ts ON sensor_blocks(end_ts)")
+
+
+def _sensor_id_dimension(cursor) -> None:
+    """
+    Tell the readings of several sensors apart. Existing data belongs to the sensor 'main'.
+    """
+    cursor.execute("ALTER TABLE sensor_data ADD COLUMN sensor_id TEXT NOT NULL DEFAULT 'main'")
+    cursor.execute("CREATE INDEX idx_sensor_data_sensor_ts ON sensor_data(sensor_id, ts)")
+    cursor.execute("ALTER TABLE sensor_blocks ADD COLUMN sensor_id TEXT NOT NULL DEFAULT 'main'")
+
+    # the aggregates are per sensor, the sensor goes first in the key so every sensor is a contiguous range
+    cursor.execute('''
+    CREATE TABLE sensor_rollup_new(
+       sensor_id TEXT NOT NULL,
+       resolution INTEGER NOT NULL,
+       bucket INTEGER NOT NULL,
+       count INTEGER NOT NULL,
+       temp_sum REAL, temp_sumsq REAL, temp_min REAL, temp_max REAL,
+       hum_sum REAL, hum_sumsq REAL, hum_min REAL, hum_max REAL,
+       PRIMARY KEY (sensor_id, resolution, bucket)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("INSERT INTO sensor_rollup_new SELECT 'main', * FROM sensor_rollup")
+    cursor.execute("DROP TABLE sensor_rollup")
+    cursor.execute("ALTER TABLE sensor_rollup_new RENAME TO sensor_rollup")
+    # retention expires the oldest buckets of every sensor at once
+    cursor.execute("CREATE INDEX idx_sensor_rollup_bucket ON sensor_rollup(resolution, bucket)")
+
+
+def _compression_settings(cursor) -> None:
+    """
+    Record how the readings of a sensor are compressed, so they can be rebuilt when read.
+    A sensor without a row stores every reading.
+    """
+    cursor.execute('''
+    CREATE TABLE sensor_compression(
+       sensor_id TEXT PRIMARY KEY,
+       kind TEXT NOT NULL,
+       max_gap REAL NOT NULL
+    )
+    ''')
+
+
+def _database_id(cursor) -> None:
+    """
+    Give the database a random id. Row ids start over in a recreated database,
+    the id tells its rows from those of the file it replaced, e.g. in the graph cache.
+    """
+    cursor.execute("CREATE TABLE database_info(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    cursor.execute("INSERT INTO database_info VALUES ('id', ?)", (uuid.uuid4().hex,))
+
+
+MIGRATIONS = [
+    _epoch_time_column,
+    _rollup_table,
+    _system_metrics_table,
+    _full_sensor_fields,
+    _sensor_id_dimension,
+    _compression_settings,
+    _database_id,
+]
+
+
+def migrate(db_name) -> int:
+    """
+    Bring the database schema up to the latest version.
+    Each migration runs in its own transaction, an interrupted run can simply be repeated.
+
+    Args:
+        db_name (str): The name of the SQLite database file.
+
+    Returns:
+        int: The schema version of the database after migrating.
+    """
+    connection = sqlite3.connect(db_name, isolation_level=None)
+    try:
+        cursor = connection.cursor()
+        # deleted rows only shrink the file with auto_vacuum, switching an existing file needs a VACUUM
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.info(f"Switching {db_name} to incremental auto-vacuum.")
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for target, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Migrating {db_name} to version {target}: {step.__name__}")
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                step(cursor)
+                cursor.execute(f"PRAGMA user_version = {target}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                logger.error(f"Migration to version {target} failed.")
+                raise
+            version = target
+        return version
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    db_name = sys.argv[1] if len(sys.argv) > 1 else "sensor_data.db"
+    print(f"{db_name} is at schema version {migrate(db_name)}")
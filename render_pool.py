@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from db_handler import DEFAULT_SENSOR_ID
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# seconds between two checks whether a retired pool finished its other jobs
+DRAIN_POLL_INTERVAL = 0.2
+
+
+class RenderQueueFull(Exception):
+    """Raised when too many graph renders are already queued or running."""
+
+
+class RenderTimeout(Exception):
+    """Raised when a graph render does not finish within the job timeout."""
+
+
+def _render_job(hours, source, sensor_id) -> bytes:
+    """
+    Entry point executed inside a worker process.
+    The graph module is imported here so matplotlib is only loaded by the workers.
+    """
+    from graph import render_graph
+    return render_graph(hours, source, sensor_id)
+
+
+def _init_worker() -> None:
+    """
+    Runs once in every new worker process, before its first job.
+    """
+    from graph import warm_up
+    warm_up()
+
+
+def _warm_up_job() -> None:
+    """
+    No-op job, submitting it makes the pool start a worker.
+    """
+
+
+def _discard_result(future) -> None:
+    """
+    Retrieve the outcome of an abandoned job so asyncio does not warn about it.
+    """
+    if not future.cancelled():
+        future.exception()
+
+
+class GraphRenderPool:
+
+    """
+    Renders graphs in a bounded pool of worker processes, away from the asyncio event loop.
+
+    Attributes:
+      max_workers (int): Number of worker processes rendering in parallel.
+      max_queue (int): Number of jobs allowed to wait for a free worker.
+      timeout (float): Time in seconds a single job may take, queue time included.
+    """
+
+    def __init__(self, max_workers=4, max_queue=8, timeout=60):
+        """
+        Initialize the render pool. Worker processes are started on first use, or ahead of it by warm_up().
+
+        Args:
+            max_workers (int): Number of worker processes rendering in parallel.
+            max_queue (int): Number of jobs allowed to wait for a free worker.
+            timeout (float): Time in seconds a single job may take, queue time included.
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pending = 0
+        self._executor = None
+        # executor -> jobs submitted to it and not answered yet, also for a retired executor
+        self._jobs = {}
+        # retired executor -> its stuck jobs, the executor is terminated once its other jobs are done
+        self._retired = {}
+        self._drains = set()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # forkserver avoids forking the bot while its sensor/database threads hold locks.
+            # The server imports the graph engine once, the workers forked from it start with
+            # matplotlib already loaded and only build their figures.
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["graph"])
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=context, initializer=_init_worker)
+            self._jobs[self._executor] = set()
+        return self._executor
+
+    def _retire(self, executor, job) -> None:
+        """
+        Replace the workers of a stuck job. ProcessPoolExecutor cannot cancel a running job, only
+        its worker processes can be terminated, so new jobs go to a fresh pool while the other jobs
+        of the old one finish there. Then the old workers are terminated, the stuck job with them.
+        """
+        if self._executor is executor:
+            self._executor = None
+        stuck = self._retired.setdefault(executor, set())
+        stuck.add(job)
+        if len(stuck) == 1:
+            logger.warning("Graph render pool replaced after a stuck job.")
+            drain = asyncio.get_running_loop().create_task(self._drain(executor))
+            self._drains.add(drain)
+            drain.add_done_callback(self._drains.discard)
+
+    async def _drain(self, executor) -> None:
+        # every other job was submitted before the retirement, it is done or timed out within `timeout`
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        stuck = self._retired.get(executor, set())
+        while (asyncio.get_running_loop().time() < deadline and
+               any(not job.done() and job not in stuck for job in self._jobs.get(executor, ()))):
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+        self._terminate(executor)
+
+    def _terminate(self, executor) -> None:
+        if self._retired.pop(executor, None) is None:
+            return
+        self._jobs.pop(executor, None)
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        logger.info("Workers of a stuck graph render are terminated.")
+
+    async def render(self, hours, source="sensor", sensor_id=DEFAULT_SENSOR_ID) -> bytes:
+        """
+        Render the graph for the past `hours` in a worker process.
+
+        Args:
+            hours (int): The number of past hours to plot.
+            source (str): "sensor" for the BME680 readings, "system" for the Pi health metrics.
+            sensor_id (str): Sensor whose readings are plotted, for the "sensor" source.
+
+        Returns:
+            bytes: The encoded PNG image.
+
+        Raises:
+            RenderQueueFull: If `max_workers + max_queue` jobs are already pending.
+            RenderTimeout: If the job does not finish within `timeout` seconds.
+        """
+        if self._pending >= self.max_workers + self.max_queue:
+            raise RenderQueueFull(f"{self._pending} graph renders already pending.")
+
+        self._pending += 1
+        executor = job = None
+        try:
+            executor = self._get_executor()
+            job = executor.submit(_render_job, hours, source, sensor_id)
+            self._jobs[executor].add(job)
+            result = asyncio.wrap_future(job)
+            try:
+                # shield keeps wait_for from cancelling the job before we can inspect it
+                return await asyncio.wait_for(asyncio.shield(result), self.timeout)
+            except asyncio.TimeoutError:
+                result.add_done_callback(_discard_result)
+                # a job that already started cannot be cancelled, only killed with its worker
+                if not job.cancel():
+                    self._retire(executor, job)
+                raise RenderTimeout(f"Graph render for {hours}h exceeded {self.timeout}s.")
+            except asyncio.CancelledError:
+                # the caller went away, drop the job if it has not started yet
+                result.add_done_callback(_discard_result)
+                job.cancel()
+                raise
+        finally:
+            self._pending -= 1
+            self._jobs.get(executor, set()).discard(job)
+
+    def warm_up(self) -> None:
+        """
+        Start the forkserver and every worker in the background, so the first graph after a
+        (re)start does not pay for loading matplotlib. Returns right away.
+        """
+        executor = self._get_executor()
+
+        def start_workers():
+            try:
+                # starting a worker waits for the forkserver to finish importing the graph engine
+                jobs = [executor.submit(_warm_up_job) for _ in range(self.max_workers)]
+                for job in jobs:
+                    job.result()
+                logger.info(f"Graph render pool is warmed up with {self.max_workers} workers.")
+            except Exception as e:
+                logger.warning(f"Graph render pool warm-up failed: {e}")
+
+        threading.Thread(target=start_workers, name="graph-warm-up", daemon=True).start()
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes and drop any queued jobs.
+        """
+        for executor in list(self._retired):
+            self._terminate(executor)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            logger.info("Graph render pool is closed.")
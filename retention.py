@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from db_handler import DataBaseHandler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+
+    """
+    How long every kind of data is kept, in days. 0 keeps it forever.
+
+    The minute, hour and day aggregates are computed when a reading is inserted, so once
+    the raw rows expire their history is still available at a coarser resolution.
+
+    Attributes:
+      raw_days (float): Raw rows of sensor_data.
+      minute_days (float): Per-minute aggregates.
+      hour_days (float): Per-hour aggregates.
+      day_days (float): Per-day aggregates.
+      block_days (float): Packed high-rate readings (sensor_blocks).
+      system_days (float): Raspberry Pi health samples (system_metrics).
+    """
+
+    def __init__(self, raw_days=30, minute_days=90, hour_days=730, day_days=0, block_days=7, system_days=30):
+        self.raw_days = raw_days
+        self.minute_days = minute_days
+        self.hour_days = hour_days
+        self.day_days = day_days
+        self.block_days = block_days
+        self.system_days = system_days
+
+    def targets(self) -> list:
+        """
+        Return what has to be pruned, as (table, time column, days, where, params).
+        """
+        return [
+            ("sensor_data", "ts", self.raw_days, "", ()),
+            ("sensor_rollup", "bucket", self.minute_days, "resolution = ?", (60,)),
+            ("sensor_rollup", "bucket", self.hour_days, "resolution = ?", (3600,)),
+            ("sensor_rollup", "bucket", self.day_days, "resolution = ?", (86400,)),
+            ("sensor_blocks", "end_ts", self.block_days, "", ()),
+            ("system_metrics", "ts", self.system_days, "", ()),
+        ]
+
+
+def enforce_retention(policy, db, now=None, batch_size=500, pause=0.05, stop_event=None) -> int:
+    """
+    Delete everything older than the policy allows, `batch_size` rows per transaction.
+
+    Args:
+        policy (RetentionPolicy): What to keep.
+        db (DataBaseHandler): Connection used for the deletes.
+        now (float): Epoch seconds the ages are computed from, defaults to now.
+        batch_size (int): Rows deleted per transaction.
+        pause (float): Seconds between two batches, leaving the write lock to the data fillers.
+        stop_event (threading.Event): Interrupts the run between two batches.
+
+    Returns:
+        int: Number of rows deleted.
+    """
+    now = time.time() if now is None else now
+    stop_event = stop_event or threading.Event()
+    total = 0
+    for table, column, days, where, params in policy.targets():
+        if not days:
+            continue
+        before = int(now - days * 86400)
+        while not stop_event.is_set():
+            deleted = db.expire(table, column, before, batch_size, where, params)
+            total += deleted
+            if deleted < batch_size:
+                break
+            stop_event.wait(pause)
+    return total
+
+
+def run_retention(policy, db_name="sensor_data.db", interval=3600, stop_event=None,
+                  batch_size=500, vacuum_pages=256, pause=0.05):
+    """
+    Applies the retention policy at regular intervals, then hands the freed pages back
+    to the file system a few at a time, so the database file on the SD card stays bounded.
+
+    :param policy: RetentionPolicy to apply.
+    :param db_name: Name of the database file.
+    :param interval: Seconds between two runs, the first one starts right away.
+    :param stop_event: threading.Event that ends the loop.
+    :param batch_size: Rows deleted per transaction.
+    :param vacuum_pages: Pages freed per incremental vacuum step.
+    :param pause: Seconds between two delete batches or vacuum steps.
+    """
+    logging.info("Retention has started.")
+    stop_event = stop_event or threading.Event()
+    db = DataBaseHandler(db_name)
+    try:
+        while not stop_event.is_set():
+            try:
+                start = time.monotonic()
+                deleted = enforce_retention(policy, db, batch_size=batch_size, pause=pause, stop_event=stop_event)
+                free_pages = db.incremental_vacuum(vacuum_pages)
+                while free_pages and not stop_event.wait(pause):
+                    free_pages = db.incremental_vacuum(vacuum_pages)
+                db.checkpoint()
+                if deleted:
+                    logging.info(f"Retention deleted {deleted} expired rows in {time.monotonic() - start:.1f}s.")
+            except Exception as e:
+                logging.error(f"Retention failed: {e}")
+            stop_event.wait(interval)
+    finally:
+        db.close()
+        logging.info("Retention has stopped.")
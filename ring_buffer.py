@@ -0,0 +1,142 @@
+import logging
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# value columns of a full sensor reading, stored as float32 next to the float64 timestamps
+FIELDS = ("temperature", "pressure", "humidity", "gas_resistance", "air_quality")
+
+
+def pack_block(block) -> bytes:
+    """
+    Pack readings column by column: all timestamps (float64), then every field of FIELDS (float32).
+    A reading takes 28 bytes, missing values are stored as NaN.
+
+    Args:
+        block (dict of np.ndarray): 'ts' and every field of FIELDS, all of the same length.
+
+    Returns:
+        bytes: The packed block.
+    """
+    import numpy as np
+    columns = [np.asarray(block["ts"], dtype="<f8")]
+    columns += [np.asarray(block[field], dtype="<f4") for field in FIELDS]
+    return b"".join(column.tobytes() for column in columns)
+
+
+def unpack_block(data, count) -> dict:
+    """
+    Inverse of pack_block().
+
+    Args:
+        data (bytes): The packed block.
+        count (int): Number of readings in the block.
+
+    Returns:
+        dict of np.ndarray: 'ts' and every field of FIELDS.
+    """
+    import numpy as np
+    block = {"ts": np.frombuffer(data, dtype="<f8", count=count)}
+    offset = 8 * count
+    for field in FIELDS:
+        block[field] = np.frombuffer(data, dtype="<f4", count=count, offset=offset)
+        offset += 4 * count
+    return block
+
+
+class SensorRingBuffer:
+
+    """
+    Fixed-size, array-backed buffer of the most recent full sensor readings.
+
+    Appending overwrites the oldest reading once the buffer is full, nothing is allocated
+    per reading. Readings not yet written to the database are handed out with pending()
+    and acknowledged with mark_flushed(), so a failed write is retried with the next flush.
+
+    Attributes:
+      capacity (int): Number of readings kept.
+    """
+
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity (int): Number of readings kept, e.g. 3600 for one hour at 1 Hz.
+        """
+        import numpy as np
+        self.capacity = capacity
+        self._ts = np.zeros(capacity, dtype=np.float64)
+        self._values = np.full((len(FIELDS), capacity), np.nan, dtype=np.float32)
+        # running totals, the slot of reading n is n % capacity
+        self._appended = 0
+        self._flushed = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._appended, self.capacity)
+
+    def append(self, ts, values) -> None:
+        """
+        Store one reading. Called from the sensor sampler thread, returns in microseconds.
+
+        Args:
+            ts (float): Epoch seconds of the reading.
+            values (dict): Value of every field of FIELDS, missing or None values become NaN.
+        """
+        import numpy as np
+        with self._lock:
+            slot = self._appended % self.capacity
+            self._ts[slot] = ts
+            for i, field in enumerate(FIELDS):
+                value = values.get(field)
+                self._values[i, slot] = np.nan if value is None else value
+            self._appended += 1
+
+    def _columns(self, start, stop) -> dict:
+        # called with self._lock held, start and stop are running totals
+        import numpy as np
+        slots = np.arange(start, stop) % self.capacity
+        block = {"ts": self._ts[slots]}
+        for i, field in enumerate(FIELDS):
+            block[field] = self._values[i, slots]
+        return block
+
+    def since(self, ts) -> dict:
+        """
+        Return the buffered readings newer than `ts`, oldest first, without touching SQLite.
+
+        Args:
+            ts (float): Epoch seconds.
+
+        Returns:
+            dict of np.ndarray: 'ts' and every field of FIELDS (copies).
+        """
+        import numpy as np
+        with self._lock:
+            start = max(self._appended - self.capacity, 0)
+            block = self._columns(start, self._appended)
+        first = np.searchsorted(block["ts"], ts, side="right")
+        return {name: column[first:] for name, column in block.items()}
+
+    def pending(self) -> tuple:
+        """
+        Return the readings not written to the database yet.
+
+        Returns:
+            tuple: (position to pass to mark_flushed(), dict of np.ndarray like since()).
+        """
+        import numpy as np
+        with self._lock:
+            start = max(self._flushed, self._appended - self.capacity)
+            if start > self._flushed:
+                # the buffer wrapped around before it was flushed
+                logger.warning(f"{start - self._flushed} buffered readings were overwritten before being stored.")
+                self._flushed = start
+            return self._appended, self._columns(start, self._appended)
+
+    def mark_flushed(self, position) -> None:
+        """
+        Acknowledge that the readings handed out by pending() are stored.
+        """
+        with self._lock:
+            self._flushed = max(self._flushed, position)
@@ -1,186 +1,621 @@
-import time
-import logging
-import bme680   
-
-# Configure logging
-logger = logging.getLogger(__name__)
-
-class SensorManager:
-
-    """
-    Manages the BME680 sensor, handling initialization, stabilization and data retrieval.
-
-    Attributes:
-      stabilization_time (int): Time in seconds for sensor stabilization.
-      read_interval (int): Interval in seconds between stabilization readings.
-      sensor : BME680 sensor object.
-      gas_baseline (float): Baseline gas resistance value.
-      is_stabilized (bool): Indicates whether the sensor is stabilized.
-    """
-
-    def __init__(self, stabilization_time=300, read_interval=2):
-        """
-        Initialize the BME680 sensor manager.
-
-        Args:
-            stabilization_time (int): Time in seconds for sensor stabilization.
-            read_interval (int): Interval in seconds between stabilization readings.
-        """
-        
-        try:
-            self.sensor = bme680.BME680(bme680.I2C_ADDR_PRIMARY)
-        except (RuntimeError, IOError):
-            self.sensor = bme680.BME680(bme680.I2C_ADDR_SECONDARY)
-        try:
-            self.stabilization_time = stabilization_time
-            self.read_interval = read_interval
-            self.baseline = None
-            self.is_stabilized = False
-            self.gas_baseline = -1
-
-            self.sensor.set_humidity_oversample(bme680.OS_2X)
-            self.sensor.set_pressure_oversample(bme680.OS_4X)
-            self.sensor.set_temperature_oversample(bme680.OS_8X)
-            self.sensor.set_filter(bme680.FILTER_SIZE_3)
-            self.sensor.set_gas_status(bme680.ENABLE_GAS_MEAS)
-
-            self.sensor.set_gas_heater_temperature(320)
-            self.sensor.set_gas_heater_duration(150)
-            self.sensor.select_gas_heater_profile(0)
-
-            logger.info("Sensor initialized successfully.")
-        except Exception as e:
-            logger.error(f"Failed to initialize sensor: {e}")
-            raise
-
-    def stabilize_sensor(self):
-        """
-        Run the stabilization process to calculate baseline values.
-        Reads data every `read_interval` for `stabilization_time` seconds.
-        """
-
-        start_time = time.time()
-        curr_time = time.time()
-        burn_in_data = []
-        logger.info("Starting sensor stabilization.")
-        while curr_time - start_time < self.stabilization_time:
-            curr_time = time.time()
-            if self.sensor.get_sensor_data() and self.sensor.data.heat_stable:
-                gas = self.sensor.data.gas_resistance
-                burn_in_data.append(gas)
-                #print('Gas: {0} Ohms'.format(gas))
-                time.sleep(self.read_interval) 
-
-        self.gas_baseline = sum(burn_in_data[-50:]) / 50.0
-
-        self.is_stabilized = True
-        logger.info("The stabilization has finished.")
-
-
-    def read_sensor(self) -> str:
-        """
-        Read data from the BME680 sensor.
-
-        Returns:
-            str: A string with temperature, data pressure, humidity, and air quality (if the sensor is stabilized).
-        """
-        output = "No sensor data available."
-        if self.sensor.get_sensor_data():
-            output =("Temperature: {0:.2f} C\n"
-                      "Pressure: {1:.2f} hPa \n"
-                      "Humidity: {2:.2f} %RH").format(
-                self.sensor.data.temperature, 
-                self.sensor.data.pressure, 
-                self.sensor.data.humidity) 
-
-        if  self.is_stabilized:
-            logger.info("All the data will be sent.")
-            return self.air_quality(output)
-        else:
-            logger.warning("Gas Sensor is not stabilized. No data about gas")
-            return output
-    
-    def get_read_sensor(self) -> dict:
-       """
-       Read data from the BME680 sensor for database population.
-
-       Returns:
-         dict: A dictionary with temperature and humidity.
-       """
-       # FUTURE TO DO: combine this function with simple read_sensor
-       while self.sensor.get_sensor_data():
-            return {
-                  "temperature": self.sensor.data.temperature, 
-                  "humidity": self.sensor.data.humidity
-            }
-   
-
-    def air_quality(self, output):
-        """
-        Calculate the air quality score using humidity and gas resistance data.
-        Retries up to three times if sensor data is not heat-stable or unavailable.
-
-        Args:
-            output (str): Base output string from the sensor.
-
-        Returns:
-            str: Output string with the air quality score or an error message.
-        """
-
-        # Set the humidity baseline to 50%, an optimal indoor humidity.
-        hum_baseline = 50.0
-
-        # This sets the balance between humidity and gas reading in the
-        # calculation of air_quality_score (25:75, humidity:gas)
-        hum_weighting = 0.25
-
-        for attempt in range(3):  # Retry up to 3 times
-            try:
-                #if self.sensor.get_sensor_data() and self.sensor.data.heat_stable:
-                
-                if self.sensor.data.heat_stable:
-                    gas = self.sensor.data.gas_resistance
-                    gas_offset = self.gas_baseline - gas
-
-                    hum = self.sensor.data.humidity
-                    hum_offset = hum - hum_baseline
-
-                    # Calculate hum_score as the distance from the hum_baseline.
-                    if hum_offset > 0:
-                        hum_score = (100 - hum_baseline - hum_offset)
-                        hum_score /= (100 - hum_baseline)
-                        hum_score *= (hum_weighting * 100)
-                    else:
-                        hum_score = (hum_baseline + hum_offset)
-                        hum_score /= hum_baseline
-                        hum_score *= (hum_weighting * 100)
-
-                    # Calculate gas_score as the distance from the gas_baseline.
-                    if gas_offset > 0:
-                        gas_score = (gas / self.gas_baseline)
-                        gas_score *= (100 - (hum_weighting * 100))
-                    else:
-                        gas_score = 100 - (hum_weighting * 100)
-
-                    # Calculate air_quality_score.
-                    air_quality_score = hum_score + gas_score
-
-                    # Return the result with air quality score.
-                    return f"{output}\nAir Quality score: {air_quality_score:.2f}"
-
-                logger.warning(f"Attempt {attempt + 1}: Sensor data not heat-stable or unavailable.")
-            except Exception as e:
-                logger.error(f"Attempt {attempt + 1}: Error reading sensor data: {e}")
-
-            time.sleep(1)  # Small delay before retrying
-
-        # If all attempts fail, return an error message.
-        logger.error("Failed to retrieve air quality data after 3 attempts.")
-        return f"{output}, Air Quality data unavailable"
-
-
-
-if __name__ == "__main__":
-    sensor_manager = SensorManager()
-    sensor_manager.stabilize_sensor()
-
+import time
+import json
+import logging
+import math
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+import metrics
+from db_handler import DEFAULT_SENSOR_ID
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# number of most recent burn-in readings averaged into the gas baseline
+BASELINE_WINDOW = 50
+
+# seconds over which the gas baseline follows the drift of the sensor once stabilized,
+# the air changes much faster and barely moves it
+BASELINE_TIME_CONSTANT = 86400
+
+# seconds between two saves of the gas baseline maintained by the sampler
+BASELINE_SAVE_INTERVAL = 300
+
+# seconds between two attempts to set up a sensor that does not answer
+CONNECT_RETRY_INTERVAL = 10
+
+@dataclass(frozen=True)
+class SensorReading:
+
+    """
+    Immutable snapshot of one BME680 measurement.
+
+    Attributes:
+      timestamp (float): Epoch seconds of the measurement.
+      temperature (float): Temperature in C.
+      pressure (float): Pressure in hPa.
+      humidity (float): Relative humidity in %RH.
+      gas_resistance (float): Gas resistance in Ohms of the latest heated measurement,
+        None if the heater was not stable.
+      gas_timestamp (float): Epoch seconds of the heated measurement `gas_resistance` comes from.
+    """
+    timestamp: float
+    temperature: float
+    pressure: float
+    humidity: float
+    gas_resistance: float = None
+    gas_timestamp: float = None
+
+    @property
+    def heat_stable(self) -> bool:
+        return self.gas_resistance is not None
+
+
+class SensorManager:
+
+    """
+    Manages the BME680 sensor, handling initialization, stabilization and data retrieval.
+    A single sampler thread owns the I2C bus and publishes the latest reading,
+    every consumer reads that snapshot instead of talking to the sensor.
+    The gas heater self-heats the sensor, so it only runs for one measurement every
+    `read_interval` seconds, the readings in between carry the gas resistance of the latest
+    heated one. The gas resistance depends on how often the heater runs, so the burn-in and
+    the readings compared against its baseline use the same cadence.
+    The sensor itself is set up by the sampler thread (see connect()), so creating
+    the manager never waits for the I2C bus.
+
+    Attributes:
+      sensor_id (str): Name of the sensor, stored with its readings.
+      stabilization_time (int): Time in seconds for sensor stabilization.
+      read_interval (int): Interval in seconds between two gas readings.
+      sample_interval (float): Interval in seconds between two sampler readings.
+      sensor : BME680 sensor object, None until connect() succeeded.
+      gas_baseline (float): Baseline gas resistance value.
+      is_stabilized (bool): Indicates whether the sensor is stabilized.
+    """
+
+    def __init__(self, stabilization_time=300, read_interval=2, sample_interval=1,
+                 baseline_path="gas_baseline.json", max_baseline_age=86400, driver=None,
+                 sensor_id=DEFAULT_SENSOR_ID, i2c_addr=None, i2c_bus=None):
+        """
+        Initialize the BME680 sensor manager. Neither the driver nor the bus is touched yet.
+
+        Args:
+            stabilization_time (int): Time in seconds for sensor stabilization.
+            read_interval (int): Interval in seconds between two gas readings.
+            sample_interval (float): Interval in seconds between two sampler readings.
+            baseline_path (str): File the gas baseline is persisted to, None to disable persistence.
+            max_baseline_age (float): Age in seconds up to which a persisted baseline is used on start.
+            driver (module): Module providing the bme680 API, defaults to the bme680 package.
+                fake_bme680 can be passed to run without the hardware.
+            sensor_id (str): Name of the sensor, stored with its readings.
+            i2c_addr (int): I2C address of the sensor, None to try the primary then the secondary address.
+            i2c_bus (int): I2C bus number, None for the default bus of the driver.
+        """
+        self.sensor = None
+        self._driver = driver
+        self._i2c_addr = i2c_addr
+        self._i2c_bus = i2c_bus
+
+        self.sensor_id = sensor_id
+        self.stabilization_time = stabilization_time
+        self.read_interval = read_interval
+        self.baseline = None
+        self.is_stabilized = False
+        self.gas_baseline = -1
+        self.sample_interval = sample_interval
+        self.baseline_path = baseline_path
+        self.max_baseline_age = max_baseline_age
+
+        # the I2C bus is only touched while holding this lock
+        self._i2c_lock = threading.Lock()
+        # the driver's (disabled, enabled) gas status values and whether the heater is on
+        self._gas_status = None
+        self._gas_enabled = False
+        # (timestamp, resistance) of the latest heat-stable measurement
+        self._last_gas = None
+        # gas readings in the baseline, when the last one moved it and when it was persisted
+        self._baseline_samples = 0
+        self._baseline_updated_at = None
+        self._baseline_saved_at = 0.0
+        self._latest = None
+        self._new_reading = threading.Condition()
+        self._sampler = None
+        self._stop = threading.Event()
+        self._subscribers = []
+
+    def connect(self) -> None:
+        """
+        Import the driver and set up the BME680. Called by the sampler thread before the first
+        measurement, so a slow bus or a missing sensor does not hold back the start of the bot.
+
+        Raises:
+            Exception: If the sensor cannot be set up, the sampler retries later.
+        """
+        driver = self._driver
+        if driver is None:
+            # imported here so the bot can run with the fake driver where bme680 is not installed
+            import bme680 as driver
+        i2c_device = None
+        if self._i2c_bus is not None:
+            import smbus2
+            i2c_device = smbus2.SMBus(self._i2c_bus)
+        try:
+            if self._i2c_addr is not None:
+                sensor = driver.BME680(self._i2c_addr, i2c_device)
+            else:
+                try:
+                    sensor = driver.BME680(driver.I2C_ADDR_PRIMARY, i2c_device)
+                except (RuntimeError, IOError):
+                    sensor = driver.BME680(driver.I2C_ADDR_SECONDARY, i2c_device)
+
+            sensor.set_humidity_oversample(driver.OS_2X)
+            sensor.set_pressure_oversample(driver.OS_4X)
+            sensor.set_temperature_oversample(driver.OS_8X)
+            sensor.set_filter(driver.FILTER_SIZE_3)
+            sensor.set_gas_status(driver.ENABLE_GAS_MEAS)
+            self._gas_status, self._gas_enabled = (driver.DISABLE_GAS_MEAS, driver.ENABLE_GAS_MEAS), True
+
+            sensor.set_gas_heater_temperature(320)
+            sensor.set_gas_heater_duration(150)
+            sensor.select_gas_heater_profile(0)
+        except Exception:
+            if i2c_device is not None:
+                i2c_device.close()
+            raise
+        self.sensor = sensor
+        logger.info(f"Sensor {self.sensor_id} initialized successfully.")
+
+    def _measure(self) -> SensorReading:
+        """
+        Run one forced measurement on the sensor.
+
+        Returns:
+            SensorReading: The measurement, or None if the sensor returned no data.
+        """
+        with self._i2c_lock:
+            if self.sensor is None:
+                self.connect()
+            heat = self._last_gas is None or time.time() - self._last_gas[0] >= self.read_interval
+            if heat != self._gas_enabled:
+                self.sensor.set_gas_status(self._gas_status[heat])
+                self._gas_enabled = heat
+            started = time.time()
+            with metrics.SENSOR_READ_SECONDS.time(sensor=self.sensor_id):
+                ok = self.sensor.get_sensor_data()
+            if not ok:
+                metrics.SENSOR_READ_FAILURES.inc(sensor=self.sensor_id, reason="no_data")
+                return None
+            data = self.sensor.data
+            now = time.time()
+            if heat and data.heat_stable:
+                self._last_gas = (now, data.gas_resistance)
+            # gas is read at most every sample_interval, a gas reading that failed twice is not carried any longer
+            max_age = 2 * max(self.read_interval, self.sample_interval) + (now - started)
+            gas = self._last_gas if self._last_gas is not None and now - self._last_gas[0] <= max_age else None
+            return SensorReading(
+                timestamp=now,
+                temperature=data.temperature,
+                pressure=data.pressure,
+                humidity=data.humidity,
+                gas_resistance=gas[1] if gas else None,
+                gas_timestamp=gas[0] if gas else None)
+
+    def _sample_loop(self):
+        logger.info("Sensor sampler has started.")
+        while not self._stop.is_set():
+            try:
+                reading = self._measure()
+            except Exception as e:
+                action = "read" if self.sensor is not None else "initialize"
+                logger.error(f"Failed to {action} sensor {self.sensor_id}: {e}")
+                metrics.SENSOR_READ_FAILURES.inc(sensor=self.sensor_id, reason="error")
+                reading = None
+            if reading is not None:
+                with self._new_reading:
+                    self._latest = reading
+                    self._new_reading.notify_all()
+                if reading.heat_stable and reading.gas_timestamp == reading.timestamp:
+                    self._update_baseline(reading)
+                for callback in self._subscribers:
+                    try:
+                        callback(reading)
+                    except Exception as e:
+                        logger.error(f"Sensor subscriber failed: {e}")
+            # a sensor that could not be set up is retried less often
+            self._stop.wait(self.sample_interval if self.sensor is not None
+                            else max(self.sample_interval, CONNECT_RETRY_INTERVAL))
+        logger.info("Sensor sampler has stopped.")
+
+    def subscribe(self, callback):
+        """
+        Register a callback receiving every new SensorReading.
+        Callbacks run on the sampler thread and must return quickly.
+
+        Args:
+            callback (callable): Called with the SensorReading.
+        """
+        self._subscribers.append(callback)
+
+    def start_sampler(self):
+        """
+        Start the background thread reading the sensor every `sample_interval` seconds.
+        Calling it again while the sampler runs does nothing.
+        """
+        if self._sampler is None or not self._sampler.is_alive():
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, name=f"sensor-sampler-{self.sensor_id}",
+                                             daemon=True)
+            self._sampler.start()
+
+    def stop_sampler(self):
+        """
+        Stop the background sampler thread.
+        """
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=5)
+
+    def latest(self) -> SensorReading:
+        """
+        Return the most recent reading without touching the hardware.
+
+        Returns:
+            SensorReading: The latest snapshot, None before the first successful reading.
+        """
+        return self._latest
+
+    def wait_for_reading(self, after=0.0, timeout=None) -> SensorReading:
+        """
+        Block until a reading newer than `after` is published.
+
+        Args:
+            after (float): Epoch seconds the reading has to be newer than.
+            timeout (float): Maximum time to wait in seconds, None to wait forever.
+
+        Returns:
+            SensorReading: The new reading, or None on timeout.
+        """
+        with self._new_reading:
+            self._new_reading.wait_for(
+                lambda: self._latest is not None and self._latest.timestamp > after, timeout)
+            reading = self._latest
+        return reading if reading is not None and reading.timestamp > after else None
+
+    def _update_baseline(self, reading) -> None:
+        """
+        Move the gas baseline towards a new gas reading and persist it every BASELINE_SAVE_INTERVAL
+        seconds, so the saved baseline stays fresh while the bot runs for days.
+        """
+        if not self.is_stabilized:
+            return
+        if self._baseline_updated_at is not None:
+            # the weight of a reading grows with the time since the previous one, whatever read_interval is
+            elapsed = reading.timestamp - self._baseline_updated_at
+            weight = 1 - math.exp(-elapsed / BASELINE_TIME_CONSTANT)
+            self.gas_baseline += weight * (reading.gas_resistance - self.gas_baseline)
+            self._baseline_samples += 1
+        self._baseline_updated_at = reading.timestamp
+        if reading.timestamp - self._baseline_saved_at >= BASELINE_SAVE_INTERVAL:
+            self.save_baseline(self._baseline_samples)
+
+    def load_baseline(self) -> bool:
+        """
+        Load the gas baseline persisted by a previous run, if it is recent enough.
+        A loaded baseline makes air quality available right away.
+
+        Returns:
+            bool: True if a baseline was loaded.
+        """
+        if not self.baseline_path:
+            return False
+        try:
+            with open(self.baseline_path) as file:
+                saved = json.load(file)
+            baseline, age = float(saved["gas_baseline"]), time.time() - float(saved["saved_at"])
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable gas baseline file: {e}")
+            return False
+
+        if age > self.max_baseline_age or baseline <= 0:
+            logger.info(f"Persisted gas baseline is {age:.0f}s old, running a full burn-in.")
+            return False
+        self.gas_baseline = baseline
+        self._baseline_samples = int(saved.get("samples", 0))
+        self.is_stabilized = True
+        logger.info(f"Loaded gas baseline {baseline:.0f} Ohms ({age:.0f}s old).")
+        return True
+
+    def save_baseline(self, samples) -> None:
+        """
+        Persist the gas baseline together with the time it was computed.
+
+        Args:
+            samples (int): Number of readings the baseline was averaged from.
+        """
+        if not self.baseline_path:
+            return
+        self._baseline_saved_at = time.time()
+        tmp_path = self.baseline_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump({"gas_baseline": self.gas_baseline, "saved_at": time.time(), "samples": samples}, file)
+            # the rename is atomic, a crash never leaves a half written baseline behind
+            os.replace(tmp_path, self.baseline_path)
+        except OSError as e:
+            logger.error(f"Failed to persist the gas baseline: {e}")
+
+    def stabilize_sensor(self):
+        """
+        Run the stabilization process to calculate baseline values.
+        Collects a gas reading every `read_interval` for `stabilization_time` seconds.
+
+        If a recent baseline was persisted, it is used immediately and the burn-in
+        only refines it in the background. The result is persisted for the next start,
+        afterwards the sampler keeps following the sensor's drift (see _update_baseline()).
+        """
+
+        self.start_sampler()
+        warm_start = self.load_baseline()
+        start_time = time.time()
+        curr_time = time.time()
+        last_time = 0.0
+        last_gas_time = 0.0
+        # only the most recent readings count, older ones are dropped as new ones arrive
+        burn_in_data = deque(maxlen=BASELINE_WINDOW)
+        logger.info("Starting sensor stabilization." if not warm_start else "Refining the gas baseline.")
+        while curr_time - start_time < self.stabilization_time:
+            reading = self.wait_for_reading(after=last_time, timeout=self.stabilization_time)
+            curr_time = time.time()
+            if reading is None:
+                continue
+            last_time = reading.timestamp
+            # the readings in between carry the same gas reading, it is counted once
+            if reading.heat_stable and reading.gas_timestamp > last_gas_time:
+                last_gas_time = reading.gas_timestamp
+                burn_in_data.append(reading.gas_resistance)
+                #print('Gas: {0} Ohms'.format(gas))
+
+        if not burn_in_data:
+            logger.error("No heat-stable reading during stabilization, the gas baseline is unchanged.")
+            return
+
+        self.gas_baseline = sum(burn_in_data) / len(burn_in_data)
+        self._baseline_samples = len(burn_in_data)
+        self.save_baseline(len(burn_in_data))
+
+        self.is_stabilized = True
+        logger.info("The stabilization has finished.")
+
+    def read_sensor(self, max_age=60) -> str:
+        """
+        Format the latest sensor reading. Never touches the hardware or blocks.
+
+        Args:
+            max_age (float): Readings older than this many seconds are reported as stale.
+
+        Returns:
+            str: A string with temperature, data pressure, humidity, and air quality (if the sensor is stabilized).
+        """
+        reading = self.latest()
+        if reading is None:
+            return "No sensor data available."
+        age = time.time() - reading.timestamp
+        if age > max_age:
+            # the sampler stopped or the sensor no longer answers, the values are not current
+            logger.warning(f"Sensor {self.sensor_id} data is stale.")
+            taken = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(reading.timestamp))
+            return f"Sensor data is stale ({age:.0f}s old, taken at {taken})."
+        output =("Temperature: {0:.2f} C\n"
+                  "Pressure: {1:.2f} hPa \n"
+                  "Humidity: {2:.2f} %RH").format(
+            reading.temperature,
+            reading.pressure,
+            reading.humidity)
+
+        if  self.is_stabilized:
+            logger.info("All the data will be sent.")
+            return self.air_quality(output, reading)
+        else:
+            logger.warning("Gas Sensor is not stabilized. No data about gas")
+            return output
+    
+    def get_read_sensor(self, max_age=60) -> dict:
+       """
+       Return the latest sensor reading for database population.
+
+       Args:
+         max_age (float): Readings older than this many seconds are considered stale.
+
+       Returns:
+         dict: A dictionary with timestamp and every field of the reading (see reading_fields()),
+         or None if there is no fresh reading.
+       """
+       reading = self.latest()
+       if reading is None or time.time() - reading.timestamp > max_age:
+           return None
+       return dict(self.reading_fields(reading), timestamp=reading.timestamp)
+
+    def reading_fields(self, reading) -> dict:
+        """
+        Return every stored field of `reading`.
+
+        Returns:
+          dict: temperature, humidity, pressure, gas_resistance and air_quality,
+          the last two None when not available.
+        """
+        return {
+              "temperature": reading.temperature,
+              "humidity": reading.humidity,
+              "pressure": reading.pressure,
+              "gas_resistance": reading.gas_resistance,
+              "air_quality": self.air_quality_score(reading),
+        }
+   
+
+    def air_quality_score(self, reading) -> float:
+        """
+        Calculate the air quality score using humidity and gas resistance data.
+
+        Args:
+            reading (SensorReading): The reading to score.
+
+        Returns:
+            float: The score (0-100, higher is better), None if the sensor is not stabilized
+            or the reading is not heat-stable.
+        """
+        if not self.is_stabilized or not reading.heat_stable:
+            return None
+
+        # Set the humidity baseline to 50%, an optimal indoor humidity.
+        hum_baseline = 50.0
+
+        # This sets the balance between humidity and gas reading in the
+        # calculation of air_quality_score (25:75, humidity:gas)
+        hum_weighting = 0.25
+
+        gas = reading.gas_resistance
+        gas_offset = self.gas_baseline - gas
+
+        hum = reading.humidity
+        hum_offset = hum - hum_baseline
+
+        # Calculate hum_score as the distance from the hum_baseline.
+        if hum_offset > 0:
+            hum_score = (100 - hum_baseline - hum_offset)
+            hum_score /= (100 - hum_baseline)
+            hum_score *= (hum_weighting * 100)
+        else:
+            hum_score = (hum_baseline + hum_offset)
+            hum_score /= hum_baseline
+            hum_score *= (hum_weighting * 100)
+
+        # Calculate gas_score as the distance from the gas_baseline.
+        if gas_offset > 0:
+            gas_score = (gas / self.gas_baseline)
+            gas_score *= (100 - (hum_weighting * 100))
+        else:
+            gas_score = 100 - (hum_weighting * 100)
+
+        # Calculate air_quality_score.
+        return hum_score + gas_score
+
+    def air_quality(self, output, reading):
+        """
+        Append the air quality score of `reading` to the sensor output.
+
+        Args:
+            output (str): Base output string from the sensor.
+            reading (SensorReading): The reading to score.
+
+        Returns:
+            str: Output string with the air quality score or an error message.
+        """
+        air_quality_score = self.air_quality_score(reading)
+        if air_quality_score is None:
+            # the sampler publishes a new reading every sample_interval, no need to wait for it here
+            logger.warning("Sensor data not heat-stable, no air quality score.")
+            return f"{output}, Air Quality data unavailable"
+
+        # Return the result with air quality score.
+        return f"{output}\nAir Quality score: {air_quality_score:.2f}"
+
+def parse_sensor_specs(text) -> list:
+    """
+    Parse the sensor list of the SENSORS setting, e.g. 'indoor:0x76,outdoor:0x77,attic:0x76@3'.
+    Every entry is name:address[@bus]; an empty text means one sensor named DEFAULT_SENSOR_ID
+    at the primary or secondary address of the default bus.
+
+    Returns:
+        list of tuples: (sensor_id, i2c address or None, bus number or None).
+
+    Raises:
+        ValueError: If an entry is malformed or a name is used twice.
+    """
+    if not text.strip():
+        return [(DEFAULT_SENSOR_ID, None, None)]
+    specs = []
+    for entry in text.split(","):
+        name, _, address = entry.strip().partition(":")
+        address, _, bus = address.partition("@")
+        if not name or not address:
+            raise ValueError(f"Invalid sensor '{entry}', expected name:address[@bus].")
+        specs.append((name, int(address, 0), int(bus) if bus else None))
+    names = [name for name, _, _ in specs]
+    if len(set(names)) != len(names):
+        raise ValueError("Sensor names must be unique.")
+    return specs
+
+
+class SensorRegistry:
+
+    """
+    The sensors of the Pi, by name.
+
+    Every sensor has its own SensorManager, so its own sampler thread, stabilization state and
+    gas baseline. The samplers read their sensors concurrently, each on its own schedule, and
+    nothing iterates over the other sensors on a reading's path, so adding a sensor adds one
+    thread and no work to the others.
+    """
+
+    def __init__(self, managers=()):
+        self._managers = {}
+        for manager in managers:
+            self.add(manager)
+
+    def add(self, manager) -> None:
+        if manager.sensor_id in self._managers:
+            raise ValueError(f"Sensor {manager.sensor_id} is already registered.")
+        self._managers[manager.sensor_id] = manager
+
+    def __iter__(self):
+        return iter(list(self._managers.values()))
+
+    def __len__(self):
+        return len(self._managers)
+
+    def ids(self) -> list:
+        return list(self._managers)
+
+    def get(self, sensor_id=None) -> SensorManager:
+        """
+        Return the sensor named `sensor_id`, the first registered sensor if None.
+
+        Raises:
+            KeyError: If there is no such sensor.
+        """
+        if sensor_id is None:
+            return next(iter(self._managers.values()))
+        return self._managers[sensor_id]
+
+    def start_samplers(self) -> None:
+        for manager in self:
+            manager.start_sampler()
+
+    def stop_samplers(self) -> None:
+        for manager in self:
+            manager.stop_sampler()
+
+    def stabilize_all(self) -> list:
+        """
+        Stabilize every sensor in its own background thread.
+
+        Returns:
+            list of threading.Thread: The stabilization threads.
+        """
+        threads = []
+        for manager in self:
+            thread = threading.Thread(target=manager.stabilize_sensor, name=f"stabilize-{manager.sensor_id}",
+                                      daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+
+if __name__ == "__main__":
+    sensor_manager = SensorManager()
+    sensor_manager.stabilize_sensor()
+
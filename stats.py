@@ -0,0 +1,67 @@
+import html
+import logging
+from db_handler import DataBaseHandler, DEFAULT_SENSOR_ID, RESOLUTION_LABELS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# rows of the /stats message: (field, label, decimals)
+STATS_ROWS = [
+    ("temperature", "Temp °C", 1),
+    ("humidity", "Hum %", 1),
+]
+
+# columns of the /stats table, in the order of the keys of DataBaseHandler.get_hours_stats()
+STATS_COLUMNS = ("min", "avg", "max", "stddev", "p5", "p50", "p95")
+
+
+def _number(value, decimals) -> str:
+    return "-" if value is None else f"{value:.{decimals}f}"
+
+
+def format_stats(stats, hours, sensor_id=DEFAULT_SENSOR_ID) -> str:
+    """
+    Build the /stats message from the result of DataBaseHandler.get_hours_stats().
+
+    Returns:
+        str: HTML for Telegram, the tables inside a <pre> block.
+    """
+    title = f"Stats of the last {hours}h" + (f" ({sensor_id})" if sensor_id != DEFAULT_SENSOR_ID else "")
+    header = ["", *("sd" if column == "stddev" else column for column in STATS_COLUMNS)]
+    rows = [header] + [[label, *(_number(stats[field][column], decimals) for column in STATS_COLUMNS)]
+                       for field, label, decimals in STATS_ROWS]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    lines = [" ".join(cell.rjust(width) if i else cell.ljust(width)
+                      for i, (cell, width) in enumerate(zip(row, widths))) for row in rows]
+
+    source = f"{stats['count']} readings"
+    if stats["resolution"]:
+        source += f", from the {RESOLUTION_LABELS[stats['resolution']]} aggregates"
+    lines.append(source)
+    if stats["percentile_resolution"]:
+        lines.append(f"Percentiles of the {RESOLUTION_LABELS[stats['percentile_resolution']]} averages")
+
+    if stats["profile"]:
+        lines.append("")
+        lines.append("Hour " + " ".join(label.split()[0].rjust(6) for _, label, _ in STATS_ROWS))
+        for hour, averages in stats["profile"].items():
+            lines.append(f"{hour:02d}   " + " ".join(_number(averages[field], decimals).rjust(6)
+                                                      for field, _, decimals in STATS_ROWS))
+    return f"<b>{html.escape(title)}</b>\n<pre>{html.escape(chr(10).join(lines))}</pre>"
+
+
+def build_stats(hours, sensor_id=DEFAULT_SENSOR_ID, db_name="sensor_data.db") -> str:
+    """
+    Compute the statistics of the last {hours} of `sensor_id` in SQLite and format them with format_stats().
+
+    Returns:
+        str: The message, None if there are no readings in the range.
+    """
+    db = DataBaseHandler(db_name)
+    try:
+        stats = db.get_hours_stats(hours, sensor_id)
+    finally:
+        db.close()
+    if not stats["count"]:
+        return None
+    return format_stats(stats, hours, sensor_id)
@@ -1,13 +1,26 @@
 import os
+import glob
 import logging
+import threading
+import time
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# /proc/diskstats counts sectors of 512 bytes, whatever the real sector size is
+SECTOR_SIZE = 512
+
+
 class GetSystemInfo:
 
     """
     A Class to gather and process system information from a Raspberry Pi.
+
+    The /proc and /sys files are opened once and re-read with pread, so a reading
+    costs one system call per file. The previous snapshot of every consumer is kept
+    to turn the kernel counters into rates (CPU %, bytes/s, IOPS), so the rates of one
+    consumer do not depend on how often the others call. One shared instance is
+    meant to serve the whole bot.
     """
 
     def __init__(self):
@@ -15,6 +28,46 @@ class GetSystemInfo:
       self.temp_threshold = 85
       self.mem_proc_treshold = 85
 
+      self._lock = threading.Lock()
+      self._prev = {}  # consumer -> (monotonic time, counters) of its previous snapshot
+      self._fds = {}
+      sources = {
+          "stat": "/proc/stat",
+          "loadavg": "/proc/loadavg",
+          "diskstats": "/proc/diskstats",
+          "net": "/proc/net/dev",
+          "meminfo": "/proc/meminfo",
+          "uptime": "/proc/uptime",
+      }
+      for path in sorted(glob.glob("/sys/class/thermal/thermal_zone*/temp")):
+          sources[os.path.basename(os.path.dirname(path))] = path
+      for name, path in sources.items():
+          try:
+              self._fds[name] = os.open(path, os.O_RDONLY)
+          except OSError:
+              logging.warning(f"{path} is not available")
+      # whole disks only, partitions would count the same I/O twice
+      self._disks = {d for d in os.listdir("/sys/block") if not d.startswith(("loop", "ram", "zram"))} \
+          if os.path.isdir("/sys/block") else set()
+
+    def close(self) -> None:
+        """
+        Close the file descriptors kept open between readings.
+        """
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+
+    def _read(self, name) -> str:
+        """
+        Re-read an already opened /proc or /sys file from the beginning.
+        Raises FileNotFoundError if the file could not be opened.
+        """
+        fd = self._fds.get(name)
+        if fd is None:
+            raise FileNotFoundError(name)
+        return os.pread(fd, 65536, 0).decode()
+
     def cpu_temp(self) -> float:
         """
         Reads the CPU temperature from /sys/class/thermal/thermal_zone0/temp
@@ -22,8 +75,7 @@ class GetSystemInfo:
         """
         logging.info("Get temperature from RPI")
         try:
-            with open('/sys/class/thermal/thermal_zone0/temp', 'r') as file:
-               return round(float(file.read()) / 1000, 1)
+            return round(float(self._read("thermal_zone0")) / 1000, 1)
         except FileNotFoundError:
             logging.error("The temp file was not found")
             return ("Data not available")
@@ -34,35 +86,163 @@ class GetSystemInfo:
         Returns a dictionary with total, available, used memory in MB and percent used.
         """
         logging.info("Get memory from RPI")
-        meminfo = {}
         try:
-           with open('/proc/meminfo', 'r') as f:
-                for line in f:
-                   parts = line.split()
-                   key = parts[0].strip(':') # remove final ':'
-                   value = int(parts[1]) # by default in kb
-                   meminfo[key] = value
-
-           total_mem = meminfo.get("MemTotal", 0) / 1024 # convert to MB
-           available_mem = meminfo.get("MemAvailable", 0) / 1024
-           used_mem = total_mem - available_mem
-           percent_used = (used_mem / total_mem) * 100 if total_mem >0 else 0
-
-           return {
-             "total_mem": total_mem,
-             "available_mem": available_mem,
-             "used_mem": used_mem,
-             "percent_used": percent_used,
-           }
+           return self._memory(self._read("meminfo"))
         except Exception as e:
            logging.error("Unexpected error while processing memory")
            return {"Error": f"Unexpected error: {e}"}
 
-    def mem_info_string(self) -> str:
+    def _memory(self, text) -> dict:
+        """
+        Memory figures in MB from the text of /proc/meminfo.
+        """
+        total_mem = self._meminfo_value(text, "MemTotal:") / 1024 # convert to MB
+        available_mem = self._meminfo_value(text, "MemAvailable:") / 1024
+        used_mem = total_mem - available_mem
+        percent_used = (used_mem / total_mem) * 100 if total_mem >0 else 0
+
+        return {
+          "total_mem": total_mem,
+          "available_mem": available_mem,
+          "used_mem": used_mem,
+          "percent_used": percent_used,
+        }
+
+    @staticmethod
+    def _meminfo_value(text, key) -> int:
+        """
+        Value in kB of one /proc/meminfo key, found without splitting the whole file.
+        """
+        start = text.find(key)
+        if start < 0:
+            return 0
+        end = text.find("\n", start)
+        return int(text[start + len(key):end].split()[0]) # by default in kb
+
+    def snapshot(self, consumer="default") -> dict:
+        """
+        Gather CPU, memory, disk, network, thermal and uptime data in one pass.
+        Rates are computed against the previous snapshot of the same `consumer`, they are None on its first call.
+
+        Args:
+            consumer (str): Who takes the snapshot, e.g. the metrics recorder or /inforpi.
+
+        Returns:
+            dict with keys:
+              - 'time' (float): monotonic time of the snapshot
+              - 'cpu_temp' (float): thermal_zone0 temperature in C
+              - 'thermal' (dict): temperature in C of every thermal zone
+              - 'cpu_percent' (float): overall CPU load in %
+              - 'cpu_percent_per_core' (list): CPU load in % of every core
+              - 'loadavg' (tuple): 1, 5 and 15 minute load averages
+              - 'memory' (dict): same keys as mem_info()
+              - 'disk' (dict): per disk 'read_bytes_s', 'write_bytes_s', 'iops'
+              - 'net' (dict): per interface 'rx_bytes_s', 'tx_bytes_s'
+              - 'uptime' (float): uptime in seconds
+        """
+        with self._lock:
+            now = time.monotonic()
+            counters = {
+                "cpu": self._parse_stat(self._read("stat")) if "stat" in self._fds else {},
+                "disk": self._parse_diskstats(self._read("diskstats")) if "diskstats" in self._fds else {},
+                "net": self._parse_net(self._read("net")) if "net" in self._fds else {},
+            }
+            prev, self._prev[consumer] = self._prev.get(consumer), (now, counters)
+
+            thermal = {name: round(float(self._read(name)) / 1000, 1)
+                       for name in self._fds if name.startswith("thermal_zone")}
+            loadavg = tuple(float(v) for v in self._read("loadavg").split()[:3]) if "loadavg" in self._fds else None
+            result = {
+                "time": now,
+                "cpu_temp": thermal.get("thermal_zone0"),
+                "thermal": thermal,
+                "cpu_percent": None,
+                "cpu_percent_per_core": None,
+                "loadavg": loadavg,
+                "memory": self._memory(self._read("meminfo")) if "meminfo" in self._fds else None,
+                "disk": None,
+                "net": None,
+                "uptime": float(self._read("uptime").split()[0]) if "uptime" in self._fds else None,
+            }
+            if prev is None:
+                return result
+
+            elapsed = now - prev[0]
+            old = prev[1]
+            cpu = {}
+            for name, (busy, total) in counters["cpu"].items():
+                if name in old["cpu"]:
+                    d_busy, d_total = busy - old["cpu"][name][0], total - old["cpu"][name][1]
+                    cpu[name] = round(100 * d_busy / d_total, 1) if d_total > 0 else 0.0
+            result["cpu_percent"] = cpu.pop("cpu", None)
+            result["cpu_percent_per_core"] = [cpu[name] for name in sorted(cpu, key=lambda n: int(n[3:]))]
+            result["disk"] = {
+                name: {
+                    "read_bytes_s": (reads[1] - old["disk"][name][1]) * SECTOR_SIZE / elapsed,
+                    "write_bytes_s": (reads[3] - old["disk"][name][3]) * SECTOR_SIZE / elapsed,
+                    "iops": ((reads[0] - old["disk"][name][0]) + (reads[2] - old["disk"][name][2])) / elapsed,
+                }
+                for name, reads in counters["disk"].items() if name in old["disk"]
+            }
+            result["net"] = {
+                name: {
+                    "rx_bytes_s": (rx - old["net"][name][0]) / elapsed,
+                    "tx_bytes_s": (tx - old["net"][name][1]) / elapsed,
+                }
+                for name, (rx, tx) in counters["net"].items() if name in old["net"]
+            }
+            return result
+
+    @staticmethod
+    def _parse_stat(text) -> dict:
+        """
+        (busy, total) jiffies of the 'cpu' line and of every 'cpuN' line in /proc/stat.
+        """
+        cpu = {}
+        for line in text.splitlines():
+            if not line.startswith("cpu"):
+                break
+            parts = line.split()
+            values = [int(v) for v in parts[1:9]]
+            idle = values[3] + values[4] # idle + iowait
+            total = sum(values)
+            cpu[parts[0]] = (total - idle, total)
+        return cpu
+
+    def _parse_diskstats(self, text) -> dict:
+        """
+        (reads completed, sectors read, writes completed, sectors written) of every disk.
+        """
+        disks = {}
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) > 9 and parts[2] in self._disks:
+                disks[parts[2]] = (int(parts[3]), int(parts[5]), int(parts[7]), int(parts[9]))
+        return disks
+
+    @staticmethod
+    def _parse_net(text) -> dict:
+        """
+        (received bytes, transmitted bytes) of every network interface except loopback.
+        """
+        net = {}
+        for line in text.splitlines()[2:]:
+            name, _, values = line.partition(":")
+            name = name.strip()
+            if name == "lo":
+                continue
+            values = values.split()
+            net[name] = (int(values[0]), int(values[8]))
+        return net
+
+    def mem_info_string(self, memory=None) -> str:
         """
         Returns the memory information as a formatted string.
+
+        Args:
+            memory (dict): Memory figures like mem_info(), e.g. from a snapshot, read now if None.
         """
-        aux = self.mem_info()
+        aux = self.mem_info() if memory is None else memory
         return (f"Memory info:\nTotal Memory: {aux['total_mem']:.2f} MB\n"
                 f"Available Memory: {aux['available_mem']:.2f} MB\n"
                 f"Used Memory: {aux['used_mem']:.2f} MB -- Percent used: {aux['percent_used']:.2f}%" )
@@ -87,8 +267,7 @@ class GetSystemInfo:
         Extract the system uptime from /proc/uptime and converts it into days, hours, minutes, seconds.
         Return a list of integers.
         """
-        with open('/proc/uptime', 'r') as file:
-            uptime_seconds = int(float(file.read().split()[0]))
+        uptime_seconds = int(float(self._read("uptime").split()[0]))
         days = uptime_seconds // 86400
         hours = (uptime_seconds % 86400) // 3600
         minutes = (uptime_seconds % 3600) // 60
@@ -0,0 +1,27 @@
+import asyncio
+
+from graph_cache import GraphCache
+
+
+def test_waiters_render_again_when_the_first_request_is_cancelled(tmp_path):
+    cache = GraphCache(str(tmp_path))
+    renders = []
+
+    async def render():
+        renders.append(1)
+        await asyncio.sleep(0.2)
+        return b"png"
+
+    async def scenario():
+        first = asyncio.create_task(cache.get_or_render(("graph", 1), render))
+        await asyncio.sleep(0.05)
+        waiters = [asyncio.create_task(cache.get_or_render(("graph", 1), render)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        first.cancel()
+        entries = await asyncio.gather(*waiters)
+        assert first.cancelled()
+        assert [entry.png for entry in entries] == [b"png"] * 3
+        # one render was abandoned, the waiters share the second one
+        assert len(renders) == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+
+import render_pool
+from render_pool import GraphRenderPool, RenderTimeout
+
+
+def sleep_job(hours, source, sensor_id) -> bytes:
+    # stands in for render_graph, `hours` is the time the job takes
+    time.sleep(hours)
+    return str(hours).encode()
+
+
+def no_warm_up() -> None:
+    pass
+
+
+def test_stuck_job_does_not_fail_the_other_renders(monkeypatch):
+    monkeypatch.setattr(render_pool, "_render_job", sleep_job)
+    monkeypatch.setattr(render_pool, "_init_worker", no_warm_up)
+
+    async def scenario():
+        pool = GraphRenderPool(max_workers=2, max_queue=2, timeout=30)
+        try:
+            # both workers are started before the timed jobs
+            await asyncio.gather(pool.render(0), pool.render(0))
+            old_processes = list(pool._executor._processes.values())
+            pool.timeout = 1
+            stuck = asyncio.create_task(pool.render(60))
+            await asyncio.sleep(0.5)
+            # still running when the stuck job times out
+            other = asyncio.create_task(pool.render(0.8))
+            with pytest.raises(RenderTimeout):
+                await stuck
+            assert await other == b"0.8"
+            assert await pool.render(0) == b"0"
+            # the old workers, the stuck one included, are terminated once the other job is done
+            for _ in range(50):
+                if not any(process.is_alive() for process in old_processes):
+                    break
+                await asyncio.sleep(0.1)
+            assert not any(process.is_alive() for process in old_processes)
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
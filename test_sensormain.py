@@ -0,0 +1,45 @@
+import json
+import time
+import fake_bme680
+import sensormain
+from sensormain import SensorManager, SensorReading
+
+
+def test_stabilize_sensor_collects_a_gas_baseline():
+    fake_bme680.configure(latency=0.0, unstable_rate=0.0, failure_rate=0.0, missing_primary=False, seed=1)
+    manager = SensorManager(1, 0, sample_interval=0, baseline_path=None, driver=fake_bme680)
+    try:
+        manager.stabilize_sensor()
+    finally:
+        manager.stop_sampler()
+    assert manager.is_stabilized
+    assert manager.gas_baseline > 0
+
+
+def test_read_sensor_reports_stale_data():
+    manager = SensorManager(baseline_path=None, driver=fake_bme680)
+    assert manager.read_sensor() == "No sensor data available."
+    manager._latest = SensorReading(timestamp=time.time() - 3600, temperature=21.0, pressure=1013.0, humidity=40.0)
+    assert manager.read_sensor().startswith("Sensor data is stale (3600s old")
+    manager._latest = SensorReading(timestamp=time.time(), temperature=21.0, pressure=1013.0, humidity=40.0)
+    assert manager.read_sensor().startswith("Temperature: 21.00 C")
+
+
+def test_sampler_keeps_the_baseline_fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(sensormain, "BASELINE_SAVE_INTERVAL", 0)
+    monkeypatch.setattr(sensormain, "BASELINE_TIME_CONSTANT", 1)
+    path = tmp_path / "gas_baseline.json"
+    path.write_text(json.dumps({"gas_baseline": 1000.0, "saved_at": time.time(), "samples": 10}))
+    fake_bme680.configure(latency=0.0, unstable_rate=0.0, failure_rate=0.0, missing_primary=False, seed=1)
+    manager = SensorManager(60, 0, sample_interval=0.05, baseline_path=str(path), driver=fake_bme680)
+    assert manager.load_baseline()
+    manager.start_sampler()
+    try:
+        time.sleep(1)
+    finally:
+        manager.stop_sampler()
+    saved = json.loads(path.read_text())
+    # the fake gas resistance is about 120 kOhm, the baseline moves there and is saved again
+    assert manager.gas_baseline > 1000.0
+    assert saved["samples"] > 10
+    assert saved["gas_baseline"] > 1000.0
@@ -0,0 +1,159 @@
+import html
+import logging
+import time
+from db_handler import DataBaseHandler, DEFAULT_SENSOR_ID
+from ring_buffer import FIELDS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# eighth blocks from lowest to highest, an empty bucket is shown as a space
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+# characters per sparkline, they fit on one line of a phone screen in monospace
+TREND_WIDTH = 24
+
+# rows of the /trend message: (field, label, unit, decimals)
+TREND_FIELDS = [
+    ("temperature", "Temp", "°C", 1),
+    ("humidity", "Hum", "%", 1),
+    ("pressure", "Pres", "hPa", 0),
+]
+
+# ranges up to this many hours are drawn from the high-rate readings when they cover the range
+HIGH_RATE_HOURS = 6
+
+
+def bucket_means(ts, values, start, end, width=TREND_WIDTH) -> "np.ndarray":
+    """
+    Average `values` over `width` equal time buckets between `start` and `end`, without a Python loop.
+
+    Args:
+        ts (np.ndarray): Epoch seconds of the values.
+        values (np.ndarray): The values, NaN for missing ones.
+        start (float): Epoch seconds where the first bucket starts.
+        end (float): Epoch seconds where the last bucket ends.
+        width (int): Number of buckets.
+
+    Returns:
+        np.ndarray: The mean of every bucket, NaN for the buckets without values.
+    """
+    import numpy as np
+    valid = ~np.isnan(values)
+    ts, values = ts[valid], values[valid]
+    index = ((ts - start) * width // max(end - start, 1)).astype(np.int64).clip(0, width - 1)
+    counts = np.bincount(index, minlength=width)
+    sums = np.bincount(index, weights=values, minlength=width)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def sparkline(means) -> str:
+    """
+    Draw the bucket means as a line of block characters scaled between their min and max.
+    """
+    import numpy as np
+    valid = ~np.isnan(means)
+    if not valid.any():
+        return " " * len(means)
+    low, high = np.nanmin(means), np.nanmax(means)
+    if high - low < 1e-9:
+        # a flat series is drawn in the middle
+        levels = np.full(len(means), len(SPARK_CHARS) // 2 - 1)
+    else:
+        levels = np.round((np.nan_to_num(means, nan=low) - low) / (high - low) * (len(SPARK_CHARS) - 1)).astype(int)
+    return "".join(SPARK_CHARS[level] if ok else " " for level, ok in zip(levels, valid))
+
+
+def format_trend(columns, hours, now=None, width=TREND_WIDTH, sensor_id=DEFAULT_SENSOR_ID) -> str:
+    """
+    Build the /trend message: for every field of TREND_FIELDS a sparkline followed by
+    the min, max, average and last value of the range, and the change over the range.
+
+    Args:
+        columns (dict of np.ndarray): 'ts' and the fields, see DataBaseHandler.get_hours_fields().
+        hours (float): The range the columns cover.
+        now (float): Epoch seconds where the range ends, defaults to now.
+        width (int): Characters per sparkline.
+        sensor_id (str): Named in the title unless it is the default sensor.
+
+    Returns:
+        str: HTML for Telegram, the table inside a <pre> block.
+    """
+    import numpy as np
+    now = time.time() if now is None else now
+    start = now - float(hours) * 3600
+    title = f"Trend of the last {hours}h" + (f" ({sensor_id})" if sensor_id != DEFAULT_SENSOR_ID else "")
+    lines = []
+    for field, label, unit, decimals in TREND_FIELDS:
+        values = columns[field]
+        valid = ~np.isnan(values)
+        if not valid.any():
+            lines.append(f"{label:<4} no data")
+            continue
+        means = bucket_means(columns["ts"], values, start, now, width)
+        present = means[~np.isnan(means)]
+        change = present[-1] - present[0]
+        arrow = "→" if abs(change) < 0.5 * 10 ** -decimals else ("↑" if change > 0 else "↓")
+        lines.append(f"{label:<4} {sparkline(means)}")
+        lines.append(f"     min {np.nanmin(values):.{decimals}f} max {np.nanmax(values):.{decimals}f} "
+                     f"avg {np.nanmean(values):.{decimals}f} last {values[valid][-1]:.{decimals}f}{unit} "
+                     f"{arrow}{abs(change):.{decimals}f}")
+    return f"<b>{html.escape(title)}</b>\n<pre>{html.escape(chr(10).join(lines))}</pre>"
+
+
+def high_rate_columns(hours, ring_buffer, db, sensor_id=DEFAULT_SENSOR_ID, fields=FIELDS, now=None) -> dict:
+    """
+    Collect the high-rate readings of the last {hours}: the buffered ones straight from the
+    ring buffer, the older ones from the packed blocks in the database.
+
+    Args:
+        hours (float): The range to collect.
+        ring_buffer (SensorRingBuffer): The buffer of `sensor_id`.
+        db (DataBaseHandler): Reads the blocks older than the buffer.
+        sensor_id (str): Sensor of the readings.
+        fields (tuple of str): Fields to return, any of ring_buffer.FIELDS.
+        now (float): Epoch seconds where the range ends, defaults to now.
+
+    Returns:
+        dict of np.ndarray: 'ts' and every field like DataBaseHandler.get_hours_fields(),
+        None if the high-rate readings do not reach back to the start of the range.
+    """
+    import numpy as np
+    now = time.time() if now is None else now
+    start = now - float(hours) * 3600
+    recent = ring_buffer.since(start)
+    until = recent["ts"][0] if len(recent["ts"]) else now
+    older = db.get_sensor_blocks(start, until, sensor_id)
+    # the buffer still holds the readings it already flushed, the blocks are only read up to it
+    keep = older["ts"] < until
+    columns = {name: np.concatenate([older[name][keep], recent[name]]).astype(np.float64)
+               for name in ("ts",) + tuple(fields)}
+    # a missing first bucket means the high-rate recording started within the range
+    if not len(columns["ts"]) or columns["ts"][0] > start + (now - start) / TREND_WIDTH:
+        return None
+    return columns
+
+
+def build_trend(hours, sensor_id=DEFAULT_SENSOR_ID, db_name="sensor_data.db", ring_buffer=None) -> str:
+    """
+    Read the last {hours} of `sensor_id` and format them with format_trend().
+    Only SQLite and NumPy are involved, the message is ready in a few milliseconds.
+    Up to HIGH_RATE_HOURS the high-rate readings are used if `ring_buffer` is given and they cover the range.
+
+    Returns:
+        str: The message, None if there are no readings in the range.
+    """
+    fields = tuple(field for field, *_ in TREND_FIELDS)
+    db = DataBaseHandler(db_name)
+    try:
+        columns = None
+        if ring_buffer is not None and float(hours) <= HIGH_RATE_HOURS:
+            columns = high_rate_columns(hours, ring_buffer, db, sensor_id, fields)
+        if columns is None:
+            columns = db.get_hours_fields(hours, fields, sensor_id)
+    finally:
+        db.close()
+    if not len(columns["ts"]):
+        return None
+    return format_trend(columns, hours, sensor_id=sensor_id)
@@ -0,0 +1,258 @@
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+import ssl
+from urllib.parse import urlsplit
+from telegram import Update
+from telegram.error import TelegramError
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Telegram updates are a few KB, anything much larger is not from Telegram
+MAX_BODY_BYTES = 1024 * 1024
+# seconds a kept-alive connection may stay silent, Telegram reuses its connections
+IDLE_TIMEOUT = 120
+# header carrying the secret_token passed to setWebhook
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class WebhookReceiver:
+
+    """
+    Small HTTP(S) server receiving the updates Telegram POSTs to the webhook.
+
+    Every request must carry the secret token, its update is put on the application's
+    update queue right away, so a command is handled as soon as it arrives. The queue
+    is bounded: when it is full the request is answered 503 and Telegram delivers the
+    update again later, instead of the bot buffering without limit.
+
+    Attributes:
+      path (str): URL path the updates are posted to.
+      port (int): Port actually listened on, known after start().
+    """
+
+    def __init__(self, application, secret_token, path="/", listen="0.0.0.0", port=8443, ssl_context=None):
+        """
+        Args:
+            application (Application): Application whose update_queue receives the updates.
+            secret_token (str): Value of the secret token header expected on every request.
+            path (str): URL path the updates are posted to.
+            listen (str): Address to bind.
+            port (int): Port to bind, 0 for any free port.
+            ssl_context (ssl.SSLContext): Serve HTTPS with it, None for plain HTTP behind a TLS proxy.
+        """
+        self.application = application
+        self.path = path
+        self.listen = listen
+        self.port = port
+        self._secret = secret_token.encode()
+        self._ssl_context = ssl_context
+        self._server = None
+        self._connections = set()
+
+    async def start(self) -> None:
+        """
+        Bind the port and start accepting requests.
+
+        Raises:
+            OSError: If the port cannot be bound.
+        """
+        self._server = await asyncio.start_server(self._serve_connection, self.listen, self.port,
+                                                  ssl=self._ssl_context)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Webhook receiver listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        """
+        Stop accepting requests and close the open connections.
+        """
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+        logger.info("Webhook receiver is closed.")
+
+    async def _serve_connection(self, reader, writer) -> None:
+        self._connections.add(writer)
+        try:
+            # one request after the other on the same connection, as long as the client keeps it
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError):
+                    return
+                keep_alive = await self._serve_request(head, reader, writer)
+                if not keep_alive:
+                    return
+        except (ConnectionError, ssl.SSLError, asyncio.IncompleteReadError):
+            return
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _serve_request(self, head, reader, writer) -> bool:
+        """
+        Answer one request. Returns whether the connection can be reused.
+        """
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+            headers = dict((name.strip().lower(), value.strip())
+                           for name, _, value in (line.partition(":") for line in lines[1:] if line))
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            await self._respond(writer, 400, keep_alive=False)
+            return False
+        if length > MAX_BODY_BYTES:
+            metrics.WEBHOOK_REQUESTS.inc(result="too_large")
+            await self._respond(writer, 413, keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+        if target.split("?")[0] != self.path:
+            status, result = 404, "not_found"
+        elif method != "POST":
+            status, result = 405, "bad_request"
+        elif not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), self._secret):
+            logger.warning("Webhook request with a wrong secret token rejected.")
+            status, result = 403, "forbidden"
+        else:
+            status, result = self._queue_update(body)
+        metrics.WEBHOOK_REQUESTS.inc(result=result)
+        await self._respond(writer, status, keep_alive)
+        return keep_alive
+
+    def _queue_update(self, body) -> tuple:
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Invalid webhook update: {e}")
+            return 400, "bad_request"
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Update queue is full, Telegram will deliver the update again.")
+            return 503, "queue_full"
+        return 200, "queued"
+
+    @staticmethod
+    async def _respond(writer, status, keep_alive) -> None:
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: 0\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode())
+        await writer.drain()
+
+
+async def serve(application, stop, webhook_url=None, listen="0.0.0.0", port=8443, secret_token=None,
+                cert=None, key=None, upload_certificate=False, max_connections=40) -> None:
+    """
+    Run the application until `stop` is set, going through the same steps as
+    Application.run_polling(): post_init, start, stop, post_stop, shutdown, post_shutdown.
+
+    The updates are received on a webhook if `webhook_url` is set. If the receiver cannot be
+    started or Telegram refuses the webhook, the bot falls back to polling, starting the
+    poller deletes the webhook again.
+
+    Args:
+        application (Application): The bot.
+        stop (asyncio.Event): Set to stop the bot.
+        webhook_url (str): Public HTTPS URL Telegram posts to, None to poll.
+        listen (str): Address the receiver binds.
+        port (int): Port the receiver binds, it may differ from the public one behind a proxy.
+        secret_token (str): Token Telegram sends with every update, a random one if None.
+        cert (str): PEM certificate file, the receiver serves HTTPS with it and `key`.
+        key (str): PEM private key file of `cert`.
+        upload_certificate (bool): Send `cert` to Telegram, needed for a self-signed certificate.
+        max_connections (int): Connections Telegram may open to deliver updates in parallel.
+    """
+    receiver = None
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        if webhook_url:
+            receiver = await _start_webhook(application, webhook_url, listen, port, secret_token, cert, key,
+                                            upload_certificate, max_connections)
+        if receiver is None:
+            await application.updater.start_polling()
+            logger.info("Receiving updates by polling.")
+        await application.start()
+        await stop.wait()
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        if receiver is not None:
+            await receiver.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def _start_webhook(application, webhook_url, listen, port, secret_token, cert, key,
+                         upload_certificate, max_connections) -> WebhookReceiver:
+    """
+    Start the receiver and register it with Telegram.
+
+    Returns:
+        WebhookReceiver: The running receiver, None if the webhook could not be set up.
+    """
+    secret_token = secret_token or secrets.token_urlsafe(32)
+    ssl_context = None
+    try:
+        if cert:
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(cert, key)
+        receiver = WebhookReceiver(application, secret_token, urlsplit(webhook_url).path or "/",
+                                   listen, port, ssl_context)
+        await receiver.start()
+    except (OSError, ssl.SSLError) as e:
+        logger.error(f"Webhook receiver could not be started, falling back to polling: {e}")
+        return None
+    try:
+        certificate = open(cert, "rb") if cert and upload_certificate else None
+        try:
+            await application.bot.set_webhook(webhook_url, certificate=certificate, secret_token=secret_token,
+                                              max_connections=max_connections,
+                                              allowed_updates=Update.ALL_TYPES)
+        finally:
+            if certificate is not None:
+                certificate.close()
+    except (TelegramError, OSError) as e:
+        logger.error(f"Telegram refused the webhook, falling back to polling: {e}")
+        await receiver.stop()
+        return None
+    logger.info(f"Receiving updates on the webhook {webhook_url}")
+    return receiver
+
+
+def run(application, **options) -> None:
+    """
+    Run the application until SIGINT or SIGTERM, like Application.run_polling().
+
+    Args:
+        application (Application): The bot.
+        **options: Passed to serve(), e.g. webhook_url.
+    """
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await serve(application, stop, **options)
+
+    asyncio.run(main())